@@ -0,0 +1,157 @@
+# standard libraries
+import json, logging, os, queue, threading, time
+from json.decoder import JSONDecodeError
+from typing import Any, Dict, Iterator, List, Sequence, Union
+
+# local libraries
+from environ import DATA_DIR, ENV
+
+
+# Initialize settings and global variables
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_INTERVAL: float = ENV.get('CHECKPOINT_INTERVAL', 10.0)
+
+
+# Class(es)
+
+class CheckpointError(Exception):
+    '''
+    Raised in a gatherer when the background thread could not write its checkpoint.
+    '''
+    pass
+
+
+class Checkpoint:
+    '''
+    Saves a gatherer's progress as it goes to an append-only file of JSON lines, so a run that is
+    interrupted can resume without repeating finished work. Records are handed to a background
+    thread, which writes them and flushes the file to disk every CHECKPOINT_INTERVAL seconds,
+    so the fetch loop never waits on the disk. If writing fails, the error is raised as a
+    CheckpointError by the next call to append, or when the context is exited. Use it as a context
+    manager.
+
+    Unless resume is True, any existing checkpoint for the stage is discarded when it is opened. When
+    resuming, a partially written last line (e.g. from a killed process) is cut off before new records
+    are appended, so it can't run into the first of them.
+    '''
+
+    def __init__(self, stage_name: str, resume: bool = False, interval: float = CHECKPOINT_INTERVAL) -> None:
+        self.stage_name: str = stage_name
+        self.resume: bool = resume
+        self.interval: float = interval
+        self.records: queue.Queue = queue.Queue()
+        self.writer_thread: Union[threading.Thread, None] = None
+        self.error: Union[Exception, None] = None
+
+    def get_path(self) -> str:
+        return os.path.join(DATA_DIR, f'checkpoint_{self.stage_name}.jsonl')
+
+    def iterate(self) -> Iterator[Dict[str, Any]]:
+        '''
+        Yields the records saved by an earlier run if resuming, one at a time, so they don't all need
+        to be held in memory. A partially written last line (e.g. from a killed process) is skipped.
+        '''
+        if not self.resume:
+            return
+        num_records = 0
+        try:
+            with open(self.get_path()) as checkpoint_file:
+                for line in checkpoint_file:
+                    try:
+                        record = json.loads(line)
+                    except JSONDecodeError:
+                        logger.warning(f'Skipping an incomplete record in the {self.stage_name} checkpoint')
+                        continue
+                    num_records += 1
+                    yield record
+        except FileNotFoundError:
+            logger.info(f'No checkpoint was found for stage {self.stage_name}')
+        logger.info(f'Loaded {num_records} records from the {self.stage_name} checkpoint')
+
+    def load(self) -> List[Dict[str, Any]]:
+        '''
+        Returns the records saved by an earlier run if resuming, or an empty list otherwise.
+        '''
+        return list(self.iterate())
+
+    def raise_error(self) -> None:
+        if self.error is not None:
+            raise CheckpointError(
+                f'The {self.stage_name} checkpoint could not be written: {self.error}'
+            ) from self.error
+
+    def append(self, record: Dict[str, Any]) -> None:
+        self.raise_error()
+        self.records.put(record)
+
+    def truncate_partial_line(self) -> None:
+        '''
+        Cuts the checkpoint file off after its last complete line, if it exists.
+        '''
+        try:
+            with open(self.get_path(), 'rb+') as checkpoint_file:
+                content = checkpoint_file.read()
+                end = content.rfind(b'\n') + 1
+                if end < len(content):
+                    logger.warning(f'Removing an incomplete record from the end of the {self.stage_name} checkpoint')
+                    checkpoint_file.truncate(end)
+        except FileNotFoundError:
+            pass
+
+    def write_records(self) -> None:
+        try:
+            self._write_records()
+        except Exception as e:
+            logger.error(f'The {self.stage_name} checkpoint could not be written: {e}')
+            self.error = e
+
+    def _write_records(self) -> None:
+        if self.resume:
+            self.truncate_partial_line()
+        mode = 'a' if self.resume else 'w'
+        with open(self.get_path(), mode) as checkpoint_file:
+            last_flushed_at = time.time()
+            finished = False
+            while not finished:
+                try:
+                    record = self.records.get(timeout=self.interval)
+                    if record is None:
+                        finished = True
+                    else:
+                        checkpoint_file.write(json.dumps(record) + '\n')
+                except queue.Empty:
+                    pass
+                if finished or time.time() - last_flushed_at >= self.interval:
+                    checkpoint_file.flush()
+                    os.fsync(checkpoint_file.fileno())
+                    last_flushed_at = time.time()
+
+    def __enter__(self) -> 'Checkpoint':
+        self.writer_thread = threading.Thread(target=self.write_records, daemon=True)
+        self.writer_thread.start()
+        return self
+
+    def __exit__(self, exc_type, *args) -> None:
+        # None tells the writer thread to write what is left and stop
+        self.records.put(None)
+        if self.writer_thread is not None:
+            self.writer_thread.join()
+        # The gatherer's own error is the one worth raising
+        if exc_type is None:
+            self.raise_error()
+
+
+# Function(s)
+
+def clear_checkpoints(stage_names: Sequence[str]) -> None:
+    '''
+    Removes checkpoints once the data they cover has been stored, so a later resume starts fresh.
+    '''
+    for stage_name in stage_names:
+        try:
+            os.remove(Checkpoint(stage_name).get_path())
+            logger.info(f'Removed the checkpoint for stage {stage_name}')
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,167 @@
+# standard libraries
+import logging, threading, time
+from typing import Any, Dict, Union
+
+# third-party libraries
+from requests import Response
+
+# local libraries
+from environ import ENV
+from job_metadata import record_metric
+
+
+# Initialize settings and global variables
+
+logger = logging.getLogger(__name__)
+
+CONCURRENCY_CONFIG: Dict[str, Any] = ENV.get('ADAPTIVE_CONCURRENCY', {})
+
+# NUM_ASYNC_WORKERS is now only the starting point; each endpoint class adapts from there.
+INITIAL_LIMIT: int = ENV.get('NUM_ASYNC_WORKERS', 8)
+MIN_LIMIT: int = CONCURRENCY_CONFIG.get('MIN_LIMIT', 1)
+MAX_LIMIT: int = CONCURRENCY_CONFIG.get('MAX_LIMIT', 32)
+DECREASE_FACTOR: float = CONCURRENCY_CONFIG.get('DECREASE_FACTOR', 0.5)
+BUDGET_FLOOR: float = CONCURRENCY_CONFIG.get('BUDGET_FLOOR', 200.0)
+LATENCY_TARGETS: Dict[str, float] = {
+    'graphql': 5.0,
+    'audit': 5.0,
+    'analytics': 10.0,
+    'rest': 5.0
+}
+LATENCY_TARGETS.update(CONCURRENCY_CONFIG.get('LATENCY_TARGETS', {}))
+
+THROTTLE_STATUS_CODES = [403, 429]
+
+
+# Class(es)
+
+class AdaptiveConcurrencyController:
+    '''
+    Limits the number of in-flight requests for one class of endpoint, adjusting the limit with an
+    additive-increase/multiplicative-decrease (AIMD) policy. The limit grows by roughly one for every
+    limit's worth of healthy responses and is cut by DECREASE_FACTOR when a response is throttled,
+    slower than the latency target, or reports a rate-limit budget below the floor. Decreases are
+    applied at most once per latency target so that one burst of slow responses only counts once.
+    '''
+
+    def __init__(
+        self,
+        name: str,
+        initial_limit: int = INITIAL_LIMIT,
+        min_limit: int = MIN_LIMIT,
+        max_limit: int = MAX_LIMIT,
+        latency_target: float = 5.0,
+        budget_floor: float = BUDGET_FLOOR,
+        decrease_factor: float = DECREASE_FACTOR
+    ) -> None:
+        self.name: str = name
+        self.min_limit: int = min_limit
+        self.max_limit: int = max(max_limit, min_limit)
+        self.limit: float = float(min(max(initial_limit, min_limit), self.max_limit))
+        self.latency_target: float = latency_target
+        self.budget_floor: float = budget_floor
+        self.decrease_factor: float = decrease_factor
+
+        self.in_flight: int = 0
+        self.max_in_flight: int = 0
+        self.num_increases: int = 0
+        self.num_decreases: int = 0
+        self.last_decrease_at: float = 0.0
+        self.condition: threading.Condition = threading.Condition()
+
+    def acquire(self) -> float:
+        '''
+        Blocks until a request slot is available; returns the time the slot was acquired.
+        '''
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        return time.time()
+
+    def is_congested(self, latency: float, response: Union[Response, None]) -> bool:
+        if response is None:
+            # Connection errors and timeouts
+            return True
+        if response.status_code in THROTTLE_STATUS_CODES:
+            # Canvas signals throttling with 403 Forbidden (Rate Limit Exceeded)
+            if response.status_code == 429 or 'Rate Limit Exceeded' in response.text:
+                return True
+        if latency > self.latency_target:
+            return True
+        remaining_str = response.headers.get('X-Rate-Limit-Remaining')
+        if remaining_str is not None:
+            try:
+                if float(remaining_str) < self.budget_floor:
+                    return True
+            except ValueError:
+                pass
+        return False
+
+    def release(self, acquired_at: float, response: Union[Response, None]) -> None:
+        '''
+        Frees the request slot and adjusts the limit using the response (None if the request failed).
+        '''
+        now = time.time()
+        latency = now - acquired_at
+        congested = self.is_congested(latency, response)
+        with self.condition:
+            self.in_flight -= 1
+            if congested:
+                if now - self.last_decrease_at > self.latency_target:
+                    self.limit = max(float(self.min_limit), self.limit * self.decrease_factor)
+                    self.last_decrease_at = now
+                    self.num_decreases += 1
+                    logger.debug(f'Decreased {self.name} concurrency limit to {int(self.limit)}')
+            elif self.limit < self.max_limit:
+                self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+                self.num_increases += 1
+            self.condition.notify_all()
+
+    def record_metrics(self) -> None:
+        logger.info(
+            f'Concurrency for {self.name} requests settled at {int(self.limit)} '
+            f'(max in flight: {self.max_in_flight}; decreases: {self.num_decreases})'
+        )
+        record_metric(f'concurrency_{self.name}_settled_limit', int(self.limit))
+        record_metric(f'concurrency_{self.name}_max_in_flight', self.max_in_flight)
+        record_metric(f'concurrency_{self.name}_num_decreases', self.num_decreases)
+
+
+# Function(s)
+
+CONTROLLERS: Dict[str, AdaptiveConcurrencyController] = {}
+CONTROLLERS_LOCK = threading.Lock()
+
+
+def classify_url(url: str) -> str:
+    '''
+    Maps a request URL to the endpoint class whose concurrency controller should govern it.
+    '''
+    if '/api/graphql' in url:
+        return 'graphql'
+    if '/audit/' in url:
+        return 'audit'
+    if '/analytics/' in url:
+        return 'analytics'
+    return 'rest'
+
+
+def get_controller(endpoint_class: str) -> AdaptiveConcurrencyController:
+    with CONTROLLERS_LOCK:
+        if endpoint_class not in CONTROLLERS:
+            CONTROLLERS[endpoint_class] = AdaptiveConcurrencyController(
+                endpoint_class, latency_target=LATENCY_TARGETS.get(endpoint_class, 5.0)
+            )
+        return CONTROLLERS[endpoint_class]
+
+
+def record_concurrency_metrics() -> None:
+    '''
+    Records the limit each endpoint class settled on as job run metrics.
+    '''
+    with CONTROLLERS_LOCK:
+        controllers = list(CONTROLLERS.values())
+    for controller in controllers:
+        controller.record_metrics()
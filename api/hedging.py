@@ -0,0 +1,241 @@
+# standard libraries
+import heapq, itertools, logging, threading, time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, List, Tuple, Union
+
+# local libraries
+from api.concurrency import AdaptiveConcurrencyController, get_controller
+from environ import ENV
+from job_metadata import record_metric
+
+
+# Initialize settings and global variables
+
+logger = logging.getLogger(__name__)
+
+HEDGING_CONFIG: Dict[str, Any] = ENV.get('REQUEST_HEDGING', {})
+
+# Hedging is off unless an endpoint class is listed here
+HEDGED_CLASSES: List[str] = HEDGING_CONFIG.get('ENDPOINT_CLASSES', [])
+# A duplicate is sent once a request has taken longer than this percentile of recent response times
+PERCENTILE: float = HEDGING_CONFIG.get('PERCENTILE', 95.0)
+MIN_DELAY: float = HEDGING_CONFIG.get('MIN_DELAY', 1.0)
+# Hedging waits until enough response times have been seen to estimate the percentile
+MIN_SAMPLES: int = HEDGING_CONFIG.get('MIN_SAMPLES', 20)
+NUM_SAMPLES: int = 500
+# Duplicates may add at most this fraction to the number of requests sent for an endpoint class
+MAX_RATIO: float = HEDGING_CONFIG.get('MAX_RATIO', 0.05)
+
+
+# Class(es)
+
+class HedgeTimer:
+    '''
+    Runs callbacks after a delay on a single background thread, so a timer doesn't need a thread
+    per request.
+    '''
+
+    def __init__(self) -> None:
+        # Heap of (due_at, sequence number, callback); the sequence number keeps callbacks from being compared
+        self.callbacks: List[Tuple[float, int, Callable[[], None]]] = []
+        self.sequence = itertools.count()
+        self.condition: threading.Condition = threading.Condition()
+        self.thread: threading.Thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def schedule(self, delay: float, callback: Callable[[], None]) -> None:
+        with self.condition:
+            heapq.heappush(self.callbacks, (time.time() + delay, next(self.sequence), callback))
+            self.condition.notify()
+
+    def run(self) -> None:
+        while True:
+            with self.condition:
+                while len(self.callbacks) == 0 or self.callbacks[0][0] > time.time():
+                    timeout = None if len(self.callbacks) == 0 else self.callbacks[0][0] - time.time()
+                    self.condition.wait(timeout)
+                callback = heapq.heappop(self.callbacks)[2]
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f'A hedged request could not be sent: {e}')
+
+
+class RequestHedger:
+    '''
+    Hedges idempotent requests for one class of endpoint: if a request hasn't answered within the
+    PERCENTILE of recent response times (but at least MIN_DELAY seconds), a duplicate is sent, and
+    whichever answers first is used. The other is cancelled if it hasn't started; one that is already
+    on the wire is left to finish and ignored. Duplicates are capped at MAX_RATIO of the requests
+    sent, so hedging can't add much load when the endpoint is slow across the board.
+
+    Response times are taken from the responses themselves (the time on the wire), so waiting in the
+    local executor queue or for a concurrency slot doesn't count. For the same reason, no duplicate is
+    sent while the endpoint class's concurrency controller has no free slot: the slowness is then local
+    queueing, and a duplicate would only wait in the same queue.
+    '''
+
+    def __init__(
+        self,
+        name: str,
+        enabled: bool,
+        timer: HedgeTimer,
+        controller: Union[AdaptiveConcurrencyController, None] = None,
+        percentile: float = PERCENTILE,
+        min_delay: float = MIN_DELAY,
+        min_samples: int = MIN_SAMPLES,
+        max_ratio: float = MAX_RATIO
+    ) -> None:
+        self.name: str = name
+        self.enabled: bool = enabled
+        self.timer: HedgeTimer = timer
+        self.controller: Union[AdaptiveConcurrencyController, None] = controller
+        self.percentile: float = percentile
+        self.min_delay: float = min_delay
+        self.min_samples: int = min_samples
+        self.max_ratio: float = max_ratio
+
+        self.latencies: Deque[float] = deque(maxlen=NUM_SAMPLES)
+        self.num_requests: int = 0
+        self.num_hedges: int = 0
+        self.num_hedge_wins: int = 0
+        self.latency_saved: float = 0.0
+        self.lock: threading.Lock = threading.Lock()
+
+    def get_threshold(self) -> Union[float, None]:
+        with self.lock:
+            if len(self.latencies) < self.min_samples:
+                return None
+            latencies = sorted(self.latencies)
+        index = min(int(len(latencies) * self.percentile / 100), len(latencies) - 1)
+        return max(latencies[index], self.min_delay)
+
+    def record_latency(self, future: Future) -> None:
+        if future.cancelled() or future.exception() is not None:
+            return
+        elapsed = getattr(future.result(), 'elapsed', None)
+        if elapsed is None:
+            return
+        with self.lock:
+            self.latencies.append(elapsed.total_seconds())
+
+    def has_free_slot(self) -> bool:
+        if self.controller is None:
+            return True
+        with self.controller.condition:
+            return self.controller.in_flight < int(self.controller.limit)
+
+    def reserve_hedge(self) -> bool:
+        if not self.has_free_slot():
+            logger.debug(f'Not hedging a {self.name} request while all of its concurrency slots are taken')
+            return False
+        with self.lock:
+            if self.num_hedges + 1 > self.max_ratio * self.num_requests:
+                return False
+            self.num_hedges += 1
+            return True
+
+    def send(self, make_request: Callable[[], Future]) -> Future:
+        '''
+        Sends a request using make_request, which must return a Future, and returns a Future for the
+        first response. Without hedging, the request's own Future is returned.
+        '''
+        with self.lock:
+            self.num_requests += 1
+        threshold = self.get_threshold() if self.enabled else None
+        primary = make_request()
+        primary.add_done_callback(self.record_latency)
+        if threshold is None:
+            return primary
+
+        outcome: Future = Future()
+        attempts = [primary]
+        attempts_lock = threading.Lock()
+
+        def settle(future: Future) -> None:
+            with attempts_lock:
+                if outcome.done():
+                    return
+                # A failed attempt only settles the outcome if nothing else is still in flight
+                if future.exception() is not None and any(not attempt.done() for attempt in attempts):
+                    return
+                if future.exception() is not None:
+                    outcome.set_exception(future.exception())
+                else:
+                    outcome.set_result(future.result())
+                losers = [attempt for attempt in attempts if attempt is not future]
+            for loser in losers:
+                loser.cancel()
+            if future is not primary:
+                with self.lock:
+                    self.num_hedge_wins += 1
+                # The primary's own response time shows how much waiting the hedge saved
+                hedge_won_at = time.time()
+                primary.add_done_callback(lambda primary_future: self.record_saving(primary_future, hedge_won_at))
+
+        def hedge() -> None:
+            with attempts_lock:
+                if outcome.done() or not self.reserve_hedge():
+                    return
+            logger.debug(f'Hedging a {self.name} request after {threshold:.1f} seconds')
+            duplicate = make_request()
+            with attempts_lock:
+                attempts.append(duplicate)
+                settled = outcome.done()
+            if settled:
+                duplicate.cancel()
+            duplicate.add_done_callback(settle)
+
+        primary.add_done_callback(settle)
+        self.timer.schedule(threshold, hedge)
+        return outcome
+
+    def record_saving(self, primary: Future, hedge_won_at: float) -> None:
+        if primary.cancelled():
+            return
+        with self.lock:
+            self.latency_saved += max(time.time() - hedge_won_at, 0.0)
+
+    def record_metrics(self) -> None:
+        if not self.enabled:
+            return
+        logger.info(
+            f'Hedged {self.num_hedges} of {self.num_requests} {self.name} requests '
+            f'(hedges answered first: {self.num_hedge_wins}; seconds saved: {self.latency_saved:.1f})'
+        )
+        record_metric(f'hedges_{self.name}', self.num_hedges)
+        record_metric(f'hedge_wins_{self.name}', self.num_hedge_wins)
+        record_metric(f'hedge_{self.name}_seconds_saved', self.latency_saved)
+
+
+# Function(s)
+
+HEDGERS: Dict[str, RequestHedger] = {}
+HEDGERS_LOCK = threading.Lock()
+HEDGE_TIMER: Union[HedgeTimer, None] = None
+
+
+def get_hedger(endpoint_class: str) -> RequestHedger:
+    global HEDGE_TIMER
+    with HEDGERS_LOCK:
+        if endpoint_class not in HEDGERS:
+            if HEDGE_TIMER is None:
+                HEDGE_TIMER = HedgeTimer()
+            HEDGERS[endpoint_class] = RequestHedger(
+                endpoint_class,
+                enabled=endpoint_class in HEDGED_CLASSES,
+                timer=HEDGE_TIMER,
+                controller=get_controller(endpoint_class)
+            )
+        return HEDGERS[endpoint_class]
+
+
+def record_hedging_metrics() -> None:
+    '''
+    Records how many requests were hedged for each endpoint class, and how much waiting was saved.
+    '''
+    with HEDGERS_LOCK:
+        hedgers = list(HEDGERS.values())
+    for hedger in hedgers:
+        hedger.record_metrics()
@@ -0,0 +1,92 @@
+# standard libraries
+import logging, threading, time
+from typing import Union
+
+# local libraries
+from environ import ENV
+
+
+# Initialize settings and global variables
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_LOG_INTERVAL: float = ENV.get('PROGRESS_LOG_INTERVAL', 30.0)
+
+
+# Class(es)
+
+class ProgressTracker:
+    '''
+    Keeps constant-time counters for a gathering process (items started, completed, and failed, plus
+    pages, bytes, and requests) and logs a summary with throughput and an estimated time remaining
+    from a background timer, rather than logging once per item. Use it as a context manager; a final
+    summary is logged on exit.
+    '''
+
+    def __init__(self, name: str, total: Union[int, None] = None, interval: float = PROGRESS_LOG_INTERVAL) -> None:
+        self.name: str = name
+        self.total: Union[int, None] = total
+        self.interval: float = interval
+
+        self.num_started: int = 0
+        self.num_completed: int = 0
+        self.num_failed: int = 0
+        self.num_pages: int = 0
+        self.num_bytes: int = 0
+        self.num_requests: int = 0
+
+        self.started_at: float = time.time()
+        self.lock: threading.Lock = threading.Lock()
+        self.stopped: threading.Event = threading.Event()
+        self.timer_thread: Union[threading.Thread, None] = None
+
+    def __enter__(self) -> 'ProgressTracker':
+        self.started_at = time.time()
+        self.timer_thread = threading.Thread(target=self.log_on_timer, daemon=True)
+        self.timer_thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.stopped.set()
+        if self.timer_thread is not None:
+            self.timer_thread.join()
+        self.log_summary()
+
+    def log_on_timer(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.log_summary()
+
+    def start_item(self) -> None:
+        with self.lock:
+            self.num_started += 1
+
+    def complete_item(self) -> None:
+        with self.lock:
+            self.num_completed += 1
+
+    def fail_item(self) -> None:
+        with self.lock:
+            self.num_failed += 1
+
+    def record_request(self, num_bytes: int = 0) -> None:
+        with self.lock:
+            self.num_requests += 1
+            self.num_bytes += num_bytes
+
+    def record_page(self) -> None:
+        with self.lock:
+            self.num_pages += 1
+
+    def log_summary(self) -> None:
+        with self.lock:
+            elapsed = max(time.time() - self.started_at, 0.001)
+            num_finished = self.num_completed + self.num_failed
+            summary = (
+                f'{self.name}: {self.num_started} started, {self.num_completed} completed, '
+                f'{self.num_failed} failed; {self.num_pages} pages, {self.num_bytes / 1e6:.1f} MB, '
+                f'{self.num_requests / elapsed:.1f} requests/second'
+            )
+            if self.total is not None and num_finished > 0 and num_finished < self.total:
+                eta_seconds = (self.total - num_finished) * elapsed / num_finished
+                summary += f'; ETA {time.strftime("%H:%M:%S", time.gmtime(eta_seconds))}'
+        logger.info(summary)
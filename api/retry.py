@@ -0,0 +1,207 @@
+# standard libraries
+import logging, random, threading, time
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, List, Union
+
+# third-party libraries
+from requests import Response
+
+# local libraries
+from environ import ENV
+from job_metadata import record_metric
+
+
+# Initialize settings and global variables
+
+logger = logging.getLogger(__name__)
+
+RETRY_CONFIG: Dict[str, Any] = ENV.get('RETRY_POLICY', {})
+
+# Statuses worth retrying; Canvas also signals throttling with 403 Forbidden (Rate Limit Exceeded)
+RETRY_STATUS_CODES: List[int] = RETRY_CONFIG.get('RETRY_STATUS_CODES', [429, 500, 502, 503, 504])
+BASE_DELAY: float = RETRY_CONFIG.get('BASE_DELAY', 1.0)
+MAX_DELAY: float = RETRY_CONFIG.get('MAX_DELAY', 60.0)
+# A run may spend at most BUDGET_MIN retries plus BUDGET_RATIO retries per request made
+BUDGET_MIN: int = RETRY_CONFIG.get('BUDGET_MIN', 20)
+BUDGET_RATIO: float = RETRY_CONFIG.get('BUDGET_RATIO', 0.1)
+# After BREAKER_THRESHOLD consecutive failures, requests for the endpoint class pause for BREAKER_COOLDOWN seconds
+BREAKER_THRESHOLD: int = RETRY_CONFIG.get('BREAKER_THRESHOLD', 5)
+BREAKER_COOLDOWN: float = RETRY_CONFIG.get('BREAKER_COOLDOWN', 30.0)
+
+
+# Class(es)
+
+class CircuitBreaker:
+    '''
+    Tracks consecutive failures for one class of endpoint. Once BREAKER_THRESHOLD failures occur in a
+    row, the circuit opens and requests wait for BREAKER_COOLDOWN seconds; afterwards requests are let
+    through again, and the next failure re-opens the circuit until a success closes it.
+    '''
+
+    def __init__(self, name: str, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN) -> None:
+        self.name: str = name
+        self.threshold: int = threshold
+        self.cooldown: float = cooldown
+        self.num_consecutive_failures: int = 0
+        self.open_until: float = 0.0
+        self.num_openings: int = 0
+        self.lock: threading.Lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self.lock:
+            delay = self.open_until - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.num_consecutive_failures = 0
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.num_consecutive_failures += 1
+            now = time.time()
+            if self.num_consecutive_failures >= self.threshold and self.open_until <= now:
+                self.open_until = now + self.cooldown
+                self.num_openings += 1
+                logger.warning(
+                    f'Opened the {self.name} circuit for {self.cooldown} seconds after '
+                    f'{self.num_consecutive_failures} consecutive failures'
+                )
+
+
+class RetryEngine:
+    '''
+    Decides whether and when a failed request should be retried, so all gatherers retry the same
+    way: only retryable statuses and errors are retried, delays grow exponentially with full jitter
+    (or follow a Retry-After header), and retries across the run are limited by a budget
+    proportional to the number of requests made. Callers retry the individual failed item after the
+    returned delay rather than starting a new round.
+    '''
+
+    def __init__(
+        self,
+        retry_status_codes: List[int] = RETRY_STATUS_CODES,
+        base_delay: float = BASE_DELAY,
+        max_delay: float = MAX_DELAY,
+        budget_min: int = BUDGET_MIN,
+        budget_ratio: float = BUDGET_RATIO
+    ) -> None:
+        self.retry_status_codes: List[int] = retry_status_codes
+        self.base_delay: float = base_delay
+        self.max_delay: float = max_delay
+        self.budget_min: int = budget_min
+        self.budget_ratio: float = budget_ratio
+
+        self.num_requests: int = 0
+        self.num_retries: Dict[str, int] = {}
+        self.num_budget_exhaustions: int = 0
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.lock: threading.Lock = threading.Lock()
+
+    def get_breaker(self, endpoint_class: str) -> CircuitBreaker:
+        with self.lock:
+            if endpoint_class not in self.breakers:
+                self.breakers[endpoint_class] = CircuitBreaker(endpoint_class)
+            return self.breakers[endpoint_class]
+
+    def is_retryable(self, response: Union[Response, None]) -> bool:
+        if response is None:
+            # Connection errors and timeouts
+            return True
+        if response.status_code in self.retry_status_codes:
+            return True
+        return response.status_code == 403 and 'Rate Limit Exceeded' in response.text
+
+    def record_result(self, endpoint_class: str, response: Union[Response, None]) -> None:
+        '''
+        Counts a request towards the retry budget and updates the endpoint class's circuit breaker.
+        '''
+        with self.lock:
+            self.num_requests += 1
+        breaker = self.get_breaker(endpoint_class)
+        if self.is_retryable(response):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
+    def spend_budget(self, endpoint_class: str) -> bool:
+        with self.lock:
+            budget = self.budget_min + self.budget_ratio * self.num_requests
+            if sum(self.num_retries.values()) >= budget:
+                self.num_budget_exhaustions += 1
+                return False
+            self.num_retries[endpoint_class] = self.num_retries.get(endpoint_class, 0) + 1
+            return True
+
+    @staticmethod
+    def get_retry_after(response: Union[Response, None]) -> Union[float, None]:
+        if response is None:
+            return None
+        retry_after = response.headers.get('Retry-After')
+        if retry_after is None:
+            return None
+        try:
+            return max(float(retry_after), 0.0)
+        except ValueError:
+            pass
+        try:
+            return max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0.0)
+        except (TypeError, ValueError):
+            return None
+
+    def get_retry_delay(
+        self,
+        endpoint_class: str,
+        num_attempts: int,
+        max_attempts: int,
+        response: Union[Response, None] = None,
+        retryable_error: bool = False
+    ) -> Union[float, None]:
+        '''
+        Returns the number of seconds to wait before retrying a request that has been attempted
+        num_attempts times, or None if it should not be retried. The response is None if the request
+        raised an exception; retryable_error marks other retryable failures (e.g. an unparseable body).
+        '''
+        if num_attempts >= max_attempts:
+            return None
+        if not retryable_error and not self.is_retryable(response):
+            return None
+        if not self.spend_budget(endpoint_class):
+            logger.warning(f'The retry budget for this run is spent; not retrying the {endpoint_class} request')
+            return None
+
+        retry_after = self.get_retry_after(response)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        # Full jitter spreads retries out so failed requests don't all return at once
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (num_attempts - 1)))
+
+    def record_metrics(self) -> None:
+        num_retries = dict(self.num_retries)
+        logger.info(
+            f'Retries by endpoint class: {num_retries} (requests: {self.num_requests}; '
+            f'times the budget was spent: {self.num_budget_exhaustions})'
+        )
+        for endpoint_class, num_class_retries in num_retries.items():
+            record_metric(f'retries_{endpoint_class}', num_class_retries)
+        record_metric('retry_budget_exhaustions', self.num_budget_exhaustions)
+        for breaker in list(self.breakers.values()):
+            record_metric(f'circuit_{breaker.name}_openings', breaker.num_openings)
+
+
+# Function(s)
+
+SHARED_RETRY_ENGINE: Union[RetryEngine, None] = None
+SHARED_RETRY_ENGINE_LOCK = threading.Lock()
+
+
+def get_retry_engine() -> RetryEngine:
+    '''
+    Returns the retry engine shared by all gatherers during a run, creating it on first use.
+    '''
+    global SHARED_RETRY_ENGINE
+    with SHARED_RETRY_ENGINE_LOCK:
+        if SHARED_RETRY_ENGINE is None:
+            SHARED_RETRY_ENGINE = RetryEngine()
+        return SHARED_RETRY_ENGINE
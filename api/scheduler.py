@@ -0,0 +1,267 @@
+# standard libraries
+import heapq, itertools, json, logging, os, threading, time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from json.decoder import JSONDecodeError
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, NamedTuple, Sequence, Tuple, Union
+
+# local libraries
+from environ import DATA_DIR
+from job_metadata import record_metric
+
+
+# Initialize settings and global variables
+
+logger = logging.getLogger(__name__)
+
+
+# Class(es)
+
+class DelayedItem(NamedTuple):
+    '''
+    A follow-up item that should not be sent until delay seconds have passed (e.g. a retry after backoff).
+    '''
+    item: Any
+    delay: float
+
+
+class WorkFeed:
+    '''
+    A queue of work items that arrive over time (e.g. course IDs as course pages are listed), so a
+    stage can start before the stage feeding it has finished. The producer puts batches of items and
+    closes the feed when there will be no more. Consumers either pass the feed to
+    WorkQueueScheduler.run, or iterate over it to receive batches as they arrive.
+    '''
+
+    def __init__(self) -> None:
+        self.items: Deque[Any] = deque()
+        self.closed: bool = False
+        self.lock: threading.Lock = threading.Lock()
+        # Completed whenever items are put or the feed is closed, so a consumer can wait on it with other futures
+        self.signal: Future = Future()
+
+    def put(self, items: Iterable[Any]) -> None:
+        with self.lock:
+            self.items.extend(items)
+            if not self.signal.done():
+                self.signal.set_result(None)
+
+    def close(self) -> None:
+        with self.lock:
+            self.closed = True
+            if not self.signal.done():
+                self.signal.set_result(None)
+
+    def take(self) -> Tuple[List[Any], bool]:
+        '''
+        Returns the items put since the last call without waiting, and whether the feed is closed.
+        '''
+        with self.lock:
+            items = list(self.items)
+            self.items.clear()
+            if not self.closed and self.signal.done():
+                self.signal = Future()
+            return (items, self.closed)
+
+    def __iter__(self) -> Iterator[List[Any]]:
+        closed = False
+        while not closed:
+            self.signal.result()
+            items, closed = self.take()
+            if len(items) > 0:
+                yield items
+
+
+class WorkQueueScheduler:
+    '''
+    Keeps a bounded number of requests in flight and submits follow-up work (e.g. the next page of a
+    paginated resource, or a retry) as soon as the response it depends on has been handled, rather
+    than waiting for a whole round of requests to finish. Follow-up work is placed ahead of work that
+    has not started, so chains of dependent requests progress as quickly as possible.
+
+    send receives a list of up to batch_size items and returns a Future; handle receives the same
+    list and the completed Future and returns any follow-up items. Follow-up items wrapped in
+    DelayedItem are held back until their delay has passed, without blocking other work. If timings
+    are provided, the duration of each request is split evenly among the items it included, so the
+    items' times add up to the time actually spent in requests.
+
+    The initial items may be a WorkFeed, in which case items are sent as they arrive and the run
+    ends once the feed is closed and all work is done. If prepare is given, it receives each
+    arriving list of items and returns the items to send (e.g. after skipping finished work).
+    '''
+
+    def __init__(
+        self,
+        send: Callable[[List[Any]], Future],
+        handle: Callable[[List[Any], Future], Sequence[Any]],
+        get_window: Callable[[], int],
+        batch_size: int = 1,
+        timings: Union['StageTimings', None] = None
+    ) -> None:
+        self.send: Callable[[List[Any]], Future] = send
+        self.handle: Callable[[List[Any], Future], Sequence[Any]] = handle
+        self.get_window: Callable[[], int] = get_window
+        self.batch_size: int = batch_size
+        self.timings: Union[StageTimings, None] = timings
+
+    def submit_batches(self, pending: Deque[Any], in_flight: Dict[Future, Tuple[List[Any], float]]) -> None:
+        window = max(self.get_window(), 1)
+        while len(pending) > 0 and len(in_flight) < window:
+            batch = [pending.popleft() for _ in range(min(self.batch_size, len(pending)))]
+            in_flight[self.send(batch)] = (batch, time.time())
+
+    def run(
+        self,
+        items: Union[Iterable[Any], WorkFeed],
+        prepare: Union[Callable[[List[Any]], List[Any]], None] = None
+    ) -> None:
+        feed: Union[WorkFeed, None] = None
+        if isinstance(items, WorkFeed):
+            feed = items
+            items = []
+        elif prepare is not None:
+            items = prepare(list(items))
+        pending: Deque[Any] = deque(items)
+        in_flight: Dict[Future, Tuple[List[Any], float]] = {}
+        # Heap of (ready_at, sequence number, item); the sequence number keeps items from being compared
+        delayed: List[Tuple[float, int, Any]] = []
+        sequence = itertools.count()
+
+        while True:
+            if feed is not None:
+                new_items, closed = feed.take()
+                pending.extend(prepare(new_items) if prepare is not None and len(new_items) > 0 else new_items)
+                if closed:
+                    feed = None
+            self.submit_batches(pending, in_flight)
+            if len(in_flight) == 0 and len(delayed) == 0 and (feed is None or len(pending) > 0):
+                if len(pending) == 0:
+                    break
+                continue
+
+            timeout = None
+            if len(delayed) > 0:
+                timeout = max(delayed[0][0] - time.time(), 0.0)
+            # New items in the feed wake the scheduler up as well as completed requests
+            waitables = list(in_flight.keys()) + ([feed.signal] if feed is not None else [])
+            if len(waitables) > 0:
+                done, _ = wait(waitables, timeout=timeout, return_when=FIRST_COMPLETED)
+            else:
+                time.sleep(timeout)
+                done = set()
+
+            ready_items = []
+            for future in done:
+                if future not in in_flight:
+                    continue
+                batch, sent_at = in_flight.pop(future)
+                if self.timings is not None and len(batch) > 0:
+                    item_duration = (time.time() - sent_at) / len(batch)
+                    for item in batch:
+                        self.timings.record(item, item_duration)
+                for follow_up_item in self.handle(batch, future):
+                    if isinstance(follow_up_item, DelayedItem) and follow_up_item.delay > 0:
+                        ready_at = time.time() + follow_up_item.delay
+                        heapq.heappush(delayed, (ready_at, next(sequence), follow_up_item.item))
+                    elif isinstance(follow_up_item, DelayedItem):
+                        ready_items.append(follow_up_item.item)
+                    else:
+                        ready_items.append(follow_up_item)
+
+            while len(delayed) > 0 and delayed[0][0] <= time.time():
+                ready_items.append(heapq.heappop(delayed)[2])
+            pending.extendleft(reversed(ready_items))
+
+
+class StageTimings:
+    '''
+    Records how long each item (e.g. a course) spent in requests during a stage, and compares the
+    stage's makespan with its critical-path lower bound: the larger of the longest single item and
+    the total work divided by the concurrency. Timings are saved so the next run can schedule the
+    most expensive items first.
+    '''
+
+    def __init__(self, stage_name: str) -> None:
+        self.stage_name: str = stage_name
+        self.item_durations: Dict[int, float] = {}
+        self.started_at: Union[float, None] = None
+        self.finished_at: Union[float, None] = None
+        self.lock: threading.Lock = threading.Lock()
+
+    def get_path(self) -> str:
+        return os.path.join(DATA_DIR, f'stage_timings_{self.stage_name}.json')
+
+    def start(self) -> None:
+        self.started_at = time.time()
+
+    def finish(self) -> None:
+        self.finished_at = time.time()
+
+    def record(self, item: int, duration: float) -> None:
+        with self.lock:
+            self.item_durations[item] = self.item_durations.get(item, 0.0) + duration
+
+    def load_previous(self) -> Dict[int, float]:
+        try:
+            with open(self.get_path()) as timings_file:
+                previous_timings = json.loads(timings_file.read())
+        except (FileNotFoundError, JSONDecodeError):
+            logger.info(f'No previous timings were found for stage {self.stage_name}')
+            return {}
+        return {int(item): float(duration) for item, duration in previous_timings.items()}
+
+    def save(self) -> None:
+        try:
+            with open(self.get_path(), 'w') as timings_file:
+                timings_file.write(json.dumps(self.item_durations))
+        except OSError as e:
+            logger.warning(f'Timings for stage {self.stage_name} could not be saved: {e}')
+
+    def report(self, concurrency: int) -> None:
+        if self.started_at is None or self.finished_at is None or len(self.item_durations) == 0:
+            return
+        makespan = self.finished_at - self.started_at
+        longest_item = max(self.item_durations.values())
+        total_work = sum(self.item_durations.values())
+        lower_bound = max(longest_item, total_work / max(concurrency, 1))
+        logger.info(
+            f'Stage {self.stage_name}: makespan of {makespan:.1f} seconds; critical-path lower bound '
+            f'of {lower_bound:.1f} seconds (longest item: {longest_item:.1f}; total work: {total_work:.1f}; '
+            f'concurrency: {concurrency})'
+        )
+        record_metric(f'stage_{self.stage_name}_makespan_seconds', makespan)
+        record_metric(f'stage_{self.stage_name}_lower_bound_seconds', lower_bound)
+
+
+# Function(s)
+
+def estimate_costs(
+    item_ids: Sequence[int],
+    item_sizes: Dict[int, int],
+    previous_timings: Dict[int, float]
+) -> Dict[int, float]:
+    '''
+    Estimates each item's cost, preferring its duration in the previous run. Items without a
+    previous duration are estimated from their size, scaled by the median duration per unit of size
+    among items that have both (so the two kinds of estimates are comparable).
+    '''
+    ratios = sorted(
+        previous_timings[item_id] / item_sizes[item_id] for item_id in item_ids
+        if item_id in previous_timings and item_sizes.get(item_id, 0) > 0
+    )
+    scale = ratios[len(ratios) // 2] if len(ratios) > 0 else 1.0
+
+    costs = {}
+    for item_id in item_ids:
+        if item_id in previous_timings:
+            costs[item_id] = previous_timings[item_id]
+        else:
+            costs[item_id] = item_sizes.get(item_id, 0) * scale
+    return costs
+
+
+def order_by_cost(item_ids: Sequence[int], costs: Dict[int, float]) -> List[int]:
+    '''
+    Orders items largest expected cost first; ties keep their original order.
+    '''
+    return sorted(item_ids, key=lambda item_id: costs.get(item_id, 0.0), reverse=True)
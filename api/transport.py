@@ -0,0 +1,219 @@
+# standard libraries
+import logging, threading, time
+from functools import partial
+from typing import Any, Callable, Dict, Set, Union
+from urllib.parse import urlparse
+
+# third-party libraries
+from requests import Response, Session
+from requests.adapters import HTTPAdapter
+from requests_futures.sessions import FuturesSession
+from urllib3.util.request import ACCEPT_ENCODING
+
+# local libraries
+from api.concurrency import classify_url, get_controller
+from api.retry import get_retry_engine
+from environ import ENV
+
+
+# Initialize settings and global variables
+
+logger = logging.getLogger(__name__)
+
+TRANSPORT_CONFIG: Dict[str, Any] = ENV.get('HTTP_TRANSPORT', {})
+
+DEFAULT_POOL_SIZE: int = TRANSPORT_CONFIG.get('DEFAULT_POOL_SIZE', 10)
+HOST_POOL_SIZES: Dict[str, int] = TRANSPORT_CONFIG.get('HOST_POOL_SIZES', {})
+# Canvas throttles requests using a leaky bucket; requests are held back while the estimated
+# X-Rate-Limit-Remaining value is below the floor. The leak rate is in units per second.
+RATE_LIMIT_FLOOR: float = TRANSPORT_CONFIG.get('RATE_LIMIT_FLOOR', 100.0)
+RATE_LIMIT_LEAK_RATE: float = TRANSPORT_CONFIG.get('RATE_LIMIT_LEAK_RATE', 10.0)
+# Only requests to the Canvas host go through the Canvas concurrency controllers, breakers and budgets
+CANVAS_HOST: str = urlparse(ENV.get('CANVAS', {}).get('CANVAS_URL', '')).netloc
+
+RATE_LIMIT_REMAINING_HEADER = 'X-Rate-Limit-Remaining'
+REQUEST_COST_HEADER = 'X-Request-Cost'
+
+
+# Class(es)
+
+class RateLimitBudget:
+    '''
+    Tracks the Canvas rate-limit bucket for a single host using the X-Rate-Limit-Remaining and
+    X-Request-Cost response headers, accounting for what has leaked back since the last response.
+    The next request is expected to cost as much as the last one, so requests are held back until
+    the bucket would stay at or above the floor after paying that cost.
+    '''
+
+    def __init__(self, floor: float, leak_rate: float) -> None:
+        self.floor: float = floor
+        self.leak_rate: float = leak_rate
+        self.remaining: Union[float, None] = None
+        self.last_cost: Union[float, None] = None
+        self.updated_at: float = time.time()
+        self.lock: threading.Lock = threading.Lock()
+
+    def update(self, response: Response) -> None:
+        remaining_str = response.headers.get(RATE_LIMIT_REMAINING_HEADER)
+        cost_str = response.headers.get(REQUEST_COST_HEADER)
+        if remaining_str is None:
+            return
+        with self.lock:
+            try:
+                self.remaining = float(remaining_str)
+                self.last_cost = float(cost_str) if cost_str is not None else None
+                self.updated_at = time.time()
+            except ValueError:
+                logger.debug(f'Could not parse rate-limit headers: {remaining_str}, {cost_str}')
+
+    def get_estimated_remaining(self) -> Union[float, None]:
+        with self.lock:
+            if self.remaining is None:
+                return None
+            return self.remaining + (time.time() - self.updated_at) * self.leak_rate
+
+    def get_delay(self) -> float:
+        estimated_remaining = self.get_estimated_remaining()
+        if estimated_remaining is None:
+            return 0.0
+        with self.lock:
+            expected_cost = self.last_cost if self.last_cost is not None else 0.0
+        shortfall = self.floor + expected_cost - estimated_remaining
+        if shortfall <= 0:
+            return 0.0
+        return shortfall / self.leak_rate
+
+
+class PooledTransport:
+    '''
+    Shared HTTP transport for the application. Sessions created here share keep-alive connection
+    pools (sized per host) and accept compressed responses. Requests to the governed hosts (the Canvas
+    host by default) are also held back when the host's rate-limit budget runs low and passed through
+    the adaptive concurrency controller and circuit breaker for their endpoint class; requests to other
+    hosts (e.g. Zoom) are sent as they are, so they can't throttle or trip those for Canvas.
+    '''
+
+    def __init__(
+        self,
+        default_pool_size: int = DEFAULT_POOL_SIZE,
+        host_pool_sizes: Union[Dict[str, int], None] = None,
+        rate_limit_floor: float = RATE_LIMIT_FLOOR,
+        rate_limit_leak_rate: float = RATE_LIMIT_LEAK_RATE,
+        governed_hosts: Union[Set[str], None] = None
+    ) -> None:
+        if governed_hosts is None:
+            governed_hosts = {CANVAS_HOST} if CANVAS_HOST != '' else set()
+        self.governed_hosts: Set[str] = governed_hosts
+        self.rate_limit_floor: float = rate_limit_floor
+        self.rate_limit_leak_rate: float = rate_limit_leak_rate
+        self.budgets: Dict[str, RateLimitBudget] = {}
+        self.budgets_lock: threading.Lock = threading.Lock()
+
+        # Adapters own the connection pools, so every session mounting them reuses connections
+        self.adapters: Dict[str, HTTPAdapter] = {
+            'https://': HTTPAdapter(pool_maxsize=default_pool_size),
+            'http://': HTTPAdapter(pool_maxsize=default_pool_size)
+        }
+        if host_pool_sizes is None:
+            host_pool_sizes = HOST_POOL_SIZES
+        for host, pool_size in host_pool_sizes.items():
+            host_adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            self.adapters[f'https://{host}/'] = host_adapter
+            self.adapters[f'http://{host}/'] = host_adapter
+
+        self.session: Session = self.new_session()
+
+    def is_governed(self, url: str) -> bool:
+        return urlparse(url).netloc in self.governed_hosts
+
+    def get_budget(self, url: str) -> RateLimitBudget:
+        host = urlparse(url).netloc
+        with self.budgets_lock:
+            if host not in self.budgets:
+                self.budgets[host] = RateLimitBudget(self.rate_limit_floor, self.rate_limit_leak_rate)
+            return self.budgets[host]
+
+    def wait_for_budget(self, url: str) -> None:
+        delay = self.get_budget(url).get_delay()
+        if delay > 0:
+            logger.debug(f'Rate-limit budget is low; waiting {delay:.2f} seconds')
+            time.sleep(delay)
+
+    def send_governed(
+        self,
+        url: str,
+        send_request: Callable[[], Response],
+        endpoint_class: Union[str, None] = None
+    ) -> Response:
+        '''
+        Sends a request with send_request once the endpoint class's circuit breaker is closed, the
+        host's rate-limit budget allows it, and the class's concurrency controller has a slot for it;
+        the result then updates the controller, the breaker, the retry budget, and the rate-limit
+        budget. The endpoint class is found from the URL unless it is given.
+        '''
+        if endpoint_class is None:
+            endpoint_class = classify_url(url)
+        controller = get_controller(endpoint_class)
+        retry_engine = get_retry_engine()
+        retry_engine.get_breaker(endpoint_class).wait()
+        self.wait_for_budget(url)
+        acquired_at = controller.acquire()
+        response = None
+        try:
+            response = send_request()
+            return response
+        finally:
+            controller.release(acquired_at, response)
+            retry_engine.record_result(endpoint_class, response)
+            if response is not None:
+                self.get_budget(url).update(response)
+
+    def new_session(self) -> Session:
+        '''
+        Creates a session with its own cookies and headers that shares the transport's connection
+        pools and rate-limit budgets.
+        '''
+        session = TransportSession(self)
+        session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+        for prefix, adapter in self.adapters.items():
+            session.mount(prefix, adapter)
+        return session
+
+    def futures_session(self, endpoint_class: str) -> FuturesSession:
+        '''
+        Creates a FuturesSession that sends requests using the shared session. The executor is sized
+        to the maximum limit of the endpoint class's concurrency controller, which decides how many
+        of its workers actually have requests in flight.
+        '''
+        max_workers = get_controller(endpoint_class).max_limit
+        return FuturesSession(max_workers=max_workers, session=self.session)
+
+
+class TransportSession(Session):
+
+    def __init__(self, transport: PooledTransport) -> None:
+        super().__init__()
+        self.transport: PooledTransport = transport
+
+    def request(self, method: str, url: str, *args, **kwargs) -> Response:
+        send_request = partial(super().request, method, url, *args, **kwargs)
+        if not self.transport.is_governed(url):
+            return send_request()
+        return self.transport.send_governed(url, send_request)
+
+
+# Function(s)
+
+SHARED_TRANSPORT: Union[PooledTransport, None] = None
+SHARED_TRANSPORT_LOCK = threading.Lock()
+
+
+def get_transport() -> PooledTransport:
+    '''
+    Returns the transport shared by all gatherers during a run, creating it on first use.
+    '''
+    global SHARED_TRANSPORT
+    with SHARED_TRANSPORT_LOCK:
+        if SHARED_TRANSPORT is None:
+            SHARED_TRANSPORT = PooledTransport()
+        return SHARED_TRANSPORT
@@ -0,0 +1,109 @@
+# standard libraries
+import argparse, logging, time
+from typing import Callable, List, Tuple
+
+# third-party libraries
+import numpy as np
+import pandas as pd
+
+# local libraries
+from db.db_creator import DBCreator
+from environ import ENV
+
+# Initializing settings and global variables
+
+logger = logging.getLogger(__name__)
+
+DB_PARAMS = ENV['INVENTORY_DB']
+
+BENCHMARK_TABLE_NAME = 'bulk_load_benchmark'
+
+
+# Function(s)
+
+def make_enrollment_like_df(num_rows: int) -> pd.DataFrame:
+    '''
+    Makes a DataFrame of random records shaped like those in the enrollment table.
+    '''
+    rng = np.random.RandomState(0)
+    return pd.DataFrame({
+        'canvas_id': np.arange(1, num_rows + 1, dtype='int64'),
+        'user_id': rng.randint(1, 500000, num_rows),
+        'course_id': rng.randint(1, 50000, num_rows),
+        'course_section_id': rng.randint(1, 100000, num_rows),
+        'role_type': rng.choice(['StudentEnrollment', 'TeacherEnrollment', 'TaEnrollment'], num_rows),
+        'workflow_state': rng.choice(['active', 'completed', 'inactive'], num_rows),
+        'created_at': pd.to_datetime(rng.randint(1500000000, 1600000000, num_rows), unit='s', utc=True)
+    })
+
+
+def time_load(db_creator_obj: DBCreator, load: Callable[[], None]) -> float:
+    db_creator_obj.engine.execute(f'DELETE FROM {BENCHMARK_TABLE_NAME};')
+    started_at = time.time()
+    load()
+    return time.time() - started_at
+
+
+def run_benchmark(num_rows: int, batch_sizes: List[int]) -> List[Tuple[str, float]]:
+    '''
+    Loads the same records into a scratch table with DataFrame.to_sql and with DBCreator.bulk_load
+    (with and without relaxed checks, for each batch size), and returns the seconds each load took.
+    '''
+    db_creator_obj = DBCreator(DB_PARAMS)
+    df = make_enrollment_like_df(num_rows)
+    db_creator_obj.engine.execute(f'DROP TABLE IF EXISTS {BENCHMARK_TABLE_NAME};')
+    db_creator_obj.engine.execute(f'''
+        CREATE TABLE {BENCHMARK_TABLE_NAME} (
+            canvas_id BIGINT NOT NULL UNIQUE,
+            user_id BIGINT NOT NULL,
+            course_id BIGINT NOT NULL,
+            course_section_id BIGINT NOT NULL,
+            role_type VARCHAR(30) NOT NULL,
+            workflow_state VARCHAR(20) NOT NULL,
+            created_at DATETIME NOT NULL,
+            PRIMARY KEY (canvas_id),
+            INDEX (course_id)
+        ) ENGINE=InnoDB CHARACTER SET utf8mb4;
+    ''')
+
+    results = []
+    try:
+        to_sql_seconds = time_load(
+            db_creator_obj,
+            lambda: df.to_sql(BENCHMARK_TABLE_NAME, db_creator_obj.engine, if_exists='append', index=False)
+        )
+        results.append(('to_sql', to_sql_seconds))
+        for batch_size in batch_sizes:
+            for relax_checks in [False, True]:
+                seconds = time_load(
+                    db_creator_obj,
+                    lambda: db_creator_obj.bulk_load(
+                        BENCHMARK_TABLE_NAME, df, batch_size=batch_size, relax_checks=relax_checks
+                    )
+                )
+                results.append((f'bulk_load (batch_size={batch_size}, relax_checks={relax_checks})', seconds))
+    finally:
+        db_creator_obj.engine.execute(f'DROP TABLE IF EXISTS {BENCHMARK_TABLE_NAME};')
+    return results
+
+
+# Main Program
+
+if __name__ == '__main__':
+    logging.basicConfig(level=ENV.get('LOG_LEVEL', 'DEBUG'))
+    parser = argparse.ArgumentParser(
+        description='Compare DataFrame.to_sql with DBCreator.bulk_load using a scratch table in INVENTORY_DB.'
+    )
+    parser.add_argument('--rows', type=int, default=200000, help='The number of records to load')
+    parser.add_argument(
+        '--batch-sizes', type=int, nargs='+', default=[500, 1000, 5000], help='The bulk_load batch sizes to try'
+    )
+    args = parser.parse_args()
+
+    benchmark_results = run_benchmark(args.rows, args.batch_sizes)
+    baseline_seconds = benchmark_results[0][1]
+    for label, seconds in benchmark_results:
+        logger.info(
+            f'{label}: {seconds:.2f} seconds, {args.rows / seconds:.0f} rows per second, '
+            f'{baseline_seconds / seconds:.1f}x to_sql'
+        )
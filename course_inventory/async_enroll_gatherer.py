@@ -1,50 +1,155 @@
 # standard libraries
-import copy, json, logging
-from typing import Any, Dict, Sequence, Tuple
+import copy, json, logging, math
+from array import array
+from functools import partial
+from typing import Any, Dict, List, Sequence, Tuple, Union
 from json.decoder import JSONDecodeError
 
 # third-party libraries
+import numpy as np
 import pandas as pd
+from concurrent.futures import Future
+from requests.exceptions import RequestException
 from requests_futures.sessions import FuturesSession
-from concurrent.futures import as_completed, Future
 
-
-logger = logging.getLogger(__name__)
+# local libraries
+from api.checkpoint import Checkpoint
+from api.concurrency import AdaptiveConcurrencyController, get_controller
+from api.progress import ProgressTracker
+from api.retry import get_retry_engine
+from api.scheduler import DelayedItem, estimate_costs, order_by_cost, StageTimings, WorkFeed, WorkQueueScheduler
+from api.transport import get_transport
+from course_inventory.gql_queries import build_course_enrollments_batch_query
 
 
-def unnest_enrollment(enroll_dict: Dict) -> Tuple[Dict, ...]:
-    flat_enroll_dict = {
-        'canvas_id': int(enroll_dict['_id']),
-        'user_id': int(enroll_dict['user']['_id']),
-        'course_id': int(enroll_dict['course']['_id']),
-        'course_section_id': int(enroll_dict['section']['_id']),
-        'role_type': enroll_dict['type'],
-        'workflow_state': enroll_dict['state']
-    }
+logger = logging.getLogger(__name__)
 
-    section_data = enroll_dict['section']
-    flat_section_dict = {
-        'canvas_id': int(section_data['_id']),
-        'name': section_data['name'],
-    }
-    return (flat_enroll_dict, flat_section_dict)
+# Canvas caps GraphQL connection page sizes at 100
+MAX_ENROLL_PAGE_SIZE = 100
+# total_students only counts students, so page size hints leave room for teachers, TAs, etc.
+NON_STUDENT_ENROLLMENT_RATIO = 0.1
+MIN_NON_STUDENT_ENROLLMENTS = 10
+
+
+class EnrollmentColumns:
+    """
+    Compact storage for flattened enrollments. IDs are kept in typed integer arrays, and the
+    repetitive role type and workflow state strings are stored once each and referenced by small
+    integer codes. Enrollments are de-duplicated on canvas_id as they are added (the last one wins).
+    """
+
+    def __init__(self) -> None:
+        self.canvas_ids: array = array('q')
+        self.user_ids: array = array('q')
+        self.course_ids: array = array('q')
+        self.course_section_ids: array = array('q')
+        self.role_type_codes: array = array('b')
+        self.workflow_state_codes: array = array('b')
+
+        self.role_types: Dict[str, int] = {}
+        self.workflow_states: Dict[str, int] = {}
+        # Maps canvas_id to row position, for de-duplication
+        self.row_positions: Dict[int, int] = {}
+        self.num_duplicates: int = 0
+
+    def __len__(self) -> int:
+        return len(self.canvas_ids)
+
+    @staticmethod
+    def get_code(categories: Dict[str, int], value: str) -> int:
+        if value not in categories:
+            categories[value] = len(categories)
+        return categories[value]
+
+    @staticmethod
+    def flatten(enroll_dict: Dict[str, Any], course_id: int) -> List[Union[int, str]]:
+        """
+        Returns an enrollment node as a row of canvas_id, user_id, course_id, course_section_id,
+        role_type, and workflow_state.
+        """
+        # Nodes from the lean query omit the course; it comes from the argument instead
+        return [
+            int(enroll_dict['_id']),
+            int(enroll_dict['user']['_id']),
+            int(enroll_dict['course']['_id']) if 'course' in enroll_dict else course_id,
+            int(enroll_dict['section']['_id']),
+            enroll_dict['type'],
+            enroll_dict['state']
+        ]
+
+    def add(self, row: Sequence[Union[int, str]]) -> None:
+        canvas_id, user_id, course_id, course_section_id, role_type, workflow_state = row
+        values = (
+            user_id,
+            course_id,
+            course_section_id,
+            self.get_code(self.role_types, role_type),
+            self.get_code(self.workflow_states, workflow_state)
+        )
+        columns = (
+            self.user_ids, self.course_ids, self.course_section_ids,
+            self.role_type_codes, self.workflow_state_codes
+        )
+
+        if canvas_id in self.row_positions:
+            self.num_duplicates += 1
+            position = self.row_positions[canvas_id]
+            for column, value in zip(columns, values):
+                column[position] = value
+        else:
+            self.row_positions[canvas_id] = len(self.canvas_ids)
+            self.canvas_ids.append(canvas_id)
+            for column, value in zip(columns, values):
+                column.append(value)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        # np.frombuffer views the arrays' memory without converting values to Python objects; the
+        # DataFrame then copies each column once into its own blocks
+        def make_categorical(codes: array, categories: Dict[str, int]) -> pd.Categorical:
+            return pd.Categorical.from_codes(np.frombuffer(codes, dtype=np.int8), categories=list(categories.keys()))
+
+        return pd.DataFrame({
+            'canvas_id': np.frombuffer(self.canvas_ids, dtype=np.int64),
+            'user_id': np.frombuffer(self.user_ids, dtype=np.int64),
+            'course_id': np.frombuffer(self.course_ids, dtype=np.int64),
+            'course_section_id': np.frombuffer(self.course_section_ids, dtype=np.int64),
+            'role_type': make_categorical(self.role_type_codes, self.role_types),
+            'workflow_state': make_categorical(self.workflow_state_codes, self.workflow_states)
+        })
 
 
 class AsyncEnrollGatherer:
 
     def __init__(
         self,
-        course_ids: Sequence[int],
+        course_ids: Union[Sequence[int], WorkFeed],
         access_token: str,
         complete_url: str,
         gql_query: str,
         enroll_page_size: int = 75,
-        num_workers: int = 8
+        max_attempts: int = 3,
+        batch_size: int = 1,
+        page_size_hints: Union[Dict[int, int], None] = None,
+        largest_first: bool = False,
+        lean: bool = False,
+        enrollment_types: Sequence[str] = ('StudentEnrollment', 'TeacherEnrollment'),
+        resume: bool = False
     ):
-        self.course_ids: Sequence[int] = sorted(course_ids)
+        self.timings: StageTimings = StageTimings('enrollments')
         self.complete_url: str = complete_url
         self.gql_query: str = gql_query
-        self.num_workers: int = num_workers
+        self.max_attempts: int = max_attempts
+        # When batch_size is greater than 1, up to that many courses are requested per POST using
+        # aliased course selections; courses with pages left are re-batched with other courses.
+        self.batch_size: int = max(batch_size, 1)
+        self.batch_queries: Dict[int, str] = {}
+        # Maps course IDs to their total number of students, used to size each course's first page
+        self.page_size_hints: Dict[int, int] = page_size_hints if page_size_hints is not None else {}
+
+        # course_ids may be a WorkFeed, in which case courses are gathered as they arrive
+        self.course_ids: Union[Sequence[int], WorkFeed] = course_ids
+        self.previous_timings: Union[Dict[int, float], None] = self.timings.load_previous() if largest_first else None
+        self.controller: AdaptiveConcurrencyController = get_controller('graphql')
         self.default_params: Dict[str, Any] = {
             'access_token': access_token,
             'query': gql_query,
@@ -54,160 +159,311 @@ class AsyncEnrollGatherer:
                 'enrollmentPageCursor': ''
             }
         }
+        # In lean mode, gql_query should be the lean query; section names are gathered separately
+        # from enrollments, and only the given enrollment types are requested.
+        self.lean: bool = lean
+        if lean:
+            self.default_params['variables'].update({
+                'enrollmentTypes': list(enrollment_types),
+                'includeSections': True,
+                'sectionPageCursor': None
+            })
+        self.section_names: Dict[int, str] = {}
+        # Enrollments are flattened into compact columns as each page arrives
+        self.enrollments: EnrollmentColumns = EnrollmentColumns()
 
         # course_enrollments will have this structure
         # {
         #     course_id: {
-        #         'enrollments': [nested_gql_enrollment_dict, ...],
         #         'page_info': {
         #             'endCursor': some_code,
         #             'hasNextPage': some_bool
         #         },
-        #         'num_pages': some_integer
+        #         'num_pages': some_integer,
+        #         'section_page_info': same_as_page_info_or_none (lean mode only)
         #     }
         # }
         self.course_enrollments: Dict[int, Dict[str, Any]] = {}
-
-    def get_complete_course_ids(self) -> Sequence[int]:
-        complete_course_ids = []
-        for course_id in self.course_enrollments.keys():
-            course_enrollment_dict = self.course_enrollments[course_id]
-            if not course_enrollment_dict['page_info']['hasNextPage']:
-                complete_course_ids.append(course_id)
-        return complete_course_ids
-
-    def get_incomplete_course_ids(self) -> Sequence[int]:
-        course_ids = []
-
-        # Get unstarted course_ids
-        for course_id in self.course_ids:
-            if course_id not in self.course_enrollments.keys():
-                course_ids.append(course_id)
-
-        # Get in-progress course ids
-        for course_id in self.course_enrollments.keys():
-            course_enrollment_dict = self.course_enrollments[course_id]
-            if course_enrollment_dict['page_info']['hasNextPage']:
-                course_ids.append(course_id)
-
-        return course_ids
-
-    def parse_enrollment_response(self, future_response: Future) -> None:
+        self.num_failures: Dict[int, int] = {}
+        self.failed_course_ids: List[int] = []
+        self.progress: ProgressTracker = ProgressTracker(
+            'AsyncEnrollGatherer', total=None if isinstance(course_ids, WorkFeed) else len(course_ids)
+        )
+        self.num_resumed_courses: int = 0
+        # Every stored page is checkpointed as its flattened rows and cursors, so a resumed run can
+        # rebuild its state and continue from each course's last cursor
+        self.checkpoint: Checkpoint = Checkpoint('enrollments', resume=resume)
+
+    def has_more_pages(self, course_id: int) -> bool:
+        course_enrollment_dict = self.course_enrollments[course_id]
+        if course_enrollment_dict['page_info']['hasNextPage']:
+            return True
+        section_page_info = course_enrollment_dict.get('section_page_info')
+        return section_page_info is not None and section_page_info['hasNextPage']
+
+    def parse_enrollment_response(self, future_response: Future) -> Union[Dict[str, Any], None]:
         # Check for irregular results
-        problem_encountered = False
-        response = future_response.result()
+        try:
+            response = future_response.result()
+        except RequestException as e:
+            logger.warning(f'Request failed: {e}')
+            return None
+        self.progress.record_request(len(response.content))
 
         status_code = response.status_code
         if status_code != 200:
             logger.warning(f'Received irregular status code: {status_code}')
             logger.debug(response.text)
-            problem_encountered = True
+            return None
+
+        try:
+            response_data = json.loads(response.text)
+        except JSONDecodeError:
+            logger.warning('JSONDecodeError encountered')
+            return None
+
+        if response_data.get('data') is None:
+            logger.warning(f'No data found in response: {response_data.get("errors")}')
+            return None
+        return response_data['data']
+
+    @staticmethod
+    def flatten_course_page(course_id: int, course_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Reduces a course's page of GraphQL data to what is kept from it: enrollment rows, section
+        names, and page info. This is also what gets checkpointed.
+        """
+        enrollments_connection = course_data['enrollmentsConnection']
+        page: Dict[str, Any] = {
+            'course_id': course_id,
+            'enrollments': [],
+            # [section ID, name] pairs, as JSON object keys can't be integers
+            'section_names': [],
+            'page_info': enrollments_connection['pageInfo']
+        }
+        for enrollment_dict in enrollments_connection['nodes']:
+            page['enrollments'].append(EnrollmentColumns.flatten(enrollment_dict, course_id))
+            section_data = enrollment_dict['section']
+            if 'name' in section_data:
+                page['section_names'].append([int(section_data['_id']), section_data['name']])
+
+        sections_connection = course_data.get('sectionsConnection')
+        if sections_connection is not None:
+            for section_dict in sections_connection['nodes']:
+                page['section_names'].append([int(section_dict['_id']), section_dict['name']])
+            page['section_page_info'] = sections_connection['pageInfo']
+        return page
+
+    def store_course_page(self, page: Dict[str, Any]) -> None:
+        course_id = page['course_id']
+        enrollment_page_info = page['page_info']
+        for row in page['enrollments']:
+            self.enrollments.add(row)
+        for section_id, name in page['section_names']:
+            self.section_names[section_id] = name
+
+        self.progress.record_page()
+        if course_id not in self.course_enrollments.keys():
+            self.progress.start_item()
+            # Create new in-progress record
+            self.course_enrollments[course_id] = {
+                'page_info': enrollment_page_info,
+                'num_pages': 1
+            }
+        else:
+            # Update existing in-progress record
+            self.course_enrollments[course_id]['page_info'] = enrollment_page_info
+            self.course_enrollments[course_id]['num_pages'] += 1
+
+        if 'section_page_info' in page:
+            self.course_enrollments[course_id]['section_page_info'] = page['section_page_info']
+
+    def get_page_size(self, course_id: int) -> int:
+        """
+        Sizes a course's first page so small courses finish in one request; large courses, and any
+        course needing more than one page, use the maximum page size.
+        """
+        if course_id in self.course_enrollments.keys():
+            return MAX_ENROLL_PAGE_SIZE
+        if course_id not in self.page_size_hints.keys():
+            return self.default_params['variables']['enrollmentPageSize']
+
+        num_students = self.page_size_hints[course_id]
+        allowance = max(math.ceil(num_students * NON_STUDENT_ENROLLMENT_RATIO), MIN_NON_STUDENT_ENROLLMENTS)
+        return min(num_students + allowance, MAX_ENROLL_PAGE_SIZE)
+
+    def get_course_variables(self, course_id: int) -> Dict[str, Any]:
+        variables = copy.deepcopy(self.default_params['variables'])
+        variables['courseID'] = course_id
+        variables['enrollmentPageSize'] = self.get_page_size(course_id)
+        if course_id in self.course_enrollments.keys():
+            course_enrollment_dict = self.course_enrollments[course_id]
+            enroll_page_info = course_enrollment_dict['page_info']
+            variables['enrollmentPageCursor'] = enroll_page_info['endCursor']
+            if self.lean:
+                # Keep requesting section pages only while the course has more of them
+                section_page_info = course_enrollment_dict.get('section_page_info')
+                variables['includeSections'] = (
+                    section_page_info is not None and section_page_info['hasNextPage']
+                )
+                if variables['includeSections']:
+                    variables['sectionPageCursor'] = section_page_info['endCursor']
+        return variables
+
+    def get_batch_query(self, num_courses: int) -> str:
+        if num_courses not in self.batch_queries.keys():
+            self.batch_queries[num_courses] = build_course_enrollments_batch_query(num_courses, self.lean)
+        return self.batch_queries[num_courses]
+
+    def make_request(self, session: FuturesSession, course_ids: List[int]) -> Future:
+        params = copy.deepcopy(self.default_params)
+        if self.batch_size == 1:
+            params['variables'] = self.get_course_variables(course_ids[0])
         else:
-            try:
-                response_data = json.loads(response.text)
-            except JSONDecodeError:
-                logger.warning('JSONDecodeError encountered')
-                problem_encountered = True
-
-        if problem_encountered:
-            logger.warning('No data will be stored, and the request will be re-tried')
+            # Each course gets an aliased selection with its own numbered variables
+            params['query'] = self.get_batch_query(len(course_ids))
+            params['variables'] = {}
+            for index, course_id in enumerate(course_ids):
+                course_variables = self.get_course_variables(course_id)
+                for name, value in course_variables.items():
+                    params['variables'][f'{name}{index}'] = value
+
+        logger.debug(params['variables'])
+        return session.post(self.complete_url, json=params)
+
+    def handle_response(self, course_ids: List[int], future_response: Future) -> List[Union[int, DelayedItem]]:
+        """
+        Parses a response and returns the IDs of courses that need another request, either for
+        the next page of enrollments or to retry a failed request after a delay. Courses in a
+        batched request succeed or fail individually.
+        """
+        response_data = self.parse_enrollment_response(future_response)
+        # The raw response (None if the request raised) tells the retry engine the status and any Retry-After
+        response = future_response.result() if future_response.exception() is None else None
+        # A 200 response without usable data for a course is worth retrying whatever the status
+        retryable_error = response is not None and response.status_code == 200
+
+        follow_up_course_ids: List[Union[int, DelayedItem]] = []
+        for index, course_id in enumerate(course_ids):
+            course_data = None
+            if response_data is not None:
+                alias = 'course' if self.batch_size == 1 else f'course{index}'
+                course_data = response_data.get(alias)
+
+            if course_data is not None:
+                # Failures are counted per page, so each page gets the full number of attempts
+                self.num_failures.pop(course_id, None)
+                page = self.flatten_course_page(course_id, course_data)
+                self.store_course_page(page)
+                self.checkpoint.append(page)
+                if self.has_more_pages(course_id):
+                    follow_up_course_ids.append(course_id)
+                else:
+                    self.progress.complete_item()
+                continue
+
+            self.num_failures[course_id] = self.num_failures.get(course_id, 0) + 1
+            delay = get_retry_engine().get_retry_delay(
+                'graphql', self.num_failures[course_id], self.max_attempts,
+                response=response, retryable_error=retryable_error
+            )
+            if delay is not None:
+                logger.info(
+                    f'Retrying request for course {course_id} in {delay:.1f} seconds '
+                    f'(failures: {self.num_failures[course_id]})'
+                )
+                follow_up_course_ids.append(DelayedItem(course_id, delay))
+            else:
+                logger.warning(
+                    f'Course {course_id} could not be processed after {self.num_failures[course_id]} attempts'
+                )
+                self.failed_course_ids.append(course_id)
+                self.progress.fail_item()
+        return follow_up_course_ids
+
+    def restore_checkpoint(self) -> None:
+        """
+        Replays the pages saved by an interrupted run, so courses continue from their last cursor.
+        """
+        for page in self.checkpoint.iterate():
+            # Checkpoints written before pages were flattened hold the raw course data
+            if 'course_data' in page:
+                page = self.flatten_course_page(page['course_id'], page['course_data'])
+            self.store_course_page(page)
+
+    def prepare_courses(self, course_ids: List[int]) -> List[int]:
+        """
+        Orders courses for scheduling and returns those that still need requests, skipping courses
+        finished by an interrupted run. Called with each list of courses as it arrives.
+        """
+        if self.previous_timings is not None:
+            # Courses with the longest chains of pages start first so they don't set the makespan
+            course_costs = estimate_costs(course_ids, self.page_size_hints, self.previous_timings)
+            course_ids = order_by_cost(course_ids, course_costs)
         else:
-            response_course_id = int(response_data['data']['course']['_id'])
-
-            enrollments_connection = response_data['data']['course']['enrollmentsConnection']
-            enrollment_dicts = enrollments_connection['nodes']
-            enrollment_page_info = enrollments_connection['pageInfo']
-
-            if response_course_id not in self.course_enrollments.keys():
-                # Create new in-progress record
-                self.course_enrollments[response_course_id] = {
-                    'enrollments': enrollment_dicts,
-                    'page_info': enrollment_page_info,
-                    'num_pages': 1
-                }
+            course_ids = sorted(course_ids)
+
+        remaining_course_ids = []
+        for course_id in course_ids:
+            if course_id in self.course_enrollments.keys() and not self.has_more_pages(course_id):
+                self.progress.complete_item()
+                self.num_resumed_courses += 1
             else:
-                # Update existing in-progress record
-                self.course_enrollments[response_course_id]['enrollments'] += enrollment_dicts
-                self.course_enrollments[response_course_id]['page_info'] = enrollment_page_info
-                self.course_enrollments[response_course_id]['num_pages'] += 1
-
-    def make_requests(self, course_ids: Sequence[int]) -> None:
-        with FuturesSession(max_workers=self.num_workers) as session:
-            responses = []
-            for course_id in course_ids:
-                # Prep params
-                params = copy.deepcopy(self.default_params)
-                params['variables']['courseID'] = course_id
-                if course_id in self.course_enrollments.keys():
-                    course_enrollment_dict = self.course_enrollments[course_id]
-                    enroll_page_info = course_enrollment_dict['page_info']
-                    params['variables']['enrollmentPageCursor'] = enroll_page_info['endCursor']
-
-                logger.debug(params['variables'])
-                response = session.post(self.complete_url, json=params)
-                responses.append(response)
-
-            for completed_response in as_completed(responses):
-                self.parse_enrollment_response(completed_response)
-
-                # Log process status
-                logger.info(f'# started courses: {len(self.course_enrollments)}')
-                logger.info(f'# completed courses: {len(self.get_complete_course_ids())}')
+                remaining_course_ids.append(course_id)
+        return remaining_course_ids
 
     def generate_output(self) -> Tuple[pd.DataFrame, ...]:
         logger.debug('generate_output')
-        enrollment_records = []
-        section_records = []
-
-        for course_id in self.course_enrollments.keys():
-            enrollment_dicts = self.course_enrollments[course_id]['enrollments']
-            for enrollment_dict in enrollment_dicts:
-                enrollment_record, section_record = unnest_enrollment(enrollment_dict)
-                enrollment_records.append(enrollment_record)
-                section_records.append(section_record)
 
         # Seems like we shouldn't have to drop duplicates for enrollments, but once one
-        # duplicate broke the process
-        enrollment_df = pd.DataFrame(enrollment_records)
-        orig_enrollment_count = len(enrollment_df)
-        enrollment_df = enrollment_df.drop_duplicates(subset=['canvas_id'], keep='last')
-        logger.info(f'{orig_enrollment_count - len(enrollment_df)} enrollment records were dropped')
-
-        section_df = pd.DataFrame(section_records).drop_duplicates(subset=['canvas_id'], keep='last')
+        # duplicate broke the process; they are now dropped as pages arrive
+        enrollment_df = self.enrollments.to_dataframe()
+        logger.info(f'{self.enrollments.num_duplicates} enrollment records were dropped')
+
+        # Courses that failed part way may have some pages stored; they are left out rather than
+        # passed on as if their enrollments were complete (callers can fall back to stored records)
+        failed_mask = enrollment_df['course_id'].isin(self.failed_course_ids)
+        if failed_mask.any():
+            logger.warning(
+                f'{failed_mask.sum()} enrollment records from {len(self.failed_course_ids)} failed courses were dropped'
+            )
+            enrollment_df = enrollment_df.loc[~failed_mask].reset_index(drop=True)
+
+        section_ids = pd.unique(enrollment_df['course_section_id'])
+        section_df = pd.DataFrame({
+            'canvas_id': section_ids,
+            'name': [self.section_names.get(section_id) for section_id in section_ids]
+        })
         return (enrollment_df, section_df)
 
     def gather(self) -> None:
         logger.info('** AsyncEnrollGatherer')
         logger.info('Gathering enrollment data for courses asynchronously with GraphQL')
 
-        more_to_gather = True
-
-        loop_num = 0
-        while more_to_gather:
-            loop_num += 1
-            logger.info(f'Starting loop number {loop_num}')
-            course_ids_to_process = sorted(self.get_incomplete_course_ids())
-
-            if len(course_ids_to_process) == 0:
-                more_to_gather = False
+        # Each course's next page is requested as soon as its previous page arrives, so the total
+        # duration tracks the longest single chain of pages rather than the sum of round barriers.
+        self.restore_checkpoint()
+        self.timings.start()
+        with self.progress, self.checkpoint, get_transport().futures_session('graphql') as session:
+            scheduler = WorkQueueScheduler(
+                send=partial(self.make_request, session),
+                handle=self.handle_response,
+                get_window=lambda: int(self.controller.limit),
+                batch_size=self.batch_size,
+                timings=self.timings
+            )
+            scheduler.run(self.course_ids, prepare=self.prepare_courses)
+        if self.num_resumed_courses > 0:
+            logger.info(f'Skipped {self.num_resumed_courses} courses gathered by an interrupted run')
+        self.timings.finish()
+        self.timings.report(int(self.controller.limit))
+        self.timings.save()
+
+        if len(self.failed_course_ids) > 0:
+            if len(self.course_enrollments) == 0:
+                logger.error('No course IDs could be processed!')
             else:
-                unstarted_course_ids = [
-                    course_id for course_id in course_ids_to_process
-                    if course_id not in self.course_enrollments.keys()
-                ]
-                # This condition will stop the gather process if all the remaining course_ids
-                # have not been started. Usually, several request attempts will have been made
-                # using this course_id before reaching this state. The first check ensures that
-                # all requests are tried at least once; if the unlikely event occurred that all
-                # requests failed the first time, the process would then exit.
-                if (loop_num > 1) and (unstarted_course_ids == course_ids_to_process):
-                    more_to_gather = False
-                    if loop_num == 2:
-                        logger.error('No course IDs could be processed on the first loop!')
-                    else:
-                        logger.warning('Some course IDs could not be processed')
-                    logger.warning(course_ids_to_process)
-                else:
-                    self.make_requests(course_ids_to_process)
+                logger.warning('Some course IDs could not be processed')
+            logger.warning(sorted(self.failed_course_ids))
 
         logger.info('Enrollment records for the course IDs have been gathered')
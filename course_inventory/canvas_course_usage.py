@@ -1,83 +1,214 @@
 import logging
 import time
+import datetime
 import pandas as pd
+import numpy as np
+from array import array
+from functools import partial
 from json.decoder import JSONDecodeError
-from requests_futures.sessions import FuturesSession
-from concurrent.futures import as_completed
 import json
+
+from requests.exceptions import RequestException
+from sqlalchemy import text
+
+from api.checkpoint import Checkpoint
+from api.concurrency import get_controller
+from api.hedging import get_hedger
+from api.progress import ProgressTracker
+from api.retry import get_retry_engine
+from api.scheduler import DelayedItem, estimate_costs, order_by_cost, StageTimings, WorkFeed, WorkQueueScheduler
+from api.transport import get_transport
 logger = logging.getLogger(__name__)
 
+EPOCH_DATE = datetime.date(1970, 1, 1)
+
+
+class UsageColumns:
+    """
+    A chunk of course usage records stored in typed columns, with dates kept as day numbers
+    """
+
+    def __init__(self):
+        self.course_ids = array('q')
+        self.days = array('q')
+        self.views = array('q')
+        self.participations = array('q')
+
+    def __len__(self):
+        return len(self.course_ids)
+
+    def add(self, course_id, analytics):
+        for row in analytics:
+            self.course_ids.append(int(course_id))
+            self.days.append((datetime.date.fromisoformat(row['date'][:10]) - EPOCH_DATE).days)
+            self.views.append(int(row['views']))
+            self.participations.append(int(row['participations']))
+
+    def to_dataframe(self):
+        df = pd.DataFrame({
+            'course_id': np.frombuffer(self.course_ids, dtype=np.int64),
+            'views': np.frombuffer(self.views, dtype=np.int64),
+            'participations': np.frombuffer(self.participations, dtype=np.int64),
+            'date': pd.to_datetime(np.frombuffer(self.days, dtype=np.int64), unit='D').date
+        })
+        # canvas_course_usage is keyed on (course_id, date); the last record for a day wins
+        return df.drop_duplicates(subset=['course_id', 'date'], keep='last')
+
 
 class CanvasCourseUsage:
-    def __init__(self, canvas_url, canvas_token, retry_attempts, course_ids):
+    def __init__(self, canvas_url, canvas_token, retry_attempts, course_ids, course_sizes=None, largest_first=False,
+                 resume=False, on_chunk=None, chunk_size=10000):
         self.canvas_url = canvas_url
         self.canvas_token = canvas_token
+        self.timings = StageTimings('canvas_course_usage')
+        # course_ids may be a WorkFeed, in which case courses are fetched as they arrive
         self.course_ids = course_ids
+        self.course_sizes = course_sizes if course_sizes is not None else {}
+        self.previous_timings = self.timings.load_previous() if largest_first else None
         self.retry_attempts = retry_attempts
+        self.num_failures = {}
         self.canvas_usage_courses = []
-        self.course_retry_list = []
-        self.retry_count = 0
+        self.progress = ProgressTracker(
+            'CanvasCourseUsage', total=None if isinstance(course_ids, WorkFeed) else len(course_ids)
+        )
+        # Each successful response is checkpointed, including empty ones, so a resumed run skips the course
+        self.checkpoint = Checkpoint('canvas_course_usage', resume=resume)
+        self.completed_course_ids = set()
+        self.num_resumed_courses = 0
+
+        # In streaming mode, responses are converted to typed columns and passed to on_chunk (as a DataFrame)
+        # whenever chunk_size records have accumulated, instead of being kept until the end
+        self.on_chunk = on_chunk
+        self.chunk_size = chunk_size
+        self.usage_chunk = UsageColumns()
+        self.num_records = 0
 
-    def parsing_canvas_course_usage_data(self, response) -> None:
+    def store_analytics(self, course_id, analytics_data):
+        if self.on_chunk is None:
+            self.canvas_usage_courses.append({'course_id': course_id, 'analytics': analytics_data})
+            return
+        self.usage_chunk.add(course_id, analytics_data)
+        if len(self.usage_chunk) >= self.chunk_size:
+            self.flush_chunk()
+
+    def flush_chunk(self):
+        if len(self.usage_chunk) == 0:
+            return
+        chunk_df = self.usage_chunk.to_dataframe()
+        self.usage_chunk = UsageColumns()
+        self.num_records += len(chunk_df)
+        self.on_chunk(chunk_df)
+
+    def parsing_canvas_course_usage_data(self, response):
+        """
+        Parses an analytics response; returns True if the request failed
+        """
         logger.debug("parsing_canvas_course_usage_data Call")
-        new_dic = {}
         if response is None:
             logger.info(f"For Canvas Course usage response is None ")
-            return
+            return False
 
-        logger.info(f"CanvasCourseUsage data collected so far : {len(self.canvas_usage_courses)}")
+        self.progress.record_request(len(response.result().content))
         status = response.result().status_code
 
         course_id = response.result().url.split('courses/')[1].split('/')[0]
 
-        status_codes_to_retry = [500]
         if status != 200:
-            logger.info(f'retry_count: {self.retry_count}')
-            if self.retry_count < self.retry_attempts and status in status_codes_to_retry:
-                logger.info("Append to retry list")
-                self.course_retry_list.append(course_id)
             logger.info(f"Response not successful with status code {status} due to {response.result().text}")
-            return
+            return True
 
         try:
             analytics_data = json.loads(response.result().text)
         except JSONDecodeError as e:
             logger.error(f"Error in parsing the response due to {e.msg}")
-            logger.info("Append to retry list")
-            self.course_retry_list.append(course_id)
-            return
+            return True
 
+        self.progress.record_page()
+        self.progress.complete_item()
+        self.checkpoint.append({'course_id': course_id, 'analytics': analytics_data})
         if not analytics_data:
             logger.info(f"Response for fetching canvas course usage is empty")
-            return
-        new_dic['course_id'] = course_id
-        new_dic['analytics'] = analytics_data
+            return False
+        self.store_analytics(course_id, analytics_data)
+        return False
 
-        self.canvas_usage_courses.append(new_dic)
+    def make_request(self, session, course_ids):
+        headers = {'Content-type': 'application/json', 'Authorization': 'Bearer ' + self.canvas_token}
+        # https://umich.instructure.com/api/v1/courses/course_id/analytics/activity
+        url = f'{self.canvas_url}/api/v1/courses/{course_ids[0]}/analytics/activity'
+        # Analytics responses have a long latency tail, so slow requests may be hedged with a duplicate
+        return get_hedger('analytics').send(partial(session.get, url, headers=headers))
+
+    def handle_response(self, course_ids, response):
+        course_id = course_ids[0]
+        try:
+            result = response.result()
+        except RequestException as e:
+            logger.warning(f"The request for course {course_id} raised an exception: {e}")
+            result = None
+        if result is not None and not self.parsing_canvas_course_usage_data(response):
+            return []
+        self.num_failures[course_id] = self.num_failures.get(course_id, 0) + 1
+        # A 200 response that failed could not be parsed, which is worth retrying whatever the status.
+        # retry_attempts counts retries, so a course gets that many attempts after the first one.
+        delay = get_retry_engine().get_retry_delay(
+            'analytics', self.num_failures[course_id], self.retry_attempts + 1,
+            response=result, retryable_error=result is not None and result.status_code == 200
+        )
+        if delay is not None:
+            logger.info(
+                f"Retrying course {course_id} in {delay:.1f} seconds (failures: {self.num_failures[course_id]})"
+            )
+            return [DelayedItem(course_id, delay)]
+        logger.warning(f"Course {course_id} could not be processed after {self.num_failures[course_id]} attempts")
+        self.progress.fail_item()
+        return []
 
-    def _get_canvas_course_views_participation_data(self, retry_courses=None):
+    def _get_canvas_course_views_participation_data(self):
         logger.debug("Starting of _get_canvas_course_views_participation_data call")
-        with FuturesSession() as session:
-            headers = {'Content-type': 'application/json', 'Authorization': 'Bearer ' + self.canvas_token}
-            # https://umich.instructure.com/api/v1/courses/course_id/analytics/activity
-            if retry_courses is None:
-                logger.info("Initial round getting canvas_course_usage data")
-                responses = [session.get(f'{self.canvas_url}/api/v1/courses/{course_id}/analytics/activity',
-                                         headers=headers) for course_id in self.course_ids]
-            else:
-                self.course_retry_list = []
-                logger.info("Retry round getting canvas_course_usage data")
-                responses = [session.get(f'{self.canvas_url}/api/v1/courses/{retry_course}/analytics/activity',
-                                         headers=headers) for retry_course in retry_courses]
-
-            for response in as_completed(responses):
-                self.parsing_canvas_course_usage_data(response)
-
-        logger.info(f"Any thing to Retry? With List of length {len(self.course_retry_list)} : {self.course_retry_list}")
-        if len(self.course_retry_list) != 0 and self.retry_count < self.retry_attempts:
-            logger.info(f"Retrying again for {self.retry_count + 1}")
-            self.retry_count = self.retry_count + 1
-            self._get_canvas_course_views_participation_data(self.course_retry_list)
+        # At most the analytics concurrency limit of requests are in flight; retries go to the front of the queue
+        controller = get_controller('analytics')
+        with get_transport().futures_session('analytics') as session:
+            scheduler = WorkQueueScheduler(
+                send=partial(self.make_request, session),
+                handle=self.handle_response,
+                get_window=lambda: int(controller.limit),
+                timings=self.timings
+            )
+            scheduler.run(self.course_ids, prepare=self.prepare_courses)
+        self.flush_chunk()
+        if self.num_resumed_courses > 0:
+            logger.info(f"Skipped {self.num_resumed_courses} courses fetched by an interrupted run")
+
+    def prepare_courses(self, course_ids):
+        """
+        Orders courses for fetching and skips those fetched by an interrupted run; called with each
+        list of courses as it arrives
+        :param course_ids:
+        :type course_ids: list
+        :return: remaining_course_ids
+        :rtype: list
+        """
+        if self.previous_timings is not None:
+            # Submit the courses expected to take longest first so they don't set the makespan
+            course_costs = estimate_costs(course_ids, self.course_sizes, self.previous_timings)
+            course_ids = order_by_cost(course_ids, course_costs)
+        remaining_course_ids = [
+            course_id for course_id in course_ids if int(course_id) not in self.completed_course_ids
+        ]
+        self.num_resumed_courses += len(course_ids) - len(remaining_course_ids)
+        for _ in range(len(course_ids) - len(remaining_course_ids)):
+            self.progress.start_item()
+            self.progress.complete_item()
+        for _ in remaining_course_ids:
+            self.progress.start_item()
+        return remaining_course_ids
+
+    def restore_checkpoint(self):
+        for record in self.checkpoint.iterate():
+            self.completed_course_ids.add(int(record['course_id']))
+            if record['analytics']:
+                self.store_analytics(record['course_id'], record['analytics'])
 
     # preparing the data to be loaded to df in format [date, views, paticipations, course_id]
     def canvas_course_usage_to_df(self):
@@ -93,17 +224,148 @@ class CanvasCourseUsage:
         df = pd.DataFrame(rows)
         logger.info(df.head())
         df = df.drop(['id'], axis=1)
-        df_dup = df[df.duplicated()]
+        # canvas_course_usage is keyed on (course_id, date), so each course keeps one record per day
+        # (the last one returned); dates are compared as days in case some include a time
+        day_keys = df[['course_id']].assign(day=df['date'].astype(str).str[:10])
+        dup_mask = day_keys.duplicated(keep='last')
         logger.info('Check for duplicate items')
-        logger.info(df_dup)
-        df = df.drop_duplicates()
+        logger.info(df[dup_mask])
+        df = df.loc[~dup_mask.to_numpy()].reset_index(drop=True)
         logger.debug(df.head())
         return df
 
-    def get_canvas_course_views_participation_data(self):
+    def gather(self):
+        """
+        Gathers usage data for the courses. Records are kept for canvas_course_usage_to_df, or in
+        streaming mode (when on_chunk was provided), passed to on_chunk and counted in num_records.
+        """
         start = time.time()
-        self._get_canvas_course_views_participation_data()
+        self.restore_checkpoint()
+        self.timings.start()
+        with self.progress, self.checkpoint:
+            self._get_canvas_course_views_participation_data()
+        self.timings.finish()
+        self.timings.report(int(get_controller('analytics').limit))
+        self.timings.save()
         delta = time.time() - start
         str_time = time.strftime("%H:%M:%S", time.gmtime(delta))
         logger.info(f'Duration of Canvas Course usage run took: {str_time}')
+
+    def get_canvas_course_views_participation_data(self):
+        """
+        Gathers usage data for the courses and returns the records as a DataFrame. Not for streaming
+        mode, where records are passed to on_chunk instead; call gather there.
+        """
+        if self.on_chunk is not None:
+            raise ValueError('Usage records are passed to on_chunk in streaming mode; use gather instead')
+        self.gather()
         return self.canvas_course_usage_to_df()
+
+
+class CanvasCourseUsageWatermarks:
+    """
+    Tracks the last complete date of each course's usage data in the canvas_course_usage_watermark table,
+    so only new or recently changed days are loaded. Canvas keeps updating a course's most recent days,
+    so days within settle_days of the latest day returned for a course are not yet considered complete.
+    """
+
+    def __init__(self, db_creator_obj, settle_days):
+        self.db_creator_obj = db_creator_obj
+        self.settle_days = settle_days
+        watermark_df = pd.read_sql('canvas_course_usage_watermark', db_creator_obj.engine)
+        watermark_df['course_id'] = watermark_df['course_id'].astype(int)
+        watermark_df['last_complete_date'] = pd.to_datetime(watermark_df['last_complete_date'])
+        self.watermark_df = watermark_df
+
+    @staticmethod
+    def get_days(usage_df):
+        # Dates are compared as days, whether or not Canvas includes a time and offset
+        return pd.to_datetime(usage_df['date'].astype(str).str[:10], format='%Y-%m-%d')
+
+    def filter_new_days(self, usage_df):
+        usage_df = usage_df.assign(course_id=usage_df['course_id'].astype(int))
+        merged_df = pd.merge(usage_df, self.watermark_df, on='course_id', how='left')
+        new_mask = (
+            merged_df['last_complete_date'].isnull() |
+            (self.get_days(merged_df) > merged_df['last_complete_date'])
+        )
+        new_usage_df = usage_df.loc[new_mask.to_numpy()].reset_index(drop=True)
+        logger.info(f"Keeping {len(new_usage_df)} of {len(usage_df)} course usage records as new or recently changed")
+        return new_usage_df
+
+    def save(self, new_usage_df):
+        if len(new_usage_df) == 0:
+            return
+        latest_df = new_usage_df.assign(day=self.get_days(new_usage_df)).groupby('course_id')['day'].max().reset_index()
+        latest_df['last_complete_date'] = latest_df['day'] - pd.Timedelta(days=self.settle_days)
+        # Watermarks only move forward
+        merged_df = pd.merge(
+            latest_df, self.watermark_df, on='course_id', how='left', suffixes=('', '_previous')
+        )
+        advanced_df = merged_df.loc[
+            merged_df['last_complete_date_previous'].isnull() |
+            (merged_df['last_complete_date'] > merged_df['last_complete_date_previous'])
+        ]
+        watermark_df = pd.DataFrame({
+            'course_id': advanced_df['course_id'],
+            'last_complete_date': advanced_df['last_complete_date'].dt.date
+        })
+        self.db_creator_obj.upsert_records('canvas_course_usage_watermark', watermark_df)
+
+
+class CanvasCourseUsageStaging:
+    """
+    Collects streamed course usage chunks in the canvas_course_usage_staging table, which has no keys,
+    so they can be written while gathering is still underway, then moves them into canvas_course_usage
+    with single statements once the course records they reference are stored.
+    """
+
+    def __init__(self, db_creator_obj):
+        self.db_creator_obj = db_creator_obj
+
+    def clear(self):
+        self.db_creator_obj.drop_records(['canvas_course_usage_staging'])
+
+    def add_chunk(self, chunk_df):
+        self.db_creator_obj.bulk_load('canvas_course_usage_staging', chunk_df)
+        logger.debug(f"Flushed {len(chunk_df)} course usage records to canvas_course_usage_staging")
+
+    def load(self, settle_days=None, table_name='canvas_course_usage'):
+        """
+        Upserts the staged records into canvas_course_usage (or the named table with the same columns, such as
+        its shadow table). If settle_days is given (incremental mode), only days after each course's last
+        complete date are loaded; save_watermarks should be called once the records are in canvas_course_usage.
+        """
+        conn = self.db_creator_obj.engine.connect()
+        if settle_days is None:
+            where_clause = ''
+        else:
+            where_clause = '''
+                LEFT JOIN canvas_course_usage_watermark w ON s.course_id = w.course_id
+                WHERE w.last_complete_date IS NULL OR s.date > w.last_complete_date
+            '''
+        result = conn.execute(text(f'''
+            INSERT INTO {table_name} (course_id, views, participations, date)
+            SELECT s.course_id, s.views, s.participations, s.date
+            FROM canvas_course_usage_staging s
+            {where_clause}
+            ON DUPLICATE KEY UPDATE views = VALUES(views), participations = VALUES(participations);
+        '''))
+        logger.info(f"Loaded staged course usage records into {table_name} ({result.rowcount} rows affected)")
+        conn.close()
+
+    def save_watermarks(self, settle_days):
+        """
+        Advances the watermarks past the staged records' days, leaving the last settle_days days of each course open.
+        """
+        conn = self.db_creator_obj.engine.connect()
+        conn.execute(text('''
+            INSERT INTO canvas_course_usage_watermark (course_id, last_complete_date)
+            SELECT course_id, DATE_SUB(MAX(date), INTERVAL :settle_days DAY)
+            FROM canvas_course_usage_staging
+            GROUP BY course_id
+            ON DUPLICATE KEY UPDATE
+                last_complete_date = GREATEST(last_complete_date, VALUES(last_complete_date));
+        '''), settle_days=settle_days)
+        logger.info("Advanced course usage watermarks")
+        conn.close()
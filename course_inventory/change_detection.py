@@ -0,0 +1,177 @@
+# standard libraries
+import logging, time
+from typing import List, Sequence, Tuple
+
+# third-party libraries
+import pandas as pd
+from sqlalchemy import bindparam, text
+
+# local libraries
+from db.db_creator import DBCreator
+
+
+logger = logging.getLogger(__name__)
+
+SIGNAL_COLUMNS = ['course_id', 'total_students', 'workflow_state', 'num_enrollments', 'gathered_at']
+ENROLLMENT_COLUMNS = ['canvas_id', 'user_id', 'course_id', 'course_section_id', 'role_type', 'workflow_state']
+
+
+class EnrollmentChangeDetector:
+    """
+    Decides which courses need their enrollments gathered again by comparing cheap signals from the
+    course listing (total_students and workflow_state) with the values stored by the previous run.
+    Enrollment and section records for the other courses are carried forward from the database.
+    A course is also gathered again if its stored enrollment records don't match the count recorded
+    when they were gathered, or if it was last gathered more than full_refresh_days days ago.
+    Courses may be checked all at once or a page at a time as they are listed.
+    """
+
+    def __init__(self, db_creator_obj: DBCreator, full_refresh_days: int) -> None:
+        self.db_creator_obj: DBCreator = db_creator_obj
+        self.full_refresh_days: int = full_refresh_days
+        self.started_at: pd.Timestamp = pd.to_datetime(time.time(), unit='s')
+
+        previous_signal_df = pd.read_sql('course_enrollment_signal', self.db_creator_obj.engine, columns=SIGNAL_COLUMNS)
+        # Types are set explicitly so an empty table (e.g. on the first run) still merges and compares cleanly
+        previous_signal_df['course_id'] = previous_signal_df['course_id'].astype(int)
+        previous_signal_df['gathered_at'] = pd.to_datetime(previous_signal_df['gathered_at'])
+        self.previous_signal_df: pd.DataFrame = previous_signal_df
+        # Signals and carried records are kept per call to find_changed_courses and combined when needed
+        self.current_signal_dfs: List[pd.DataFrame] = []
+        self.carried_course_ids: List[int] = []
+        self.carried_enrollment_dfs: List[pd.DataFrame] = []
+        self.carried_section_dfs: List[pd.DataFrame] = []
+
+    @staticmethod
+    def combine(dfs: List[pd.DataFrame], columns: List[str]) -> pd.DataFrame:
+        if len(dfs) == 0:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(dfs, ignore_index=True)
+
+    def find_changed_courses(self, course_df: pd.DataFrame) -> List[int]:
+        """
+        Returns the IDs of courses in course_df (which needs canvas_id, total_students, and
+        workflow_state columns) whose enrollments should be gathered; the records of the rest are
+        read from the database so they can be carried forward.
+        """
+        current_signal_df = course_df[['canvas_id', 'total_students', 'workflow_state']].rename(
+            columns={'canvas_id': 'course_id'}
+        )
+        self.current_signal_dfs.append(current_signal_df)
+        signal_df = pd.merge(
+            current_signal_df, self.previous_signal_df,
+            on='course_id', how='left', suffixes=('', '_previous')
+        )
+        refresh_before = self.started_at - pd.Timedelta(days=self.full_refresh_days)
+        unchanged_mask = (
+            signal_df['gathered_at'].notnull() &
+            (signal_df['total_students'] == signal_df['total_students_previous']) &
+            (signal_df['workflow_state'] == signal_df['workflow_state_previous']) &
+            (signal_df['gathered_at'] > refresh_before)
+        )
+        unchanged_course_ids = signal_df.loc[unchanged_mask, 'course_id'].astype(int).tolist()
+
+        carried_course_ids: List[int] = []
+        if len(unchanged_course_ids) > 0:
+            carried_enrollment_df, carried_section_df = read_stored_records(
+                self.db_creator_obj, unchanged_course_ids
+            )
+            # Courses whose stored records are incomplete (e.g. from a partial load) are gathered again
+            stored_counts = carried_enrollment_df.groupby('course_id').size()
+            expected_counts = signal_df.loc[unchanged_mask].set_index('course_id')['num_enrollments']
+            consistent_counts = expected_counts == stored_counts.reindex(expected_counts.index).fillna(0)
+            carried_course_ids = consistent_counts[consistent_counts].index.astype(int).tolist()
+            self.carried_course_ids += carried_course_ids
+            self.carried_enrollment_dfs.append(
+                carried_enrollment_df.loc[carried_enrollment_df['course_id'].isin(carried_course_ids)]
+            )
+            self.carried_section_dfs.append(carried_section_df)
+
+        carried_course_id_set = set(carried_course_ids)
+        changed_course_ids = [
+            course_id for course_id in course_df['canvas_id'].to_list() if course_id not in carried_course_id_set
+        ]
+        logger.info(
+            f'Enrollments will be gathered for {len(changed_course_ids)} changed course(s) and carried '
+            f'forward for {len(carried_course_ids)} unchanged course(s)'
+        )
+        return changed_course_ids
+
+    def add_carried_records(
+        self,
+        enrollment_df: pd.DataFrame,
+        section_df: pd.DataFrame
+    ) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Combines freshly gathered enrollment and section records with those carried forward.
+        """
+        carried_enrollment_df = self.combine(self.carried_enrollment_dfs, ENROLLMENT_COLUMNS)
+        carried_section_df = self.combine(self.carried_section_dfs, ['canvas_id', 'name'])
+        return add_stored_records(enrollment_df, section_df, carried_enrollment_df, carried_section_df)
+
+    def save_signals(self, enrollment_df: pd.DataFrame, failed_course_ids: Sequence[int]) -> None:
+        """
+        Replaces the stored signals with those of this run, once its records have been stored.
+        Courses that could not be gathered are left out, so the next run gathers them again.
+        """
+        num_enrollments = enrollment_df.groupby('course_id').size()
+        current_signal_df = self.combine(self.current_signal_dfs, SIGNAL_COLUMNS[:3])
+        signal_df = current_signal_df.loc[~current_signal_df['course_id'].isin(failed_course_ids)].copy()
+        signal_df['num_enrollments'] = signal_df['course_id'].map(num_enrollments).fillna(0).astype(int)
+
+        # Carried courses keep the time they were last gathered, so the full refresh still comes due
+        signal_df = pd.merge(
+            signal_df, self.previous_signal_df[['course_id', 'gathered_at']], on='course_id', how='left'
+        )
+        carried_mask = signal_df['course_id'].isin(self.carried_course_ids)
+        signal_df['gathered_at'] = signal_df['gathered_at'].where(carried_mask, self.started_at)
+
+        # The stored signals are replaced in one transaction, so a failure can't leave them emptied
+        self.db_creator_obj.sync_records('course_enrollment_signal', signal_df[SIGNAL_COLUMNS], key_column='course_id')
+
+
+# Function(s)
+
+def read_stored_records(db_creator_obj: DBCreator, course_ids: Sequence[int]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Reads the stored enrollment records of the given courses, and the section records they reference.
+    """
+    enrollment_query = text(f'''
+        SELECT {', '.join(ENROLLMENT_COLUMNS)}
+        FROM enrollment
+        WHERE course_id IN :course_ids;
+    ''').bindparams(bindparam('course_ids', expanding=True))
+    enrollment_df = pd.read_sql(
+        enrollment_query, db_creator_obj.engine, params={'course_ids': list(course_ids)}
+    )
+
+    section_df = pd.DataFrame(columns=['canvas_id', 'name'])
+    section_ids = enrollment_df['course_section_id'].unique().tolist()
+    if len(section_ids) > 0:
+        section_query = text('''
+            SELECT canvas_id, name
+            FROM course_section
+            WHERE canvas_id IN :section_ids;
+        ''').bindparams(bindparam('section_ids', expanding=True))
+        section_df = pd.read_sql(
+            section_query, db_creator_obj.engine, params={'section_ids': section_ids}
+        )
+    return (enrollment_df, section_df)
+
+
+def add_stored_records(
+    enrollment_df: pd.DataFrame,
+    section_df: pd.DataFrame,
+    stored_enrollment_df: pd.DataFrame,
+    stored_section_df: pd.DataFrame
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Combines freshly gathered enrollment and section records with stored ones read for other courses.
+    """
+    enrollment_df = pd.concat([enrollment_df, stored_enrollment_df], ignore_index=True)
+    stored_section_df = stored_section_df.loc[
+        stored_section_df['canvas_id'].isin(stored_enrollment_df['course_section_id'])
+    ]
+    section_df = pd.concat([section_df, stored_section_df], ignore_index=True)
+    section_df = section_df.drop_duplicates(subset=['canvas_id'], keep='first').reset_index(drop=True)
+    return (enrollment_df, section_df)
@@ -0,0 +1,61 @@
+# standard libraries
+import logging
+from typing import Any, Dict, List, Union
+
+# third-party libraries
+import pandas as pd
+
+# local libraries
+from api.scheduler import WorkFeed
+from course_inventory.change_detection import EnrollmentChangeDetector
+
+
+logger = logging.getLogger(__name__)
+
+
+class CourseStream:
+    """
+    Passes courses to the published date, usage, and enrollment stages as course pages are listed,
+    so those stages can start before the listing is finished and run at the same time. Courses are
+    routed the same way as when the listing is complete: only courses with students are kept,
+    published dates and usage are fetched for available courses, and with change detection,
+    enrollments are only gathered for changed courses.
+    """
+
+    def __init__(self, change_detector: Union[EnrollmentChangeDetector, None] = None) -> None:
+        self.change_detector: Union[EnrollmentChangeDetector, None] = change_detector
+        # Filled in as pages arrive, before the page's courses are passed on, so stages can use it for sizing
+        self.course_student_counts: Dict[int, int] = {}
+        self.published_date_feed: WorkFeed = WorkFeed()
+        self.usage_feed: WorkFeed = WorkFeed()
+        self.enrollment_feed: WorkFeed = WorkFeed()
+        self.num_courses: int = 0
+
+    def add_courses(self, course_dicts: List[Dict[str, Any]]) -> None:
+        """
+        Routes a page of slimmed course records to the stages.
+        """
+        course_dicts = [course_dict for course_dict in course_dicts if course_dict['total_students'] > 0]
+        if len(course_dicts) == 0:
+            return
+        self.num_courses += len(course_dicts)
+        for course_dict in course_dicts:
+            self.course_student_counts[course_dict['canvas_id']] = course_dict['total_students']
+
+        available_course_ids = [
+            course_dict['canvas_id'] for course_dict in course_dicts if course_dict['workflow_state'] == 'available'
+        ]
+        self.published_date_feed.put(available_course_ids)
+        self.usage_feed.put(available_course_ids)
+
+        if self.change_detector is not None:
+            enroll_course_ids = self.change_detector.find_changed_courses(pd.DataFrame(course_dicts))
+        else:
+            enroll_course_ids = [course_dict['canvas_id'] for course_dict in course_dicts]
+        self.enrollment_feed.put(enroll_course_ids)
+
+    def close(self) -> None:
+        logger.info(f'Passed {self.num_courses} courses with students to the later stages')
+        self.published_date_feed.close()
+        self.usage_feed.close()
+        self.enrollment_feed.close()
@@ -0,0 +1,89 @@
+# standard libraries
+import logging
+from typing import Sequence
+
+# third-party libraries
+import numpy as np
+import pandas as pd
+
+# local libraries
+from course_inventory.change_detection import ENROLLMENT_COLUMNS
+from db.db_creator import DBCreator
+from job_metadata import defer_records, record_metric
+
+
+logger = logging.getLogger(__name__)
+
+# Only these columns can change for an existing enrollment; the others are part of what it is
+TRACKED_COLUMNS = ['course_section_id', 'role_type', 'workflow_state']
+
+
+def find_enrollment_changes(previous_df: pd.DataFrame, current_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Compares two enrollment snapshots by canvas_id and returns a record for each enrollment that was
+    added, removed, or changed (in its section, role type, or workflow state), with a change_type column.
+    Removed enrollments keep their previous values; changed ones also carry the previous values of
+    TRACKED_COLUMNS in previous_* columns.
+    """
+    # Categorical columns are compared as plain values, since the two snapshots' categories differ
+    previous_df = previous_df[ENROLLMENT_COLUMNS].astype({'role_type': object, 'workflow_state': object})
+    current_df = current_df[ENROLLMENT_COLUMNS].astype({'role_type': object, 'workflow_state': object})
+    merged_df = pd.merge(
+        current_df, previous_df, on='canvas_id', how='outer', suffixes=('', '_previous'), indicator=True
+    )
+
+    added = merged_df['_merge'] == 'left_only'
+    removed = merged_df['_merge'] == 'right_only'
+    changed = pd.Series(False, index=merged_df.index)
+    for column in TRACKED_COLUMNS:
+        changed |= merged_df[column] != merged_df[f'{column}_previous']
+    changed &= merged_df['_merge'] == 'both'
+
+    change_df = merged_df.loc[added | removed | changed].copy()
+    change_df['change_type'] = np.select(
+        [added[change_df.index], removed[change_df.index]], ['added', 'removed'], default='changed'
+    )
+    removed_mask = change_df['change_type'] == 'removed'
+    for column in ENROLLMENT_COLUMNS[1:]:
+        change_df[column] = change_df[column].where(~removed_mask, change_df[f'{column}_previous'])
+    for column in TRACKED_COLUMNS:
+        change_df[f'previous_{column}'] = change_df[f'{column}_previous'].where(change_df['change_type'] == 'changed')
+
+    # The outer join turns integer columns into floats, so they are restored
+    change_df = change_df.astype({'user_id': 'int64', 'course_id': 'int64', 'course_section_id': 'int64'})
+    change_df['previous_course_section_id'] = change_df['previous_course_section_id'].astype('Int64')
+    return change_df[
+        ['change_type'] + ENROLLMENT_COLUMNS + [f'previous_{column}' for column in TRACKED_COLUMNS]
+    ].reset_index(drop=True)
+
+
+def capture_enrollment_changes(
+    db_creator_obj: DBCreator,
+    enrollment_df: pd.DataFrame,
+    failed_course_ids: Sequence[int] = ()
+) -> None:
+    """
+    Compares the enrollment records about to be loaded with those in the enrollment table, and defers
+    the differences as enrollment_change records for the job's job_run. Courses whose enrollments could
+    not be gathered are left out of the comparison. This must run before the enrollment table is emptied
+    or updated.
+    """
+    previous_df = pd.read_sql(f"SELECT {', '.join(ENROLLMENT_COLUMNS)} FROM enrollment;", db_creator_obj.engine)
+    if len(previous_df) == 0:
+        # Every enrollment would count as added; the enrollment table itself is the starting point
+        logger.info('No previous enrollment records were found, so no enrollment changes will be recorded')
+        return
+
+    # A failed course's records are not a new snapshot of it, so comparing them would record false changes
+    previous_df = previous_df.loc[~previous_df['course_id'].isin(failed_course_ids)]
+    current_df = enrollment_df.loc[~enrollment_df['course_id'].isin(failed_course_ids)]
+    change_df = find_enrollment_changes(previous_df, current_df)
+    change_counts = change_df['change_type'].value_counts()
+    for change_type in ['added', 'removed', 'changed']:
+        record_metric(f'enrollment_changes_{change_type}', int(change_counts.get(change_type, 0)))
+    logger.info(
+        f"Found {len(change_df)} enrollment changes since the previous load: "
+        f"{change_counts.get('added', 0)} added, {change_counts.get('removed', 0)} removed, "
+        f"{change_counts.get('changed', 0)} changed"
+    )
+    defer_records('enrollment_change', change_df)
@@ -34,6 +34,174 @@ course_enrollments_query = '''
     }
 '''
 
+# Lean version of course_enrollments_query: enrollment nodes only include section IDs, section names
+# are fetched once per course (page by page, alongside the enrollment pages, while
+# $includeSections is true), and the enrollment types are filtered by the server
+lean_course_enrollments_query = '''
+    query courseEnrollmentsLeanQuery (
+        $courseID: ID!,
+        $enrollmentPageSize: Int,
+        $enrollmentPageCursor: String,
+        $enrollmentTypes: [EnrollmentType!],
+        $includeSections: Boolean!,
+        $sectionPageCursor: String
+    ) {
+        course(id: $courseID) {
+            _id
+            sectionsConnection(
+                first: 100,
+                after: $sectionPageCursor
+            ) @include(if: $includeSections) {
+                nodes {
+                    _id
+                    name
+                }
+                pageInfo {
+                    endCursor
+                    hasNextPage
+                }
+            }
+            enrollmentsConnection(
+                first: $enrollmentPageSize,
+                after: $enrollmentPageCursor,
+                filter: {types: $enrollmentTypes}
+            ) {
+                nodes {
+                    _id
+                    section {
+                        _id
+                    }
+                    state
+                    type
+                    user {
+                        _id
+                    }
+                }
+                pageInfo {
+                    endCursor
+                    hasNextPage
+                }
+            }
+        }
+    }
+'''
+
+# Used to build a batched version of course_enrollments_query with one aliased course selection
+# per course; each selection gets its own numbered variables, e.g. $courseID0, $enrollmentPageCursor0
+batch_course_variables_template = '''
+        $courseID{index}: ID!,
+        $enrollmentPageSize{index}: Int,
+        $enrollmentPageCursor{index}: String'''
+
+batch_course_selection_template = '''
+        course{index}: course(id: $courseID{index}) {{
+            _id
+            enrollmentsConnection(
+                first: $enrollmentPageSize{index},
+                after: $enrollmentPageCursor{index}
+            ) {{
+                nodes {{
+                    ...enrollmentFields
+                }}
+                pageInfo {{
+                    endCursor
+                    hasNextPage
+                }}
+            }}
+        }}'''
+
+lean_batch_course_variables_template = '''
+        $courseID{index}: ID!,
+        $enrollmentPageSize{index}: Int,
+        $enrollmentPageCursor{index}: String,
+        $enrollmentTypes{index}: [EnrollmentType!],
+        $includeSections{index}: Boolean!,
+        $sectionPageCursor{index}: String'''
+
+lean_batch_course_selection_template = '''
+        course{index}: course(id: $courseID{index}) {{
+            _id
+            sectionsConnection(
+                first: 100,
+                after: $sectionPageCursor{index}
+            ) @include(if: $includeSections{index}) {{
+                nodes {{
+                    _id
+                    name
+                }}
+                pageInfo {{
+                    endCursor
+                    hasNextPage
+                }}
+            }}
+            enrollmentsConnection(
+                first: $enrollmentPageSize{index},
+                after: $enrollmentPageCursor{index},
+                filter: {{types: $enrollmentTypes{index}}}
+            ) {{
+                nodes {{
+                    ...leanEnrollmentFields
+                }}
+                pageInfo {{
+                    endCursor
+                    hasNextPage
+                }}
+            }}
+        }}'''
+
+batch_enrollment_fragment = '''
+    fragment enrollmentFields on Enrollment {
+        _id
+        section {
+            _id
+            name
+        }
+        state
+        type
+        user {
+            _id
+        }
+        course {
+            _id
+        }
+    }
+'''
+
+
+lean_batch_enrollment_fragment = '''
+    fragment leanEnrollmentFields on Enrollment {
+        _id
+        section {
+            _id
+        }
+        state
+        type
+        user {
+            _id
+        }
+    }
+'''
+
+
+def build_course_enrollments_batch_query(num_courses: int, lean: bool = False) -> str:
+    if lean:
+        variables_template = lean_batch_course_variables_template
+        selection_template = lean_batch_course_selection_template
+        fragment = lean_batch_enrollment_fragment
+    else:
+        variables_template = batch_course_variables_template
+        selection_template = batch_course_selection_template
+        fragment = batch_enrollment_fragment
+
+    variables = ','.join(variables_template.format(index=index) for index in range(num_courses))
+    selections = ''.join(selection_template.format(index=index) for index in range(num_courses))
+    return (
+        f'\n    query courseEnrollmentsBatchQuery ({variables}\n    ) {{{selections}\n    }}\n' +
+        fragment
+    )
+
+
 queries = {
-    'course_enrollments': course_enrollments_query
+    'course_enrollments': course_enrollments_query,
+    'course_enrollments_lean': lean_course_enrollments_query
 }
@@ -1,7 +1,11 @@
 # standard libraries
 import json, logging, os, time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import datetime
+from functools import partial
 from json.decoder import JSONDecodeError
-from typing import Any, Dict, List, Sequence, Union
+from typing import Any, Callable, Dict, List, Sequence, Tuple, Union
+from urllib.parse import parse_qs, urlparse
 
 # third-party libraries
 import pandas as pd
@@ -11,11 +15,23 @@ from requests import Response
 from umich_api.api_utils import ApiUtil
 
 # local libraries
+from api.checkpoint import clear_checkpoints
+from api.concurrency import get_controller, record_concurrency_metrics
+from api.hedging import record_hedging_metrics
+from api.retry import get_retry_engine
+from api.scheduler import WorkFeed
+from api.transport import get_transport
 from course_inventory.async_enroll_gatherer import AsyncEnrollGatherer
-from course_inventory.canvas_course_usage import CanvasCourseUsage
+from course_inventory.canvas_course_usage import (
+    CanvasCourseUsage, CanvasCourseUsageStaging, CanvasCourseUsageWatermarks
+)
+from course_inventory.change_detection import add_stored_records, EnrollmentChangeDetector, read_stored_records
+from course_inventory.course_stream import CourseStream
+from course_inventory.enrollment_change import capture_enrollment_changes
 from course_inventory.gql_queries import queries as QUERIES
-from course_inventory.published_date import FetchPublishedDate
+from course_inventory.published_date import FetchAccountPublishedDates, FetchPublishedDate, PublishedDateCache
 from db.db_creator import DBCreator
+from db.loader import WriteBehindLoader
 from environ import ENV
 from vocab import ValidDataSourceName
 
@@ -36,13 +52,32 @@ CANVAS_TOKEN = CANVAS['CANVAS_TOKEN']
 CANVAS_URL = CANVAS['CANVAS_URL']
 
 MAX_REQ_ATTEMPTS = ENV.get('MAX_REQ_ATTEMPTS', 3)
-NUM_ASYNC_WORKERS = ENV.get('NUM_ASYNC_WORKERS', 8)
+CONCURRENT_COURSE_LISTING = ENV.get('CONCURRENT_COURSE_LISTING', False)
+STREAMING_STAGES = ENV.get('STREAMING_STAGES', False)
+ENROLL_BATCH_SIZE = ENV.get('ENROLL_BATCH_SIZE', 1)
+LARGEST_FIRST_SCHEDULING = ENV.get('LARGEST_FIRST_SCHEDULING', False)
+LEAN_ENROLLMENT_QUERY = ENV.get('LEAN_ENROLLMENT_QUERY', False)
+ENROLLMENT_TYPES = ENV.get('ENROLLMENT_TYPES', ['StudentEnrollment', 'TeacherEnrollment'])
+PUBLISHED_DATE_RESOLVER = ENV.get('PUBLISHED_DATE_RESOLVER', 'course')
+CANVAS_COURSE_USAGE_INCREMENTAL = ENV.get('CANVAS_COURSE_USAGE_INCREMENTAL', False)
+CANVAS_COURSE_USAGE_SETTLE_DAYS = ENV.get('CANVAS_COURSE_USAGE_SETTLE_DAYS', 2)
+CANVAS_COURSE_USAGE_STREAMING = ENV.get('CANVAS_COURSE_USAGE_STREAMING', False)
+CANVAS_COURSE_USAGE_CHUNK_SIZE = ENV.get('CANVAS_COURSE_USAGE_CHUNK_SIZE', 10000)
+ENROLLMENT_CHANGE_DETECTION = ENV.get('ENROLLMENT_CHANGE_DETECTION', False)
+ENROLLMENT_FULL_REFRESH_DAYS = ENV.get('ENROLLMENT_FULL_REFRESH_DAYS', 7)
+SHADOW_LOAD = ENV.get('SHADOW_LOAD', False)
+HASH_LOAD = ENV.get('HASH_LOAD', False)
+ENROLLMENT_CHANGE_CAPTURE = ENV.get('ENROLLMENT_CHANGE_CAPTURE', False)
 CREATE_CSVS = ENV.get('CREATE_CSVS', False)
+# Set by the --resume option of run_jobs.py, or in the configuration
+RESUME = ENV.get('RESUME', False)
 
 INVENTORY_DB = ENV['INVENTORY_DB']
 
 CANVAS_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
 
+PUBLISHED_DATE_WATERMARK = 'course_audit_published'
+
 
 # Function(s) - Canvas
 
@@ -54,23 +89,33 @@ def make_request_using_api_utils(url: str, params: Union[Dict[str, Any], None] =
 
     logger.debug('Making a request for data...')
 
+    retry_engine = get_retry_engine()
     for i in range(1, MAX_REQ_ATTEMPTS + 1):
         logger.debug(f'Attempt #{i}')
-        response = API_UTIL.api_call(url, SUBSCRIPTION_NAME, payload=request_params)
+        # API Directory requests don't go through a transport session, so they are governed explicitly
+        response = get_transport().send_governed(
+            url, partial(API_UTIL.api_call, url, SUBSCRIPTION_NAME, payload=request_params), endpoint_class='rest'
+        )
         status_code = response.status_code
 
+        invalid_json = False
         if status_code != 200:
             logger.warning(f'Received irregular status code: {status_code}')
-            logger.info('Beginning next_attempt')
         else:
             try:
                 json.loads(response.text)
                 return response
             except JSONDecodeError:
                 logger.warning('JSONDecodeError encountered')
-                logger.info('Beginning next attempt')
+                invalid_json = True
+
+        delay = retry_engine.get_retry_delay('rest', i, MAX_REQ_ATTEMPTS, response, retryable_error=invalid_json)
+        if delay is None:
+            break
+        logger.info(f'Beginning next attempt in {delay:.1f} seconds')
+        time.sleep(delay)
 
-    logger.error('The maximum number of request attempts was reached')
+    logger.error('The request failed, and no more attempts will be made')
     return response
 
 
@@ -129,41 +174,137 @@ def slim_down_course_data(course_data: List[Dict]) -> List[Dict]:
     return slim_course_dicts
 
 
-def gather_course_data_from_api(account_id: int, term_ids: Sequence[int]) -> pd.DataFrame:
-    logger.info('** gather_course_data_from_api')
-    url_ending_with_scope = f'{API_SCOPE_PREFIX}/accounts/{account_id}/courses'
+def get_last_page_num(response: Response) -> Union[int, None]:
+    last_link = response.links.get('last')
+    if last_link is None:
+        return None
+    page_values = parse_qs(urlparse(last_link['url']).query).get('page', [])
+    try:
+        return int(page_values[0])
+    except (IndexError, ValueError):
+        # Some Canvas endpoints use opaque bookmarks instead of page numbers
+        return None
+
+
+def fetch_course_page(url: str, params: Dict[str, Any]) -> Tuple[Response, List[Dict]]:
+    response = make_request_using_api_utils(url, params)
+    return (response, json.loads(response.text))
+
+
+def fetch_course_dicts_concurrently(
+    url: str,
+    term_params: Sequence[Dict[str, Any]],
+    on_courses: Union[Callable[[List[Dict[str, Any]]], None], None] = None
+) -> List[Dict[str, Any]]:
+    """
+    Fetches course pages for all terms at once. After the first page for a term arrives, the remaining
+    pages are requested using page numbers computed from the "last" Link header when Canvas provides it;
+    otherwise, the "next" link is requested as soon as the previous page arrives. Pages are slimmed as
+    they complete (and passed to on_courses, if provided) and then reassembled in term and page order,
+    matching the sequential process.
+    """
+    logger.info('Fetching course data for all terms concurrently')
+    slim_pages: Dict[Tuple[int, int], List[Dict[str, Any]]] = {}
+
+    with ThreadPoolExecutor(max_workers=get_controller('rest').max_limit) as executor:
+        # Maps in-flight futures to (term index, page number, whether the page number was computed)
+        in_flight: Dict[Future, Tuple[int, int, bool]] = {}
+        for term_index, params in enumerate(term_params):
+            future = executor.submit(fetch_course_page, url, params)
+            in_flight[future] = (term_index, 1, False)
+
+        while in_flight:
+            done, _ = wait(in_flight.keys(), return_when=FIRST_COMPLETED)
+            for future in done:
+                term_index, page_num, page_num_computed = in_flight.pop(future)
+                response, course_data = future.result()
+
+                if page_num == 1:
+                    last_page_num = get_last_page_num(response)
+                    if last_page_num is not None:
+                        term_id = term_params[term_index]['enrollment_term_id']
+                        logger.info(f'Found {last_page_num} course page(s) for term {term_id}')
+                        next_params = API_UTIL.get_next_page(response)
+                        for later_page_num in range(2, last_page_num + 1):
+                            page_params = dict(next_params)
+                            page_params['page'] = str(later_page_num)
+                            later_future = executor.submit(fetch_course_page, url, page_params)
+                            in_flight[later_future] = (term_index, later_page_num, True)
+                        page_num_computed = True
+
+                if not page_num_computed:
+                    next_params = API_UTIL.get_next_page(response)
+                    if next_params:
+                        next_future = executor.submit(fetch_course_page, url, next_params)
+                        in_flight[next_future] = (term_index, page_num + 1, False)
+
+                # Slimming happens here while later pages are still being fetched
+                slim_pages[(term_index, page_num)] = slim_down_course_data(course_data)
+                if on_courses is not None:
+                    on_courses(slim_pages[(term_index, page_num)])
+                logger.info(f'Course pages collected: {len(slim_pages)}')
 
     course_dicts: List[Dict[str, Any]] = []
-    for term_id in term_ids:
-        logger.info(f'Fetching course data for term {term_id}')
+    for page_key in sorted(slim_pages.keys()):
+        course_dicts += slim_pages[page_key]
+    return course_dicts
+
+
+def gather_course_data_from_api(
+    account_id: int,
+    term_ids: Sequence[int],
+    on_courses: Union[Callable[[List[Dict[str, Any]]], None], None] = None
+) -> pd.DataFrame:
+    """
+    Lists the courses in the given terms. If on_courses is provided, it receives each page of slimmed
+    course records as soon as the page arrives.
+    """
+    logger.info('** gather_course_data_from_api')
+    url_ending_with_scope = f'{API_SCOPE_PREFIX}/accounts/{account_id}/courses'
 
-        params = {
+    term_params = [
+        {
             'with_enrollments': True,
             'enrollment_type': ['student', 'teacher'],
             'enrollment_term_id': term_id,
             'per_page': 100,
             'include': ['total_students']
         }
+        for term_id in term_ids
+    ]
 
-        # Make first course request
-        page_num = 1
-        logger.info(f'Course Page Number: {page_num}')
-        response = make_request_using_api_utils(url_ending_with_scope, params)
-        all_course_data = json.loads(response.text)
-        course_dicts += slim_down_course_data(all_course_data)
-        more_pages = True
-
-        while more_pages:
-            next_params = API_UTIL.get_next_page(response)
-            if next_params:
-                page_num += 1
-                logger.info(f'Course Page Number: {page_num}')
-                response = make_request_using_api_utils(url_ending_with_scope, next_params)
-                all_course_data = json.loads(response.text)
-                course_dicts += slim_down_course_data(all_course_data)
-            else:
-                logger.info('No more pages!')
-                more_pages = False
+    course_dicts: List[Dict[str, Any]] = []
+    if CONCURRENT_COURSE_LISTING:
+        course_dicts = fetch_course_dicts_concurrently(url_ending_with_scope, term_params, on_courses)
+    else:
+        for params in term_params:
+            logger.info(f'Fetching course data for term {params["enrollment_term_id"]}')
+
+            # Make first course request
+            page_num = 1
+            logger.info(f'Course Page Number: {page_num}')
+            response = make_request_using_api_utils(url_ending_with_scope, params)
+            all_course_data = json.loads(response.text)
+            slim_course_dicts = slim_down_course_data(all_course_data)
+            course_dicts += slim_course_dicts
+            if on_courses is not None:
+                on_courses(slim_course_dicts)
+            more_pages = True
+
+            while more_pages:
+                next_params = API_UTIL.get_next_page(response)
+                if next_params:
+                    page_num += 1
+                    logger.info(f'Course Page Number: {page_num}')
+                    response = make_request_using_api_utils(url_ending_with_scope, next_params)
+                    all_course_data = json.loads(response.text)
+                    slim_course_dicts = slim_down_course_data(all_course_data)
+                    course_dicts += slim_course_dicts
+                    if on_courses is not None:
+                        on_courses(slim_course_dicts)
+                else:
+                    logger.info('No more pages!')
+                    more_pages = False
 
     num_course_dicts = len(course_dicts)
     logger.info(f'Total course records for all active terms: {num_course_dicts}')
@@ -176,12 +317,120 @@ def gather_course_data_from_api(account_id: int, term_ids: Sequence[int]) -> pd.
     logger.info(f'Course records with students: {num_course_dicts_with_students}')
     logger.info(f'Dropped {num_course_dicts - num_course_dicts_with_students} records')
 
+    # total_students is kept so later steps can use it; it is dropped before output is produced
     course_df = pd.DataFrame(course_dicts_with_students)
-    course_df = course_df.drop(['total_students'], axis='columns')
     logger.debug(course_df.head())
     return course_df
 
 
+def stream_course_data_from_api(account_id: int, term_ids: Sequence[int], course_stream: CourseStream) -> pd.DataFrame:
+    """
+    Lists the courses in the given terms, passing each page to the later stages through course_stream.
+    The stream is closed even if listing fails, so the stages waiting on it can finish.
+    """
+    try:
+        return gather_course_data_from_api(account_id, term_ids, on_courses=course_stream.add_courses)
+    finally:
+        course_stream.close()
+
+
+def find_known_published_dates(
+    course_ids: Sequence[int],
+    published_date_cache: PublishedDateCache,
+    stream_course_date: Dict[int, str],
+    published_course_date: Dict[int, str],
+    search_start_times: Dict[int, datetime]
+) -> List[int]:
+    """
+    Adds the published dates of courses found in the cache or the account audit stream to
+    published_course_date, and returns the IDs of the courses that still need to be looked up. Those
+    searched before without finding a date are added to search_start_times, so only their later events
+    are looked up.
+    """
+    published_course_date.update(published_date_cache.get_cached_dates(course_ids))
+    uncached_course_ids = [course_id for course_id in course_ids if course_id not in published_course_date.keys()]
+    for course_id in uncached_course_ids:
+        if course_id in stream_course_date:
+            published_course_date[course_id] = stream_course_date[course_id]
+    lookup_course_ids = [
+        course_id for course_id in uncached_course_ids if course_id not in published_course_date.keys()
+    ]
+    search_start_times.update(published_date_cache.get_search_start_times(lookup_course_ids))
+    return lookup_course_ids
+
+
+def resolve_published_dates(
+    db_creator_obj: DBCreator,
+    course_ids: Union[Sequence[int], WorkFeed]
+) -> Dict[int, str]:
+    """
+    Finds the published dates of the given courses. Dates found by earlier runs come from the cache.
+    When PUBLISHED_DATE_RESOLVER is "account", courses published since the previous run are found in
+    the account audit stream; the rest (e.g. all uncached courses on the first run) are looked up
+    one course at a time. course_ids may be a WorkFeed, in which case courses are resolved as they
+    arrive.
+    """
+    # Published dates don't change once found, so only courses without a cached date are looked up
+    published_date_cache = PublishedDateCache(db_creator_obj, CANVAS_DATETIME_FORMAT)
+    published_course_date: Dict[int, str] = {}
+    stream_course_date: Dict[int, str] = {}
+    search_start_times: Dict[int, datetime] = {}
+
+    # Courses looked up without finding a date are recorded as searched through this time, too
+    stream_end_time = pd.to_datetime(time.time(), unit='s').to_pydatetime()
+    move_watermark = False
+    if PUBLISHED_DATE_RESOLVER == 'account':
+        watermark = db_creator_obj.get_watermark(PUBLISHED_DATE_WATERMARK)
+        if watermark is None:
+            # The per-course lookups below catch up on everything, so the next run can start streaming
+            logger.info('No audit stream watermark was found; published dates will be looked up per course')
+            move_watermark = True
+        else:
+            account_dates = FetchAccountPublishedDates(CANVAS_URL, CANVAS_TOKEN, ACCOUNT_ID, MAX_REQ_ATTEMPTS)
+            account_course_date = account_dates.get_published_dates(watermark, stream_end_time)
+            if account_course_date is not None:
+                move_watermark = True
+                stream_course_date = {
+                    int(course_id): published_at for course_id, published_at in account_course_date.items()
+                }
+
+    if isinstance(course_ids, WorkFeed):
+        # Courses that need a lookup are passed on as they arrive, while earlier ones are being looked up
+        uncached_course_ids: Union[List[int], WorkFeed] = WorkFeed()
+        published_dates = FetchPublishedDate(
+            CANVAS_URL, CANVAS_TOKEN, uncached_course_ids, resume=RESUME, max_attempts=MAX_REQ_ATTEMPTS,
+            search_start_times=search_start_times, searched_at=stream_end_time
+        )
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            fetch_future = executor.submit(published_dates.get_published_course_date, uncached_course_ids)
+            try:
+                for new_course_ids in course_ids:
+                    uncached_course_ids.put(find_known_published_dates(
+                        new_course_ids, published_date_cache, stream_course_date, published_course_date,
+                        search_start_times
+                    ))
+            finally:
+                uncached_course_ids.close()
+            fetched_course_date = fetch_future.result()
+    else:
+        uncached_course_ids = find_known_published_dates(
+            course_ids, published_date_cache, stream_course_date, published_course_date, search_start_times
+        )
+        published_dates = FetchPublishedDate(
+            CANVAS_URL, CANVAS_TOKEN, uncached_course_ids, resume=RESUME, max_attempts=MAX_REQ_ATTEMPTS,
+            search_start_times=search_start_times, searched_at=stream_end_time
+        )
+        fetched_course_date = published_dates.get_published_course_date(uncached_course_ids)
+
+    published_date_cache.record_metrics()
+    published_course_date.update(fetched_course_date)
+    published_date_cache.add_dates(published_course_date)
+    published_date_cache.add_searched_through(published_dates.searched_through)
+    if move_watermark:
+        db_creator_obj.set_watermark(PUBLISHED_DATE_WATERMARK, stream_end_time)
+    return published_course_date
+
+
 # Function(s) - UDW
 
 def process_sis_id(orig_sis_id: str) -> Union[int, None]:
@@ -218,134 +467,298 @@ def run_course_inventory() -> Sequence[Dict[str, Union[ValidDataSourceName, pd.T
     # Gather term data
     term_df = gather_term_data_from_api(ACCOUNT_ID, TERM_IDS)
 
-    # Gather course data
-    course_df = gather_course_data_from_api(ACCOUNT_ID, TERM_IDS)
+    # Initialize DBCreator object
+    db_creator_obj = DBCreator(INVENTORY_DB)
+    # Records are written to the DB by the loader's thread, so fetching doesn't wait on inserts. Leaving
+    # the block waits for the queued writes, and raises an error in any of them if the job succeeded
+    with WriteBehindLoader(db_creator_obj, 'course_inventory') as loader:
+
+        # Only gather enrollments for courses that look changed since the previous run
+        change_detector = None
+        if ENROLLMENT_CHANGE_DETECTION:
+            change_detector = EnrollmentChangeDetector(db_creator_obj, ENROLLMENT_FULL_REFRESH_DAYS)
+
+        course_stream = None
+        if STREAMING_STAGES:
+            # Courses are passed to the later stages page by page as they are listed, and the stages run at
+            # the same time, sharing each endpoint class's concurrency limit and the Canvas rate-limit budget
+            course_stream = CourseStream(change_detector)
+            course_student_counts = course_stream.course_student_counts
+            course_available_ids: Union[List[int], WorkFeed] = course_stream.published_date_feed
+            usage_course_ids: Union[List[int], WorkFeed] = course_stream.usage_feed
+            enroll_course_ids: Union[List[int], WorkFeed] = course_stream.enrollment_feed
+        else:
+            # Gather course data
+            course_df = gather_course_data_from_api(ACCOUNT_ID, TERM_IDS)
+            course_student_counts = course_df.set_index('canvas_id')['total_students'].to_dict()
+            if change_detector is not None:
+                enroll_course_ids = change_detector.find_changed_courses(course_df)
+            else:
+                enroll_course_ids = course_df['canvas_id'].to_list()
+            course_available_ids = course_df.loc[course_df.workflow_state == 'available', 'canvas_id'].to_list()
+            usage_course_ids = course_available_ids
+
+        usage_staging = None
+        on_usage_chunk = None
+        if CANVAS_COURSE_USAGE_STREAMING:
+            # Usage records are flushed to a staging table in chunks as they arrive, rather than held in memory
+            usage_staging = CanvasCourseUsageStaging(db_creator_obj)
+            usage_staging.clear()
+            on_usage_chunk = partial(loader.submit, usage_staging.add_chunk)
+        canvas_course_usage = CanvasCourseUsage(
+            CANVAS_URL, CANVAS_TOKEN, MAX_REQ_ATTEMPTS, usage_course_ids,
+            course_sizes=course_student_counts,
+            largest_first=LARGEST_FIRST_SCHEDULING,
+            resume=RESUME,
+            on_chunk=on_usage_chunk,
+            chunk_size=CANVAS_COURSE_USAGE_CHUNK_SIZE
+        )
+
+        enroll_gatherer = AsyncEnrollGatherer(
+            course_ids=enroll_course_ids,
+            access_token=CANVAS_TOKEN,
+            complete_url=CANVAS_URL + '/api/graphql',
+            gql_query=QUERIES['course_enrollments_lean'] if LEAN_ENROLLMENT_QUERY else QUERIES['course_enrollments'],
+            enroll_page_size=75,
+            max_attempts=MAX_REQ_ATTEMPTS,
+            batch_size=ENROLL_BATCH_SIZE,
+            page_size_hints=course_student_counts,
+            largest_first=LARGEST_FIRST_SCHEDULING,
+            lean=LEAN_ENROLLMENT_QUERY,
+            enrollment_types=ENROLLMENT_TYPES,
+            resume=RESUME
+        )
+
+        if course_stream is not None:
+            logger.info("*** Listing courses while fetching published dates, usage data, and enrollments ***")
+            # The stages overlap, so the duration reported below covers all of them
+            enroll_start = time.time()
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                course_future = executor.submit(stream_course_data_from_api, ACCOUNT_ID, TERM_IDS, course_stream)
+                published_date_future = executor.submit(resolve_published_dates, db_creator_obj, course_available_ids)
+                usage_future = executor.submit(canvas_course_usage.gather)
+                enroll_future = executor.submit(enroll_gatherer.gather)
+                course_df = course_future.result()
+                published_course_date = published_date_future.result()
+                usage_future.result()
+                enroll_future.result()
+        else:
+            logger.info("*** Fetching the published date ***")
+            published_course_date = resolve_published_dates(db_creator_obj, course_available_ids)
+
+            logger.info("*** Fetching the canvas course usage data ***")
+            canvas_course_usage.gather()
 
-    logger.info("*** Fetching the published date ***")
-    course_available_df = course_df.loc[course_df.workflow_state == 'available'].copy()
-    course_available_ids = course_available_df['canvas_id'].to_list()
-    published_dates = FetchPublishedDate(CANVAS_URL, CANVAS_TOKEN, NUM_ASYNC_WORKERS, course_available_ids)
-    published_course_date = published_dates.get_published_course_date(course_available_ids)
-    course_published_date_df = pd.DataFrame(published_course_date.items(), columns=['canvas_id', 'published_at'])
-    course_df = pd.merge(course_df, course_published_date_df, on='canvas_id', how='left')
+            # Gather enrollment and section data
+            enroll_start = time.time()
+            enroll_gatherer.gather()
 
-    logger.info("*** Checking for courses available and no published date ***")
-    logger.info(course_df[(course_df['workflow_state'] == 'available') & (course_df['published_at'].isnull())])
+        course_df = course_df.drop(['total_students'], axis='columns')
+        course_published_date_df = pd.DataFrame(published_course_date.items(), columns=['canvas_id', 'published_at'])
+        course_df = pd.merge(course_df, course_published_date_df, on='canvas_id', how='left')
+
+        logger.info("*** Checking for courses available and no published date ***")
+        logger.info(course_df[(course_df['workflow_state'] == 'available') & (course_df['published_at'].isnull())])
     
-    course_df['created_at'] = pd.to_datetime(course_df['created_at'],
-                                             format=CANVAS_DATETIME_FORMAT,
-                                             errors='coerce')
-    course_df['published_at'] = pd.to_datetime(course_df['published_at'],
-                                               format=CANVAS_DATETIME_FORMAT,
-                                               errors='coerce')
-
-    logger.info("*** Fetching the canvas course usage data ***")
-    canvas_course_usage = CanvasCourseUsage(CANVAS_URL, CANVAS_TOKEN, MAX_REQ_ATTEMPTS, course_available_ids)
-    canvas_course_usage_df = canvas_course_usage.get_canvas_course_views_participation_data()
-
-    # Gather enrollment and section data
-    course_ids = course_df['canvas_id'].to_list()
-
-    enroll_start = time.time()
-    enroll_gatherer = AsyncEnrollGatherer(
-        course_ids=course_ids,
-        access_token=CANVAS_TOKEN,
-        complete_url=CANVAS_URL + '/api/graphql',
-        gql_query=QUERIES['course_enrollments'],
-        enroll_page_size=75,
-        num_workers=NUM_ASYNC_WORKERS
-    )
-    enroll_gatherer.gather()
-    enrollment_df, section_df = enroll_gatherer.generate_output()
-    enroll_delta = time.time() - enroll_start
-    logger.info(f'Duration of process (seconds): {enroll_delta}')
-
-    # Record data source info for Canvas API
-    canvas_data_source = {
-        'data_source_name': ValidDataSourceName.CANVAS_API,
-        'data_updated_at': pd.to_datetime(time.time(), unit='s', utc=True)
-    }
-
-    udw_conn = psycopg2.connect(**ENV['UDW'])
-
-    # Pull SIS course section data from UDW
-    udw_section_ids = section_df['canvas_id'].to_list()
-    sis_section_df = pull_sis_section_data_from_udw(udw_section_ids, udw_conn)
-    section_df = pd.merge(section_df, sis_section_df, on='canvas_id', how='left')
-
-    # Record data source info for UDW
-    udw_meta_df = pd.read_sql('''
-        SELECT *
-        FROM unizin_metadata
-        WHERE key='canvasdatadate';
-    ''', udw_conn)
-    udw_update_datetime_str = udw_meta_df['value'].iloc[0]
-    udw_update_datetime = pd.to_datetime(udw_update_datetime_str, format='%Y-%m-%d %H:%M:%S.%f%z')
-    logger.info(f'Found canvasdatadate in UDW of {udw_update_datetime}')
-
-    udw_data_source = {
-        'data_source_name': ValidDataSourceName.UNIZIN_DATA_WAREHOUSE,
-        'data_updated_at': udw_update_datetime
-    }
-
-    # Produce output
-    num_term_records = len(term_df)
-    num_course_records = len(course_df)
-    num_section_records = len(section_df)
-    num_enrollment_records = len(enrollment_df)
-    num_canvas_usage_records = len(canvas_course_usage_df)
-
-    if CREATE_CSVS:
-        # Generate CSV Output
-        logger.info(f'Writing {num_term_records} term records to CSV')
-        term_df.to_csv(os.path.join('data', 'term.csv'), index=False)
-        logger.info('Wrote data to data/term.csv')
-
-        logger.info(f'Writing {num_course_records} course records to CSV')
-        course_df.to_csv(os.path.join('data', 'course.csv'), index=False)
-        logger.info('Wrote data to data/course.csv')
-
-        logger.info(f'Writing {num_section_records} course_section records to CSV')
-        section_df.to_csv(os.path.join('data', 'course_section.csv'), index=False)
-        logger.info('Wrote data to data/course_section.csv')
-
-        logger.info(f'Writing {num_enrollment_records} enrollment records to CSV')
-        enrollment_df.to_csv(os.path.join('data', 'enrollment.csv'), index=False)
-        logger.info('Wrote data to data/enrollment.csv')
-
-        logger.info(f"Writing {num_canvas_usage_records} canvas course usage records to CSV")
-        canvas_course_usage_df.to_csv(os.path.join('data', 'canvas_course_usage.csv'), index=False)
-        logger.info('Wrote data to data/canvas_course_usage.csv')
+        course_df['created_at'] = pd.to_datetime(course_df['created_at'],
+                                                 format=CANVAS_DATETIME_FORMAT,
+                                                 errors='coerce')
+        course_df['published_at'] = pd.to_datetime(course_df['published_at'],
+                                                   format=CANVAS_DATETIME_FORMAT,
+                                                   errors='coerce')
+
+        usage_watermarks = None
+        if usage_staging is not None:
+            # In streaming mode, the records were flushed to the staging table as they arrived
+            canvas_course_usage_df = None
+            num_canvas_usage_records = canvas_course_usage.num_records
+        else:
+            canvas_course_usage_df = canvas_course_usage.canvas_course_usage_to_df()
+            if CANVAS_COURSE_USAGE_INCREMENTAL:
+                # Only days after each course's last complete date are loaded; the rest are already stored
+                usage_watermarks = CanvasCourseUsageWatermarks(db_creator_obj, CANVAS_COURSE_USAGE_SETTLE_DAYS)
+                canvas_course_usage_df = usage_watermarks.filter_new_days(canvas_course_usage_df)
+
+        enrollment_df, section_df = enroll_gatherer.generate_output()
+        if change_detector is not None:
+            enrollment_df, section_df = change_detector.add_carried_records(enrollment_df, section_df)
+        if len(enroll_gatherer.failed_course_ids) > 0:
+            # Courses that could not be gathered keep their stored records until a later run gathers them
+            failed_enrollment_df, failed_section_df = read_stored_records(
+                db_creator_obj, enroll_gatherer.failed_course_ids
+            )
+            logger.info(
+                f'Keeping {len(failed_enrollment_df)} stored enrollment records for '
+                f'{len(enroll_gatherer.failed_course_ids)} courses that could not be gathered'
+            )
+            enrollment_df, section_df = add_stored_records(
+                enrollment_df, section_df, failed_enrollment_df, failed_section_df
+            )
+        enroll_delta = time.time() - enroll_start
+        logger.info(f'Duration of process (seconds): {enroll_delta}')
+
+        # Report the request concurrency each Canvas endpoint class settled on, and how requests were retried and hedged
+        record_concurrency_metrics()
+        get_retry_engine().record_metrics()
+        record_hedging_metrics()
+
+        # Record data source info for Canvas API
+        canvas_data_source = {
+            'data_source_name': ValidDataSourceName.CANVAS_API,
+            'data_updated_at': pd.to_datetime(time.time(), unit='s', utc=True)
+        }
 
-    # Initialize DBCreator object
-    db_creator_obj = DBCreator(INVENTORY_DB)
+        udw_conn = psycopg2.connect(**ENV['UDW'])
+
+        # Pull SIS course section data from UDW
+        udw_section_ids = section_df['canvas_id'].to_list()
+        sis_section_df = pull_sis_section_data_from_udw(udw_section_ids, udw_conn)
+        section_df = pd.merge(section_df, sis_section_df, on='canvas_id', how='left')
+
+        # Record data source info for UDW
+        udw_meta_df = pd.read_sql('''
+            SELECT *
+            FROM unizin_metadata
+            WHERE key='canvasdatadate';
+        ''', udw_conn)
+        udw_update_datetime_str = udw_meta_df['value'].iloc[0]
+        udw_update_datetime = pd.to_datetime(udw_update_datetime_str, format='%Y-%m-%d %H:%M:%S.%f%z')
+        logger.info(f'Found canvasdatadate in UDW of {udw_update_datetime}')
+
+        udw_data_source = {
+            'data_source_name': ValidDataSourceName.UNIZIN_DATA_WAREHOUSE,
+            'data_updated_at': udw_update_datetime
+        }
 
-    # Empty records from Canvas data tables in database
-    logger.info('Emptying Canvas data tables in DB')
-    db_creator_obj.drop_records(
-        ['course', 'canvas_course_usage', 'course_section', 'enrollment', 'term']
-    )
+        # Nothing in the Canvas tables is replaced until all the data is in hand, so a failure before this
+        # point leaves the DB as it was; the loader writes it while the CSVs are produced
+        num_term_records = len(term_df)
+        num_course_records = len(course_df)
+        num_section_records = len(section_df)
+        num_enrollment_records = len(enrollment_df)
+        if canvas_course_usage_df is not None:
+            num_canvas_usage_records = len(canvas_course_usage_df)
+
+        canvas_table_names = ['course', 'canvas_course_usage', 'course_section', 'enrollment', 'term']
+        # With hash loading, only the changed records in these tables are written; the others are replaced
+        synced_table_names = ['course', 'course_section', 'enrollment'] if HASH_LOAD else []
+        replaced_table_names = [table_name for table_name in canvas_table_names if table_name not in synced_table_names]
+        load_table_names = {table_name: table_name for table_name in canvas_table_names}
+        if ENROLLMENT_CHANGE_CAPTURE:
+            # Queued first, so the enrollment table still holds the previous load when it is compared
+            loader.submit(
+                capture_enrollment_changes, db_creator_obj, enrollment_df, enroll_gatherer.failed_course_ids
+            )
+        if SHADOW_LOAD:
+            # Records are loaded into shadow tables that replace the current ones at once, so readers never
+            # see empty or partly loaded tables; earlier usage days are copied over in incremental mode
+            logger.info('Creating shadow tables for Canvas data in DB')
+            for table_name in replaced_table_names:
+                load_table_names[table_name] = db_creator_obj.get_shadow_table_name(table_name)
+            usage_copy_table_names = ['canvas_course_usage'] if CANVAS_COURSE_USAGE_INCREMENTAL else []
+            loader.submit(db_creator_obj.create_shadow_tables, replaced_table_names, usage_copy_table_names)
+        else:
+            # Empty records from Canvas data tables in database
+            logger.info('Emptying Canvas data tables in DB')
+            drop_table_names = replaced_table_names.copy()
+            if CANVAS_COURSE_USAGE_INCREMENTAL:
+                # Usage records are upserted instead, so earlier days are kept
+                drop_table_names.remove('canvas_course_usage')
+            loader.submit(db_creator_obj.drop_records, drop_table_names)
+
+        def write_records(table_name: str, df: pd.DataFrame) -> None:
+            if table_name in synced_table_names:
+                logger.info(f'Syncing {len(df)} {table_name} records to DB')
+                loader.submit(db_creator_obj.sync_records, table_name, df)
+            else:
+                logger.info(f'Inserting {len(df)} {table_name} records to DB')
+                loader.load(load_table_names[table_name], df)
+
+        # Insert gathered data
+        write_records('term', term_df)
+        write_records('course', course_df)
+
+        # Usage watermarks are only advanced once the usage records are in the live table; the loader skips
+        # this if an earlier write (such as the shadow table swap) fails, so those days are fetched again
+        advance_usage_watermarks = None
+        if usage_staging is not None:
+            logger.info(f"Moving {num_canvas_usage_records} staged canvas_course_usage records to DB")
+            loader.submit(
+                usage_staging.load,
+                CANVAS_COURSE_USAGE_SETTLE_DAYS if CANVAS_COURSE_USAGE_INCREMENTAL else None,
+                load_table_names['canvas_course_usage']
+            )
+            if CANVAS_COURSE_USAGE_INCREMENTAL:
+                advance_usage_watermarks = partial(usage_staging.save_watermarks, CANVAS_COURSE_USAGE_SETTLE_DAYS)
+        elif usage_watermarks is not None:
+            logger.info(f"Upserting {num_canvas_usage_records} canvas_course_usage records to DB")
+            loader.submit(
+                db_creator_obj.upsert_records, load_table_names['canvas_course_usage'], canvas_course_usage_df
+            )
+            advance_usage_watermarks = partial(usage_watermarks.save, canvas_course_usage_df)
+        else:
+            logger.info(f"Inserting {num_canvas_usage_records} canvas_course_usage records to DB")
+            loader.load(load_table_names['canvas_course_usage'], canvas_course_usage_df)
+
+        write_records('course_section', section_df)
+        write_records('enrollment', enrollment_df)
+
+        if SHADOW_LOAD:
+            record_counts = {
+                'term': num_term_records,
+                'course': num_course_records,
+                'course_section': num_section_records,
+                'enrollment': num_enrollment_records
+            }
+            # Earlier usage days copied over may belong to courses that are no longer listed
+            loader.submit(
+                db_creator_obj.swap_shadow_tables,
+                replaced_table_names,
+                expected_counts={
+                    table_name: count for table_name, count in record_counts.items()
+                    if table_name in replaced_table_names
+                },
+                orphan_check_table_names=[
+                    table_name for table_name in replaced_table_names if table_name not in usage_copy_table_names
+                ]
+            )
+
+        if advance_usage_watermarks is not None:
+            loader.submit(advance_usage_watermarks)
+
+        if change_detector is not None:
+            loader.submit(change_detector.save_signals, enrollment_df, enroll_gatherer.failed_course_ids)
 
-    # Insert gathered data
-    logger.info(f'Inserting {num_term_records} term records to DB')
-    term_df.to_sql('term', db_creator_obj.engine, if_exists='append', index=False)
-    logger.info(f'Inserted data into term table in {db_creator_obj.db_name}')
+        # Produce output
+        if CREATE_CSVS:
+            # Generate CSV Output
+            logger.info(f'Writing {num_term_records} term records to CSV')
+            term_df.to_csv(os.path.join('data', 'term.csv'), index=False)
+            logger.info('Wrote data to data/term.csv')
 
-    logger.info(f'Inserting {num_course_records} course records to DB')
-    course_df.to_sql('course', db_creator_obj.engine, if_exists='append', index=False)
-    logger.info(f'Inserted data into course table in {db_creator_obj.db_name}')
+            logger.info(f'Writing {num_course_records} course records to CSV')
+            course_df.to_csv(os.path.join('data', 'course.csv'), index=False)
+            logger.info('Wrote data to data/course.csv')
 
-    logger.info(f'Inserting {num_section_records} section records to DB')
-    section_df.to_sql('course_section', db_creator_obj.engine, if_exists='append', index=False)
-    logger.info(f'Inserted data into section table in {db_creator_obj.db_name}')
+            logger.info(f'Writing {num_section_records} course_section records to CSV')
+            section_df.to_csv(os.path.join('data', 'course_section.csv'), index=False)
+            logger.info('Wrote data to data/course_section.csv')
+
+            logger.info(f'Writing {num_enrollment_records} enrollment records to CSV')
+            enrollment_df.to_csv(os.path.join('data', 'enrollment.csv'), index=False)
+            logger.info('Wrote data to data/enrollment.csv')
+
+            if canvas_course_usage_df is None:
+                logger.info('Canvas course usage records were streamed to the DB, so no CSV will be written')
+            else:
+                logger.info(f"Writing {num_canvas_usage_records} canvas course usage records to CSV")
+                canvas_course_usage_df.to_csv(os.path.join('data', 'canvas_course_usage.csv'), index=False)
+                logger.info('Wrote data to data/canvas_course_usage.csv')
 
-    logger.info(f'Inserting {num_enrollment_records} enrollment records to DB')
-    enrollment_df.to_sql('enrollment', db_creator_obj.engine, if_exists='append', index=False)
-    logger.info(f'Inserted data into enrollment table in {db_creator_obj.db_name}')
+    logger.info(f'Inserted Canvas data into {db_creator_obj.db_name}')
 
-    logger.info(f"Inserting {num_canvas_usage_records} canvas_course_usage records to DB")
-    canvas_course_usage_df.to_sql('canvas_course_usage', db_creator_obj.engine, if_exists='append', index=False)
-    logger.info(f'Inserted data into canvas_course_usage table in {db_creator_obj.db_name}')
+    # The gathered data is stored, so the next run should start from scratch
+    clear_checkpoints(['published_dates', 'canvas_course_usage', 'enrollments'])
 
     return [canvas_data_source, udw_data_source]
 
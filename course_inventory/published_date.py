@@ -2,22 +2,66 @@ import logging
 import time
 import json
 from json.decoder import JSONDecodeError
-from requests_futures.sessions import FuturesSession
-from concurrent.futures import as_completed
+from functools import partial
+
+import pandas as pd
+from requests.exceptions import RequestException
+
+from api.checkpoint import Checkpoint
+from api.concurrency import get_controller
+from api.hedging import get_hedger
+from api.progress import ProgressTracker
+from api.retry import get_retry_engine
+from api.scheduler import DelayedItem, WorkFeed, WorkQueueScheduler
+from api.transport import get_transport
+from job_metadata import record_metric
 
 
 logger = logging.getLogger(__name__)
 
+# The audit APIs take start_time and end_time in this format (in UTC)
+AUDIT_TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
 
 class FetchPublishedDate:
 
-    def __init__(self, canvas_url, canvas_token, num_workers, canvas_ids):
+    def __init__(self, canvas_url, canvas_token, canvas_ids, resume=False, max_attempts=3, search_start_times=None,
+                 searched_at=None):
         self.canvas_url = canvas_url
         self.canvas_token = canvas_token
         self.canvas_ids = canvas_ids
-        self.num_workers = num_workers
+        self.max_attempts = max_attempts
         self.published_course_date = {}
-        self.published_course_next_page_list = []
+        # Courses searched by an earlier run without finding a published date only need their events since
+        # then; search_start_times maps their IDs to that time. Courses this search finishes without a date
+        # are recorded in searched_through, as searched through searched_at (when the lookups began).
+        self.search_start_times = search_start_times if search_start_times is not None else {}
+        self.searched_at = searched_at
+        self.searched_through = {}
+        self.num_failures = {}
+        # canvas_ids may be a WorkFeed, in which case courses are searched as they arrive
+        self.progress = ProgressTracker(
+            'FetchPublishedDate', total=None if isinstance(canvas_ids, WorkFeed) else len(canvas_ids)
+        )
+        # Courses are checkpointed once their search is over, with or without a published date
+        self.checkpoint = Checkpoint('published_dates', resume=resume)
+        self.completed_course_ids = set()
+        self.num_resumed_courses = 0
+
+    @staticmethod
+    def get_course_id(response):
+        # Both the first and the next page URLs look like .../audit/course/courses/{course_id}?...
+        return int(response.result().url.split('courses/')[1].split('?')[0].split('/')[0])
+
+    def complete_course(self, course_id, published_at=None):
+        searched_through = None
+        if published_at is None and self.searched_at is not None:
+            searched_through = self.searched_at.strftime(AUDIT_TIME_FORMAT)
+            self.searched_through.update({course_id: searched_through})
+        self.checkpoint.append(
+            {'course_id': course_id, 'published_at': published_at, 'searched_through': searched_through}
+        )
+        self.progress.complete_item()
 
     def get_next_page_url(self, response):
         """
@@ -34,36 +78,45 @@ class FetchPublishedDate:
             return None
 
         if 'next' in results:
-            url_ = results['next']['url']
-            self.published_course_next_page_list.append(url_)
-            logger.info(f"Pagination size {len(self.published_course_next_page_list)} for published_at date")
+            return results['next']['url']
+        return None
 
     def published_date_resp_parsing(self, response):
+        """
+        parse an audit log page, returning whether the request failed and the course's next page url
+        if its published date was not found
+        :param response:
+        :type response: concurrent.futures.Future
+        :return: failed, next_page_url
+        :rtype: tuple
+        """
 
-        logger.info("published_date_resp_parsing Call")
+        logger.debug("published_date_resp_parsing Call")
 
         if response is None:
             logger.info(f"Published course date response is None ")
-            return
+            return False, None
 
         start_time = time.time()
 
-        logger.info(f"published courses date collected so far : {len(self.published_course_date)}")
+        self.progress.record_request(len(response.result().content))
         status = response.result().status_code
         published_date_found = False
         if status != 200:
             logger.info(f"Response not successful with status code {status} due to {response.result().text}")
-            return
+            return True, None
 
         try:
             audit_events = json.loads(response.result().text)
         except JSONDecodeError as e:
             logger.error(f"Error in parsing the response {e.msg}")
-            return
+            return True, None
 
+        self.progress.record_page()
         if not audit_events:
             logger.info(f"Response for fetching published date is empty {audit_events}")
-            return
+            self.complete_course(self.get_course_id(response))
+            return False, None
 
         events = audit_events['events']
 
@@ -74,41 +127,305 @@ class FetchPublishedDate:
                 course_id = event['links']['course']
                 published_date_found = True
                 self.published_course_date.update({course_id: event['created_at']})
-                logger.info(f"Published Date {event['created_at']} for course {course_id}")
+                self.complete_course(course_id, event['created_at'])
+                logger.debug(f"Published Date {event['created_at']} for course {course_id}")
                 break
+        next_page_url = None
         if not published_date_found:
-            self.get_next_page_url(response)
+            next_page_url = self.get_next_page_url(response)
+            if next_page_url is None:
+                self.complete_course(self.get_course_id(response))
 
         seconds = time.time() - start_time
         str_time = time.strftime("%H:%M:%S", time.gmtime(seconds))
         logger.debug(f"Parsing the published date took {str_time} ")
-        return
+        return False, next_page_url
 
-    def get_published_course_date(self, course_ids, next_page_links=None):
-        logger.info("Starting of get_published_course_date call")
-        with FuturesSession(max_workers=self.num_workers) as session:
-            headers = {'Content-type': 'application/json', 'Authorization': 'Bearer ' + self.canvas_token}
-            if next_page_links is not None:
-                logger.info("Going through Next page URL set")
-                responses = []
-                for next_page_link in next_page_links:
-                    response = session.get(next_page_link, headers=headers)
-                    self.published_course_next_page_list.remove(next_page_link)
-                    responses.append(response)
-            else:
-                logger.info("Initial Round of Fetching course published date")
-                responses = [
-                    session.get(f'{self.canvas_url}/api/v1/audit/course/courses/{course_id}?per_page=100',
-                                headers=headers)
-                    for course_id in course_ids
-                ]
-
-            for response in as_completed(responses):
-                self.published_date_resp_parsing(response)
-
-        if len(self.published_course_next_page_list) != 0:
-            logger.info(f"""Pagination size {len(self.published_course_next_page_list)} with published_at date items
-                         {self.published_course_next_page_list}""")
-            self.get_published_course_date(course_ids, self.published_course_next_page_list)
+    def restore_checkpoint(self):
+        """
+        Restores the published dates found by an interrupted run, and the courses whose search finished
+        """
+        for record in self.checkpoint.load():
+            self.completed_course_ids.add(int(record['course_id']))
+            if record['published_at'] is not None:
+                self.published_course_date.update({record['course_id']: record['published_at']})
+            elif record.get('searched_through') is not None:
+                self.searched_through.update({int(record['course_id']): record['searched_through']})
 
+    def prepare_courses(self, course_ids):
+        """
+        Skips the courses whose search finished in an interrupted run and returns the first page urls
+        of the rest; called with each list of courses as it arrives
+        :param course_ids:
+        :type course_ids: list
+        :return: first_page_urls
+        :rtype: list
+        """
+        remaining_course_ids = [course_id for course_id in course_ids if course_id not in self.completed_course_ids]
+        self.num_resumed_courses += len(course_ids) - len(remaining_course_ids)
+        for _ in range(len(course_ids) - len(remaining_course_ids)):
+            self.progress.start_item()
+            self.progress.complete_item()
+        for _ in remaining_course_ids:
+            self.progress.start_item()
+        first_page_urls = []
+        for course_id in remaining_course_ids:
+            url = f'{self.canvas_url}/api/v1/audit/course/courses/{course_id}?per_page=100'
+            if course_id in self.search_start_times:
+                url += f'&start_time={self.search_start_times[course_id].strftime(AUDIT_TIME_FORMAT)}'
+            first_page_urls.append(url)
+        return first_page_urls
+
+    def get_published_course_date(self, course_ids):
+        self.restore_checkpoint()
+        with self.progress, self.checkpoint:
+            return self._get_published_course_date(course_ids)
+
+    def make_request(self, session, urls):
+        headers = {'Content-type': 'application/json', 'Authorization': 'Bearer ' + self.canvas_token}
+        return get_hedger('audit').send(partial(session.get, urls[0], headers=headers))
+
+    def handle_response(self, urls, response):
+        # A course's next page is requested as soon as this one is parsed; courses stop once a date is found
+        url = urls[0]
+        try:
+            result = response.result()
+        except RequestException as e:
+            logger.warning(f"The request for {url} raised an exception: {e}")
+            result = None
+        if result is not None:
+            failed, next_page_url = self.published_date_resp_parsing(response)
+            if not failed:
+                return [] if next_page_url is None else [next_page_url]
+
+        # Only the failed page is retried, so the rest of the course's search is not repeated
+        self.num_failures[url] = self.num_failures.get(url, 0) + 1
+        delay = get_retry_engine().get_retry_delay(
+            'audit', self.num_failures[url], self.max_attempts,
+            response=result, retryable_error=result is not None and result.status_code == 200
+        )
+        if delay is not None:
+            logger.info(f"Retrying {url} in {delay:.1f} seconds (failures: {self.num_failures[url]})")
+            return [DelayedItem(url, delay)]
+        logger.warning(f"{url} could not be fetched after {self.num_failures[url]} attempts")
+        self.progress.fail_item()
+        return []
+
+    def _get_published_course_date(self, course_ids):
+        logger.info("Starting of get_published_course_date call")
+        controller = get_controller('audit')
+        with get_transport().futures_session('audit') as session:
+            scheduler = WorkQueueScheduler(
+                send=partial(self.make_request, session),
+                handle=self.handle_response,
+                get_window=lambda: int(controller.limit)
+            )
+            scheduler.run(course_ids, prepare=self.prepare_courses)
+        if self.num_resumed_courses > 0:
+            logger.info(f"Skipped {self.num_resumed_courses} courses searched by an interrupted run")
         return self.published_course_date
+
+
+class FetchAccountPublishedDates:
+    """
+    Resolves published dates from the account-level course audit stream, which lists events for every
+    course in the account. Only the events in a time window are read, so the number of requests scales
+    with the amount of activity since the previous run rather than with the number of courses.
+    """
+
+    def __init__(self, canvas_url, canvas_token, account_id, max_attempts):
+        self.canvas_url = canvas_url
+        self.canvas_token = canvas_token
+        self.account_id = account_id
+        self.max_attempts = max_attempts
+        self.progress = ProgressTracker('FetchAccountPublishedDates')
+
+    def get_page(self, session, url, params=None):
+        """
+        get one page of the audit stream, retrying irregular responses
+        :param session:
+        :type session: requests.Session
+        :param url:
+        :type url: str
+        :param params:
+        :type params: dict
+        :return: response, audit_events, or None, None if all attempts failed
+        :rtype: tuple
+        """
+        headers = {'Content-type': 'application/json', 'Authorization': 'Bearer ' + self.canvas_token}
+        retry_engine = get_retry_engine()
+        for attempt in range(1, self.max_attempts + 1):
+            invalid_json = False
+            try:
+                response = session.get(url, headers=headers, params=params)
+            except RequestException as e:
+                logger.warning(f"The request raised an exception: {e} (attempt {attempt})")
+                response = None
+            if response is not None:
+                self.progress.record_request(len(response.content))
+                if response.status_code != 200:
+                    logger.info(f"Response not successful with status code {response.status_code} (attempt {attempt})")
+                else:
+                    try:
+                        return response, json.loads(response.text)
+                    except JSONDecodeError as e:
+                        logger.error(f"Error in parsing the response {e.msg} (attempt {attempt})")
+                        invalid_json = True
+            delay = retry_engine.get_retry_delay(
+                'audit', attempt, self.max_attempts, response=response, retryable_error=invalid_json
+            )
+            if delay is None:
+                break
+            time.sleep(delay)
+        return None, None
+
+    def get_published_dates(self, start_time, end_time):
+        """
+        get the latest published date in the window for every course published during it
+        :param start_time:
+        :type start_time: datetime
+        :param end_time:
+        :type end_time: datetime
+        :return: published_course_date, or None if the stream could not be read completely
+        :rtype: dict
+        """
+        logger.info(f"Reading the account course audit stream from {start_time} to {end_time}")
+        published_course_date = {}
+        session = get_transport().session
+        url = f'{self.canvas_url}/api/v1/audit/course/accounts/{self.account_id}'
+        params = {
+            'start_time': start_time.strftime(AUDIT_TIME_FORMAT),
+            'end_time': end_time.strftime(AUDIT_TIME_FORMAT),
+            'per_page': 100
+        }
+        with self.progress:
+            while url is not None:
+                response, audit_events = self.get_page(session, url, params)
+                if response is None:
+                    logger.error("The account course audit stream could not be read completely")
+                    return None
+                self.progress.record_page()
+
+                for event in audit_events.get('events', []) if audit_events else []:
+                    if event['event_type'] != 'published':
+                        continue
+                    course_id = event['links']['course']
+                    if course_id not in published_course_date or event['created_at'] > published_course_date[course_id]:
+                        published_course_date[course_id] = event['created_at']
+
+                next_link = response.links.get('next')
+                # The next link already carries the query parameters
+                url, params = (next_link['url'], None) if next_link else (None, None)
+
+        logger.info(f"Found published dates for {len(published_course_date)} courses in the audit stream")
+        return published_course_date
+
+
+class PublishedDateCache:
+    """
+    Keeps the published dates found by earlier runs in the course_published_date table, which is not
+    emptied between runs, so only courses without a known date need to be looked up in the audit log.
+    Courses whose audit log had no published event are kept in the course_published_date_search table
+    with the time they were searched through, so later lookups only need the events since then.
+    """
+
+    def __init__(self, db_creator_obj, canvas_datetime_format):
+        self.db_creator_obj = db_creator_obj
+        self.canvas_datetime_format = canvas_datetime_format
+        self.cache_df = None
+        self.cached_course_ids = set()
+        self.searched_through = None
+        self.num_hits = 0
+        self.num_misses = 0
+        self.num_resumed_searches = 0
+
+    def get_cached_dates(self, course_ids):
+        """
+        get the cached published dates for the given courses; the table is read on the first call, so
+        courses can be looked up a page at a time
+        :param course_ids:
+        :type course_ids: list
+        :return: published_course_date
+        :rtype: dict
+        """
+        if self.cache_df is None:
+            self.cache_df = pd.read_sql('course_published_date', self.db_creator_obj.engine)
+            self.cached_course_ids = set(self.cache_df['course_id'].to_list())
+
+        course_id_set = set(course_ids)
+        cache_df = self.cache_df.loc[self.cache_df['course_id'].isin(course_id_set)]
+        # Dates are formatted like the audit API's, so they can be handled the same way as fetched ones
+        published_course_date = dict(zip(
+            cache_df['course_id'].to_list(),
+            pd.to_datetime(cache_df['published_at']).dt.strftime(self.canvas_datetime_format).to_list()
+        ))
+
+        self.num_hits += len(published_course_date)
+        self.num_misses += len(course_id_set) - len(published_course_date)
+        return published_course_date
+
+    def get_search_start_times(self, course_ids):
+        """
+        get the times through which the given courses' audit logs were searched without finding a
+        published date; the table is read on the first call
+        :param course_ids:
+        :type course_ids: list
+        :return: search_start_times
+        :rtype: dict
+        """
+        if self.searched_through is None:
+            search_df = pd.read_sql('course_published_date_search', self.db_creator_obj.engine)
+            self.searched_through = dict(zip(
+                search_df['course_id'].to_list(),
+                pd.to_datetime(search_df['searched_through']).dt.to_pydatetime().tolist()
+            ))
+
+        search_start_times = {
+            course_id: self.searched_through[course_id] for course_id in course_ids
+            if course_id in self.searched_through
+        }
+        self.num_resumed_searches += len(search_start_times)
+        return search_start_times
+
+    def record_metrics(self):
+        logger.info(
+            f"Published date cache: {self.num_hits} hits and {self.num_misses} misses, of which "
+            f"{self.num_resumed_searches} were searched before without a published date"
+        )
+        record_metric('published_date_cache_hits', self.num_hits)
+        record_metric('published_date_cache_misses', self.num_misses)
+        record_metric('published_date_cache_resumed_searches', self.num_resumed_searches)
+
+    def add_dates(self, published_course_date):
+        new_dates = [
+            (int(course_id), published_at) for course_id, published_at in published_course_date.items()
+            if int(course_id) not in self.cached_course_ids
+        ]
+        if len(new_dates) == 0:
+            return
+        new_date_df = pd.DataFrame(new_dates, columns=['course_id', 'published_at'])
+        new_date_df['published_at'] = pd.to_datetime(
+            new_date_df['published_at'], format=self.canvas_datetime_format, errors='coerce'
+        )
+        new_date_df = new_date_df.dropna().drop_duplicates(subset=['course_id'])
+        # The table may already have some of the courses (e.g. if it wasn't read this run), and
+        # the date stored first is kept
+        self.db_creator_obj.bulk_load('course_published_date', new_date_df, keep_existing=True)
+        self.cached_course_ids.update(new_date_df['course_id'].to_list())
+        logger.info(f"Added {len(new_date_df)} published dates to the cache")
+
+    def add_searched_through(self, searched_through):
+        """
+        record the times through which courses' audit logs were searched without finding a published date
+        :param searched_through:
+        :type searched_through: dict
+        """
+        if len(searched_through) == 0:
+            return
+        search_df = pd.DataFrame(
+            [(int(course_id), time_str) for course_id, time_str in searched_through.items()],
+            columns=['course_id', 'searched_through']
+        )
+        search_df['searched_through'] = pd.to_datetime(search_df['searched_through'], format=AUDIT_TIME_FORMAT)
+        self.db_creator_obj.upsert_records('course_published_date_search', search_df)
+        logger.info(f"Recorded {len(search_df)} courses searched without finding a published date")
@@ -2,14 +2,22 @@
 from __future__ import annotations
 
 # standard libraries
-import logging, os
-from typing import Dict, List, Sequence, Union
+import logging, os, time
+from datetime import datetime
+from typing import Any, Dict, List, Sequence, Tuple, Union
 from urllib.parse import quote_plus
 
 # third-party libraries
-from sqlalchemy.engine import create_engine, Engine
+import numpy as np
+import pandas as pd
+from sqlalchemy import bindparam, text
+from sqlalchemy.engine import Connection, create_engine, Engine
 from yoyo import get_backend, read_migrations
 
+# local libraries
+from environ import ENV
+from job_metadata import record_metric
+
 
 # Initialize settings and global variables
 
@@ -18,6 +26,16 @@ logger = logging.getLogger(__name__)
 PARENT_PATH = os.path.dirname(os.path.abspath(__file__))
 MIGRATIONS_PATH = os.path.join(PARENT_PATH, 'migrations')
 
+# Suffixes for the tables a shadow load fills, and for the tables it replaces while they're dropped
+SHADOW_SUFFIX = '_shadow'
+REPLACED_SUFFIX = '_replaced'
+
+BULK_LOAD_CONFIG: Dict[str, Any] = ENV.get('BULK_LOAD', {})
+# The number of rows sent in each multi-row INSERT statement
+BULK_LOAD_BATCH_SIZE: int = BULK_LOAD_CONFIG.get('BATCH_SIZE', 1000)
+# Whether unique and foreign key checks are turned off while a table is loaded
+BULK_LOAD_RELAX_CHECKS: bool = BULK_LOAD_CONFIG.get('RELAX_CHECKS', False)
+
 
 class DBCreator:
     '''
@@ -92,9 +110,526 @@ class DBCreator:
             logger.debug(f'Table Name: {drop_table_name}')
             conn.execute(f'DELETE FROM {drop_table_name};')
             logger.info(f'Dropped records in {drop_table_name} in {self.db_name}')
+        self.clear_row_hashes(conn, [table_name for table_name in drop_table_names if table_name != 'load_row_hash'])
         conn.execute('SET FOREIGN_KEY_CHECKS=1;')
         return self
 
+    def upsert_records(self, table_name: str, df: pd.DataFrame) -> DBCreator:
+        '''
+        Inserts the records in the DataFrame into the specified table, updating the other columns
+        of existing records that share a primary or unique key with a new record.
+        '''
+        logger.debug('upsert_records')
+        if len(df) == 0:
+            return self
+        columns = df.columns.to_list()
+        upsert_statement = text(f'''
+            INSERT INTO {table_name} ({', '.join(columns)})
+            VALUES ({', '.join(':' + column for column in columns)})
+            ON DUPLICATE KEY UPDATE {', '.join(f'{column} = VALUES({column})' for column in columns)};
+        ''')
+        # Converting to objects turns NumPy scalars into Python values the driver can escape
+        records = df.astype(object).where(df.notnull(), None).to_dict('records')
+        conn = self.engine.connect()
+        conn.execute(upsert_statement, records)
+        conn.close()
+        logger.info(f'Upserted {len(records)} records into {table_name} in {self.db_name}')
+        return self
+
+    @staticmethod
+    def get_db_rows(df: pd.DataFrame) -> List[Tuple[Any, ...]]:
+        '''
+        Converts the DataFrame's records to tuples of Python values the driver can escape, with None
+        for missing values. Datetimes are made naive in UTC, as MySQL DATETIME columns expect.
+        '''
+        columns = []
+        for column_name in df.columns:
+            series = df[column_name]
+            missing = series.isnull().to_numpy()
+            if pd.api.types.is_datetime64tz_dtype(series):
+                series = series.dt.tz_convert(None)
+            if pd.api.types.is_datetime64_any_dtype(series):
+                values = series.dt.to_pydatetime().astype(object)
+            else:
+                # Converting to objects turns NumPy scalars into Python values
+                values = series.to_numpy(dtype=object, copy=True)
+            values[missing] = None
+            columns.append(values)
+        return list(zip(*columns))
+
+    @staticmethod
+    def get_row_hashes(df: pd.DataFrame) -> pd.Series:
+        '''
+        Hashes each record by its values alone, so the hash doesn't depend on the column order or on the
+        dtypes pandas chose (e.g. IDs held as float64 because of missing values rather than as Int64).
+        Values are compared as strings after integral floats and booleans are made integers, datetimes
+        are made naive in UTC, and missing values are made None.
+        '''
+        def normalize(value: Any) -> Any:
+            if isinstance(value, (bool, np.bool_)):
+                return int(value)
+            if isinstance(value, (float, np.floating)) and float(value).is_integer():
+                return int(value)
+            return value
+
+        normalized_columns = {}
+        for column_name in sorted(df.columns.to_list()):
+            series = df[column_name]
+            missing = series.isnull().to_numpy()
+            if pd.api.types.is_datetime64tz_dtype(series):
+                series = series.dt.tz_convert(None)
+            values = np.array([str(normalize(value)) for value in series.to_numpy(dtype=object)], dtype=object)
+            values[missing] = None
+            normalized_columns[column_name] = values
+        return pd.util.hash_pandas_object(pd.DataFrame(normalized_columns), index=False)
+
+    @staticmethod
+    def insert_batches(
+        cursor: Any,
+        table_name: str,
+        columns: List[str],
+        rows: List[Tuple[Any, ...]],
+        batch_size: int,
+        insert_suffix: str = ''
+    ) -> None:
+        '''
+        Sends the rows using a DBAPI cursor in multi-row INSERT statements of batch_size rows, each
+        ending with insert_suffix (e.g. an ON DUPLICATE KEY UPDATE clause).
+        '''
+        insert_prefix = f"INSERT INTO {table_name} ({', '.join(f'`{column}`' for column in columns)}) VALUES "
+        row_placeholder = '(' + ', '.join(['%s'] * len(columns)) + ')'
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            statement = insert_prefix + ', '.join([row_placeholder] * len(batch)) + insert_suffix
+            cursor.execute(statement, [value for row in batch for value in row])
+
+    def bulk_load(
+        self,
+        table_name: str,
+        df: pd.DataFrame,
+        batch_size: Union[int, None] = None,
+        relax_checks: Union[bool, None] = None,
+        keep_existing: bool = False
+    ) -> DBCreator:
+        '''
+        Appends the records in the DataFrame to the specified table using multi-row INSERT statements
+        of batch_size rows, committed together in a single transaction. With relax_checks, unique and
+        foreign key checks are turned off for the transaction, which should only be used when the
+        records are known to be valid. With keep_existing, records that share a primary or unique key
+        with an existing record are skipped instead of raising an error. batch_size and relax_checks
+        default to the BULK_LOAD settings.
+        '''
+        logger.debug('bulk_load')
+        if len(df) == 0:
+            return self
+        batch_size = BULK_LOAD_BATCH_SIZE if batch_size is None else batch_size
+        relax_checks = BULK_LOAD_RELAX_CHECKS if relax_checks is None else relax_checks
+
+        columns = df.columns.to_list()
+        rows = self.get_db_rows(df)
+        insert_suffix = f' ON DUPLICATE KEY UPDATE `{columns[0]}` = `{columns[0]}`' if keep_existing else ''
+
+        started_at = time.time()
+        # The DBAPI connection is used directly so the rows skip SQLAlchemy's per-row processing
+        conn = self.engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            if relax_checks:
+                cursor.execute('SET UNIQUE_CHECKS=0, FOREIGN_KEY_CHECKS=0;')
+            try:
+                self.insert_batches(cursor, table_name, columns, rows, batch_size, insert_suffix)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                if relax_checks:
+                    # The connection goes back to the pool, so the session settings are restored
+                    cursor.execute('SET UNIQUE_CHECKS=1, FOREIGN_KEY_CHECKS=1;')
+                cursor.close()
+        finally:
+            conn.close()
+        logger.info(
+            f'Inserted {len(rows)} records into {table_name} in {self.db_name} '
+            f'in {time.time() - started_at:.1f} seconds'
+        )
+        return self
+
+    def sync_records(
+        self,
+        table_name: str,
+        df: pd.DataFrame,
+        key_column: str = 'canvas_id',
+        batch_size: Union[int, None] = None
+    ) -> Dict[str, int]:
+        '''
+        Makes the specified table match the records in the DataFrame by changing only what differs.
+        A hash of each record is compared with the hash stored in load_row_hash for its key by the
+        previous sync, and the new, changed, and removed records are then inserted, updated, and
+        deleted in batches of batch_size, committed with the new hashes in a single transaction.
+        If the table doesn't match its stored hashes (e.g. on the first sync, or after the table was
+        emptied another way), it is emptied and loaded in full. The counts of inserted, updated,
+        deleted, and unchanged records are logged, recorded as job metrics, and returned.
+        '''
+        logger.debug('sync_records')
+        batch_size = BULK_LOAD_BATCH_SIZE if batch_size is None else batch_size
+        started_at = time.time()
+
+        new_hashes: Dict[Any, int] = dict(zip(df[key_column].to_list(), self.get_row_hashes(df).to_list()))
+
+        conn = self.engine.connect()
+        stored_hashes: Dict[Any, int] = dict(conn.execute(
+            text('SELECT row_key, row_hash FROM load_row_hash WHERE table_name = :table_name;'),
+            table_name=table_name
+        ).fetchall())
+        num_table_records = conn.execute(f'SELECT COUNT(*) FROM {table_name};').scalar()
+        conn.close()
+        full_load = num_table_records != len(stored_hashes)
+        if full_load:
+            logger.warning(
+                f'{table_name} has {num_table_records} records but {len(stored_hashes)} stored hashes, '
+                'so it will be loaded in full'
+            )
+            stored_hashes = {}
+
+        inserted_keys = [key for key in new_hashes if key not in stored_hashes]
+        updated_keys = [
+            key for key, row_hash in new_hashes.items()
+            if key in stored_hashes and stored_hashes[key] != row_hash
+        ]
+        deleted_keys = [key for key in stored_hashes if key not in new_hashes]
+
+        columns = df.columns.to_list()
+        update_suffix = ' ON DUPLICATE KEY UPDATE ' + ', '.join(
+            f'`{column}` = VALUES(`{column}`)' for column in columns if column != key_column
+        )
+        inserted_rows = self.get_db_rows(df.loc[df[key_column].isin(inserted_keys)])
+        updated_rows = self.get_db_rows(df.loc[df[key_column].isin(updated_keys)])
+        hash_rows = [(table_name, key, new_hashes[key]) for key in inserted_keys + updated_keys]
+
+        conn = self.engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            # Related tables are synced separately, so references are only consistent once all are done;
+            # this also keeps deletes from cascading to records that are synced on their own
+            cursor.execute('SET FOREIGN_KEY_CHECKS=0;')
+            try:
+                if full_load:
+                    cursor.execute(f'DELETE FROM {table_name};')
+                    cursor.execute('DELETE FROM load_row_hash WHERE table_name = %s;', [table_name])
+                for start in range(0, len(deleted_keys), batch_size):
+                    batch = deleted_keys[start:start + batch_size]
+                    placeholders = ', '.join(['%s'] * len(batch))
+                    cursor.execute(f'DELETE FROM {table_name} WHERE `{key_column}` IN ({placeholders});', batch)
+                    cursor.execute(
+                        f'DELETE FROM load_row_hash WHERE table_name = %s AND row_key IN ({placeholders});',
+                        [table_name] + batch
+                    )
+                self.insert_batches(cursor, table_name, columns, inserted_rows, batch_size)
+                self.insert_batches(cursor, table_name, columns, updated_rows, batch_size, update_suffix)
+                self.insert_batches(
+                    cursor, 'load_row_hash', ['table_name', 'row_key', 'row_hash'], hash_rows, batch_size,
+                    ' ON DUPLICATE KEY UPDATE `row_hash` = VALUES(`row_hash`)'
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cursor.execute('SET FOREIGN_KEY_CHECKS=1;')
+                cursor.close()
+        finally:
+            conn.close()
+
+        counts = {
+            'inserted': len(inserted_keys),
+            'updated': len(updated_keys),
+            'deleted': len(deleted_keys),
+            'unchanged': len(new_hashes) - len(inserted_keys) - len(updated_keys)
+        }
+        logger.info(
+            f"Synced {table_name} in {self.db_name} in {time.time() - started_at:.1f} seconds: "
+            f"{counts['inserted']} inserted, {counts['updated']} updated, {counts['deleted']} deleted, "
+            f"{counts['unchanged']} unchanged"
+        )
+        for change, count in counts.items():
+            record_metric(f'{table_name}_records_{change}', count)
+        return counts
+
+    def clear_row_hashes(self, conn: Connection, table_names: Sequence[str]) -> None:
+        '''
+        Removes the hashes stored by sync_records for the specified tables, which must be done whenever
+        their records are replaced some other way.
+        '''
+        if 'load_row_hash' not in self.get_table_names() or len(table_names) == 0:
+            return
+        conn.execute(
+            text('DELETE FROM load_row_hash WHERE table_name IN :table_names;').bindparams(
+                bindparam('table_names', expanding=True)
+            ),
+            table_names=list(table_names)
+        )
+
+    def get_watermark(self, name: str) -> Union[datetime, None]:
+        '''
+        Gets the named watermark (the point up to which some incremental process has caught up),
+        or None if it has not been set.
+        '''
+        logger.debug('get_watermark')
+        conn = self.engine.connect()
+        result = conn.execute(text('SELECT value FROM watermark WHERE name = :name;'), name=name)
+        row = result.fetchone()
+        conn.close()
+        return None if row is None else row[0]
+
+    def set_watermark(self, name: str, value: datetime) -> DBCreator:
+        '''
+        Creates or moves the named watermark.
+        '''
+        logger.debug('set_watermark')
+        conn = self.engine.connect()
+        conn.execute(
+            text('''
+                INSERT INTO watermark (name, value) VALUES (:name, :value)
+                ON DUPLICATE KEY UPDATE value = VALUES(value);
+            '''),
+            name=name,
+            value=value
+        )
+        conn.close()
+        logger.info(f'Set watermark {name} to {value}')
+        return self
+
+    @staticmethod
+    def get_shadow_table_name(table_name: str) -> str:
+        return table_name + SHADOW_SUFFIX
+
+    def get_foreign_keys(self, table_names: Sequence[str]) -> List[Dict[str, Any]]:
+        '''
+        Gets the foreign keys that belong to or reference any of the specified tables.
+        '''
+        logger.debug('get_foreign_keys')
+        conn = self.engine.connect()
+        result = conn.execute(
+            text('''
+                SELECT k.CONSTRAINT_NAME, k.TABLE_NAME, k.COLUMN_NAME, k.REFERENCED_TABLE_NAME,
+                    k.REFERENCED_COLUMN_NAME, r.UPDATE_RULE, r.DELETE_RULE
+                FROM information_schema.KEY_COLUMN_USAGE k
+                JOIN information_schema.REFERENTIAL_CONSTRAINTS r
+                    ON k.CONSTRAINT_SCHEMA = r.CONSTRAINT_SCHEMA AND k.CONSTRAINT_NAME = r.CONSTRAINT_NAME
+                WHERE k.TABLE_SCHEMA = :db_name AND k.REFERENCED_TABLE_NAME IS NOT NULL
+                ORDER BY k.TABLE_NAME, k.CONSTRAINT_NAME, k.ORDINAL_POSITION;
+            '''),
+            db_name=self.db_name
+        )
+        foreign_keys: Dict[str, Dict[str, Any]] = {}
+        for row in result:
+            name, table_name, column, ref_table_name, ref_column, update_rule, delete_rule = row
+            if table_name not in table_names and ref_table_name not in table_names:
+                continue
+            if name not in foreign_keys:
+                foreign_keys[name] = {
+                    'name': name,
+                    'table_name': table_name,
+                    'columns': [],
+                    'ref_table_name': ref_table_name,
+                    'ref_columns': [],
+                    'update_rule': update_rule,
+                    'delete_rule': delete_rule
+                }
+            foreign_keys[name]['columns'].append(column)
+            foreign_keys[name]['ref_columns'].append(ref_column)
+        conn.close()
+        return list(foreign_keys.values())
+
+    def create_shadow_tables(
+        self,
+        table_names: Sequence[str],
+        copy_table_names: Sequence[str] = ()
+    ) -> DBCreator:
+        '''
+        Creates an empty shadow copy of each specified table (see get_shadow_table_name), replacing any
+        left by an earlier run, so new records can be loaded while readers still see the current ones.
+        Shadow tables have the same columns and indexes but no foreign keys; swap_shadow_tables checks
+        the records instead. Tables in copy_table_names start with a copy of their current records.
+        '''
+        logger.debug('create_shadow_tables')
+        conn = self.engine.connect()
+        for table_name in table_names:
+            shadow_table_name = self.get_shadow_table_name(table_name)
+            conn.execute(f'DROP TABLE IF EXISTS {shadow_table_name};')
+            conn.execute(f'CREATE TABLE {shadow_table_name} LIKE {table_name};')
+            if table_name in copy_table_names:
+                conn.execute(f'INSERT INTO {shadow_table_name} SELECT * FROM {table_name};')
+            logger.info(f'Created {shadow_table_name} in {self.db_name}')
+        conn.close()
+        return self
+
+    def validate_shadow_tables(
+        self,
+        table_names: Sequence[str],
+        foreign_keys: List[Dict[str, Any]],
+        expected_counts: Dict[str, int],
+        orphan_check_table_names: Sequence[str]
+    ) -> None:
+        '''
+        Raises a ValueError describing every record count or foreign key check the shadow tables fail.
+        '''
+        conn = self.engine.connect()
+        problems = []
+        for table_name, expected_count in expected_counts.items():
+            shadow_table_name = self.get_shadow_table_name(table_name)
+            count = conn.execute(f'SELECT COUNT(*) FROM {shadow_table_name};').scalar()
+            if count != expected_count:
+                problems.append(f'{shadow_table_name} has {count} records, but {expected_count} were expected')
+        for foreign_key in foreign_keys:
+            if foreign_key['table_name'] not in orphan_check_table_names:
+                continue
+            ref_table_name = foreign_key['ref_table_name']
+            if ref_table_name in table_names:
+                ref_table_name = self.get_shadow_table_name(ref_table_name)
+            join_condition = ' AND '.join(
+                f'c.{column} = p.{ref_column}'
+                for column, ref_column in zip(foreign_key['columns'], foreign_key['ref_columns'])
+            )
+            num_orphans = conn.execute(f'''
+                SELECT COUNT(*)
+                FROM {self.get_shadow_table_name(foreign_key['table_name'])} c
+                LEFT JOIN {ref_table_name} p ON {join_condition}
+                WHERE p.{foreign_key['ref_columns'][0]} IS NULL AND c.{foreign_key['columns'][0]} IS NOT NULL;
+            ''').scalar()
+            if num_orphans > 0:
+                problems.append(f"{num_orphans} records would violate {foreign_key['name']}")
+        conn.close()
+        if len(problems) > 0:
+            raise ValueError('Shadow tables failed validation: ' + '; '.join(problems))
+
+    @staticmethod
+    def get_add_foreign_key_ddl(foreign_key: Dict[str, Any]) -> str:
+        return (
+            f"ALTER TABLE {foreign_key['table_name']} "
+            f"ADD CONSTRAINT {foreign_key['name']} "
+            f"FOREIGN KEY ({', '.join(foreign_key['columns'])}) "
+            f"REFERENCES {foreign_key['ref_table_name']}({', '.join(foreign_key['ref_columns'])}) "
+            f"ON UPDATE {foreign_key['update_rule']} ON DELETE {foreign_key['delete_rule']};"
+        )
+
+    @staticmethod
+    def run_foreign_key_ddl(conn: Connection, ddl: str) -> None:
+        '''
+        Runs a statement that drops or adds a foreign key. A failure is logged and the remaining
+        statements still run; check_foreign_keys then reports what is missing.
+        '''
+        try:
+            conn.execute(ddl)
+        except Exception as e:
+            logger.error(f'Failed to run "{ddl}": {e}')
+
+    def check_foreign_keys(self, foreign_keys: List[Dict[str, Any]]) -> None:
+        '''
+        Checks that the foreign keys exist again after a swap, and counts records violating them, since
+        foreign keys added with FOREIGN_KEY_CHECKS=0 aren't validated. Violations are logged as warnings;
+        if a foreign key is missing, a RuntimeError giving the statements needed to restore it is raised.
+        '''
+        table_names = list({foreign_key['table_name'] for foreign_key in foreign_keys})
+        # A foreign key that kept its name may still point at a replaced table
+        current_foreign_keys = self.get_foreign_keys(table_names)
+        restored_keys = {(foreign_key['name'], foreign_key['ref_table_name']) for foreign_key in current_foreign_keys}
+        current_names = {foreign_key['name'] for foreign_key in current_foreign_keys}
+        missing_foreign_keys = [
+            foreign_key for foreign_key in foreign_keys
+            if (foreign_key['name'], foreign_key['ref_table_name']) not in restored_keys
+        ]
+
+        conn = self.engine.connect()
+        for foreign_key in foreign_keys:
+            if foreign_key in missing_foreign_keys:
+                continue
+            join_condition = ' AND '.join(
+                f'c.{column} = p.{ref_column}'
+                for column, ref_column in zip(foreign_key['columns'], foreign_key['ref_columns'])
+            )
+            num_orphans = conn.execute(f'''
+                SELECT COUNT(*)
+                FROM {foreign_key['table_name']} c
+                LEFT JOIN {foreign_key['ref_table_name']} p ON {join_condition}
+                WHERE p.{foreign_key['ref_columns'][0]} IS NULL AND c.{foreign_key['columns'][0]} IS NOT NULL;
+            ''').scalar()
+            if num_orphans > 0:
+                logger.warning(
+                    f"{num_orphans} records in {foreign_key['table_name']} violate {foreign_key['name']}"
+                )
+        conn.close()
+
+        if len(missing_foreign_keys) > 0:
+            restore_ddl = ' '.join(
+                (
+                    f"ALTER TABLE {foreign_key['table_name']} DROP FOREIGN KEY {foreign_key['name']}; "
+                    if foreign_key['name'] in current_names else ''
+                ) + self.get_add_foreign_key_ddl(foreign_key)
+                for foreign_key in missing_foreign_keys
+            )
+            raise RuntimeError(
+                f'{len(missing_foreign_keys)} foreign keys were not restored after the swap; '
+                f'with FOREIGN_KEY_CHECKS=0, run: {restore_ddl}'
+            )
+        logger.info(f'Restored {len(foreign_keys)} foreign keys')
+
+    def swap_shadow_tables(
+        self,
+        table_names: Sequence[str],
+        expected_counts: Union[Dict[str, int], None] = None,
+        orphan_check_table_names: Union[Sequence[str], None] = None
+    ) -> DBCreator:
+        '''
+        Checks the shadow tables created by create_shadow_tables, then replaces the specified tables
+        with them using a single RENAME TABLE, so readers switch from the old records to the new ones
+        at once. The shadow tables are checked against expected_counts (record counts by table name)
+        and for records in orphan_check_table_names (by default, all of the specified tables) that would
+        violate a foreign key; if any check fails, a ValueError is raised and the tables are left as they
+        were. The replaced tables are then dropped, and the foreign keys belonging to or referencing the
+        specified tables are created again, so they point at the new tables; see check_foreign_keys.
+        Records in tables left out of orphan_check_table_names (e.g. usage days copied into the shadow
+        table) are only reported, so such a load can bring back records that violate a foreign key.
+        '''
+        logger.debug('swap_shadow_tables')
+        expected_counts = {} if expected_counts is None else expected_counts
+        orphan_check_table_names = table_names if orphan_check_table_names is None else orphan_check_table_names
+        foreign_keys = self.get_foreign_keys(table_names)
+        self.validate_shadow_tables(table_names, foreign_keys, expected_counts, orphan_check_table_names)
+
+        conn = self.engine.connect()
+        conn.execute('SET FOREIGN_KEY_CHECKS=0;')
+        try:
+            for table_name in table_names:
+                conn.execute(f'DROP TABLE IF EXISTS {table_name}{REPLACED_SUFFIX};')
+            renames = []
+            for table_name in table_names:
+                renames.append(f'{table_name} TO {table_name}{REPLACED_SUFFIX}')
+                renames.append(f'{self.get_shadow_table_name(table_name)} TO {table_name}')
+            conn.execute(f"RENAME TABLE {', '.join(renames)};")
+            logger.info(f"Swapped in new records for {', '.join(table_names)} in {self.db_name}")
+            try:
+                self.clear_row_hashes(conn, table_names)
+                # Foreign keys on other tables may have followed the replaced tables, and their names must be free
+                for foreign_key in foreign_keys:
+                    if foreign_key['table_name'] not in table_names:
+                        self.run_foreign_key_ddl(
+                            conn, f"ALTER TABLE {foreign_key['table_name']} DROP FOREIGN KEY {foreign_key['name']};"
+                        )
+                for table_name in table_names:
+                    conn.execute(f'DROP TABLE {table_name}{REPLACED_SUFFIX};')
+            finally:
+                # The new tables are live, so their foreign keys are restored even if something above failed
+                for foreign_key in foreign_keys:
+                    self.run_foreign_key_ddl(conn, self.get_add_foreign_key_ddl(foreign_key))
+        finally:
+            conn.execute('SET FOREIGN_KEY_CHECKS=1;')
+            conn.close()
+        logger.info('Dropped the replaced tables')
+        self.check_foreign_keys(foreign_keys)
+        return self
+
     def reset_database(self) -> DBCreator:
         '''
         Drops records in application-managed tables and applies outstanding migrations
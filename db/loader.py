@@ -0,0 +1,150 @@
+# standard libraries
+import logging, queue, threading, time
+from typing import Any, Callable, Dict, Tuple, Union
+
+# third-party libraries
+import pandas as pd
+
+# local libraries
+from db.db_creator import DBCreator
+from environ import ENV
+from job_metadata import record_metric
+
+
+# Initialize settings and global variables
+
+logger = logging.getLogger(__name__)
+
+# The number of writes that may wait for the loader before producers are made to wait; 0 writes inline
+DB_LOADER_QUEUE_DEPTH: int = ENV.get('DB_LOADER_QUEUE_DEPTH', 4)
+
+
+# Class(es)
+
+class LoaderError(Exception):
+    '''
+    Raised in a producer when a write it handed to a WriteBehindLoader failed.
+    '''
+    pass
+
+
+class WriteBehindLoader:
+    '''
+    Writes data to the database on a background thread, so producers can keep fetching while earlier
+    data is being loaded. Writes run one at a time in the order they were submitted, so a write can
+    rely on earlier ones (e.g. inserts after a table is emptied, or child records after their parents).
+
+    At most queue_depth writes wait to be run; submitting another blocks the producer until the worker
+    catches up. If a write fails, the writes after it are skipped, and the error is raised as a
+    LoaderError by the producer's next call to submit, load, flush, or close. With a queue_depth of 0,
+    writes run right away in the producer's thread. Use start and close, or use it as a context manager.
+    '''
+
+    def __init__(self, db_creator_obj: DBCreator, name: str, queue_depth: int = DB_LOADER_QUEUE_DEPTH) -> None:
+        self.db_creator_obj: DBCreator = db_creator_obj
+        self.name: str = name
+        self.queue_depth: int = queue_depth
+        self.tasks: queue.Queue = queue.Queue(maxsize=max(queue_depth, 1))
+        self.worker_thread: Union[threading.Thread, None] = None
+        self.error: Union[Exception, None] = None
+
+        self.num_writes: int = 0
+        self.load_seconds: float = 0.0
+        self.wait_seconds: float = 0.0
+        self.lock: threading.Lock = threading.Lock()
+
+    def start(self) -> 'WriteBehindLoader':
+        if self.queue_depth > 0 and self.worker_thread is None:
+            self.worker_thread = threading.Thread(target=self.work, daemon=True)
+            self.worker_thread.start()
+        return self
+
+    def raise_error(self) -> None:
+        if self.error is not None:
+            raise LoaderError(f'A write by the {self.name} loader failed: {self.error}') from self.error
+
+    def run_write(self, write: Callable[..., Any], args: Tuple[Any, ...], kwargs: Dict[str, Any]) -> None:
+        if self.error is not None:
+            # Later writes may depend on the failed one, so they are skipped
+            return
+        started_at = time.time()
+        try:
+            write(*args, **kwargs)
+        except Exception as e:
+            logger.error(f'A write by the {self.name} loader failed: {e}')
+            self.error = e
+        finally:
+            with self.lock:
+                self.num_writes += 1
+                self.load_seconds += time.time() - started_at
+
+    def work(self) -> None:
+        while True:
+            task = self.tasks.get()
+            try:
+                # None tells the worker to stop once the writes before it are done
+                if task is None:
+                    return
+                self.run_write(*task)
+            finally:
+                self.tasks.task_done()
+
+    def submit(self, write: Callable[..., Any], *args, **kwargs) -> None:
+        '''
+        Hands the loader a function that writes to the database, along with its arguments.
+        '''
+        self.raise_error()
+        if self.worker_thread is None:
+            self.run_write(write, args, kwargs)
+            self.raise_error()
+            return
+        waited_at = time.time()
+        self.tasks.put((write, args, kwargs))
+        with self.lock:
+            self.wait_seconds += time.time() - waited_at
+
+    def load(self, table_name: str, df: pd.DataFrame, **bulk_load_kwargs) -> None:
+        '''
+        Hands the loader a DataFrame whose records should be appended to the table; bulk_load_kwargs are
+        passed on to DBCreator.bulk_load. The DataFrame should not be changed afterwards.
+        '''
+        self.submit(self.db_creator_obj.bulk_load, table_name, df, **bulk_load_kwargs)
+
+    def flush(self) -> None:
+        '''
+        Waits until every write submitted so far is done.
+        '''
+        if self.worker_thread is not None:
+            self.tasks.join()
+        self.raise_error()
+
+    def stop(self) -> None:
+        if self.worker_thread is not None:
+            self.tasks.put(None)
+            self.worker_thread.join()
+            self.worker_thread = None
+
+    def close(self, record_metrics: bool = True) -> None:
+        '''
+        Waits for the submitted writes to finish and stops the worker. Unless record_metrics is False,
+        the time spent loading and the time producers waited on a full queue are recorded as job metrics.
+        '''
+        self.stop()
+        logger.info(
+            f'The {self.name} loader made {self.num_writes} writes in {self.load_seconds:.1f} seconds; '
+            f'producers waited {self.wait_seconds:.1f} seconds for it'
+        )
+        if record_metrics:
+            record_metric(f'db_loader_{self.name}_load_seconds', self.load_seconds)
+            record_metric(f'db_loader_{self.name}_wait_seconds', self.wait_seconds)
+        self.raise_error()
+
+    def __enter__(self) -> 'WriteBehindLoader':
+        return self.start()
+
+    def __exit__(self, exc_type, *args) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            # The producer's own error is the one worth raising
+            self.stop()
@@ -0,0 +1,20 @@
+#
+# file: migrations/0017.add_job_run_metric_table.py
+#
+from yoyo import step
+
+__depends__ = {'0016.remove_user_table'}
+
+step('''
+    CREATE TABLE IF NOT EXISTS job_run_metric
+    (
+        id INTEGER NOT NULL UNIQUE AUTO_INCREMENT,
+        job_run_id INTEGER NOT NULL,
+        metric_name VARCHAR(100) NOT NULL,
+        metric_value DOUBLE NOT NULL,
+        PRIMARY KEY (id),
+        FOREIGN KEY (job_run_id) REFERENCES job_run(id) ON DELETE CASCADE ON UPDATE CASCADE
+    )
+    ENGINE=InnoDB
+    CHARACTER SET utf8mb4;
+''')
@@ -0,0 +1,20 @@
+#
+# file: migrations/0018.add_course_enrollment_signal_table.py
+#
+from yoyo import step
+
+__depends__ = {'0017.add_job_run_metric_table'}
+
+step('''
+    CREATE TABLE IF NOT EXISTS course_enrollment_signal
+    (
+        course_id INTEGER NOT NULL UNIQUE,
+        total_students INTEGER NOT NULL,
+        workflow_state VARCHAR(50) NOT NULL,
+        num_enrollments INTEGER NOT NULL,
+        gathered_at DATETIME NOT NULL,
+        PRIMARY KEY (course_id)
+    )
+    ENGINE=InnoDB
+    CHARACTER SET utf8mb4;
+''')
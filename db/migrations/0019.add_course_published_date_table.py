@@ -0,0 +1,17 @@
+#
+# file: migrations/0019.add_course_published_date_table.py
+#
+from yoyo import step
+
+__depends__ = {'0018.add_course_enrollment_signal_table'}
+
+step('''
+    CREATE TABLE IF NOT EXISTS course_published_date
+    (
+        course_id INTEGER NOT NULL UNIQUE,
+        published_at DATETIME NOT NULL,
+        PRIMARY KEY (course_id)
+    )
+    ENGINE=InnoDB
+    CHARACTER SET utf8mb4;
+''')
@@ -0,0 +1,17 @@
+#
+# file: migrations/0020.add_watermark_table.py
+#
+from yoyo import step
+
+__depends__ = {'0019.add_course_published_date_table'}
+
+step('''
+    CREATE TABLE IF NOT EXISTS watermark
+    (
+        name VARCHAR(100) NOT NULL UNIQUE,
+        value DATETIME NOT NULL,
+        PRIMARY KEY (name)
+    )
+    ENGINE=InnoDB
+    CHARACTER SET utf8mb4;
+''')
@@ -0,0 +1,33 @@
+#
+# file: migrations/0021.add_canvas_course_usage_natural_key.py
+#
+from yoyo import step
+
+__depends__ = {'0020.add_watermark_table'}
+
+steps = [
+    # Remove any duplicate days, keeping the most recently inserted record
+    step('''
+        DELETE older
+        FROM canvas_course_usage older
+        INNER JOIN canvas_course_usage newer
+            ON older.course_id = newer.course_id
+            AND older.date = newer.date
+            AND older.id < newer.id;
+    '''),
+    step('''
+        ALTER TABLE canvas_course_usage
+        ADD CONSTRAINT uq_canvas_course_usage_course_id_date
+            UNIQUE (course_id, date);
+    '''),
+    step('''
+        CREATE TABLE IF NOT EXISTS canvas_course_usage_watermark
+        (
+            course_id INTEGER NOT NULL UNIQUE,
+            last_complete_date DATE NOT NULL,
+            PRIMARY KEY (course_id)
+        )
+        ENGINE=InnoDB
+        CHARACTER SET utf8mb4;
+    ''')
+]
@@ -0,0 +1,18 @@
+#
+# file: migrations/0022.add_canvas_course_usage_staging_table.py
+#
+from yoyo import step
+
+__depends__ = {'0021.add_canvas_course_usage_natural_key'}
+
+step('''
+    CREATE TABLE IF NOT EXISTS canvas_course_usage_staging
+    (
+        course_id INTEGER NOT NULL,
+        views INTEGER NOT NULL,
+        participations INTEGER NOT NULL,
+        date DATE NOT NULL
+    )
+    ENGINE=InnoDB
+    CHARACTER SET utf8mb4;
+''')
@@ -0,0 +1,18 @@
+#
+# file: migrations/0023.add_load_row_hash_table.py
+#
+from yoyo import step
+
+__depends__ = {'0022.add_canvas_course_usage_staging_table'}
+
+step('''
+    CREATE TABLE IF NOT EXISTS load_row_hash
+    (
+        table_name VARCHAR(64) NOT NULL,
+        row_key BIGINT NOT NULL,
+        row_hash BIGINT UNSIGNED NOT NULL,
+        PRIMARY KEY (table_name, row_key)
+    )
+    ENGINE=InnoDB
+    CHARACTER SET utf8mb4;
+''')
@@ -0,0 +1,29 @@
+#
+# file: migrations/0024.add_enrollment_change_table.py
+#
+from yoyo import step
+
+__depends__ = {'0023.add_load_row_hash_table'}
+
+step('''
+    CREATE TABLE IF NOT EXISTS enrollment_change
+    (
+        id BIGINT NOT NULL UNIQUE AUTO_INCREMENT,
+        job_run_id INTEGER NOT NULL,
+        change_type VARCHAR(10) NOT NULL,
+        canvas_id BIGINT NOT NULL,
+        user_id BIGINT NOT NULL,
+        course_id INTEGER NOT NULL,
+        course_section_id INTEGER NOT NULL,
+        role_type VARCHAR(25) NOT NULL,
+        workflow_state VARCHAR(25) NOT NULL,
+        previous_course_section_id INTEGER,
+        previous_role_type VARCHAR(25),
+        previous_workflow_state VARCHAR(25),
+        PRIMARY KEY (id),
+        INDEX (canvas_id),
+        FOREIGN KEY (job_run_id) REFERENCES job_run(id) ON DELETE CASCADE ON UPDATE CASCADE
+    )
+    ENGINE=InnoDB
+    CHARACTER SET utf8mb4;
+''')
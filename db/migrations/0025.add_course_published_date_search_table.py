@@ -0,0 +1,17 @@
+#
+# file: migrations/0025.add_course_published_date_search_table.py
+#
+from yoyo import step
+
+__depends__ = {'0024.add_enrollment_change_table'}
+
+step('''
+    CREATE TABLE IF NOT EXISTS course_published_date_search
+    (
+        course_id INTEGER NOT NULL UNIQUE,
+        searched_through DATETIME NOT NULL,
+        PRIMARY KEY (course_id)
+    )
+    ENGINE=InnoDB
+    CHARACTER SET utf8mb4;
+''')
@@ -0,0 +1,58 @@
+# standard libraries
+import logging, threading
+from typing import List, Tuple, Union
+
+# third-party libraries
+import pandas as pd
+
+# Initialize settings and global variables
+
+logger = logging.getLogger(__name__)
+
+METRICS: List[Tuple[str, float]] = []
+METRICS_LOCK = threading.Lock()
+
+DEFERRED_RECORDS: List[Tuple[str, pd.DataFrame]] = []
+DEFERRED_RECORDS_LOCK = threading.Lock()
+
+
+# Function(s)
+
+def record_metric(metric_name: str, metric_value: Union[int, float]) -> None:
+    '''
+    Records a named numeric value for the currently running job; run_jobs.py inserts the recorded
+    values as job_run_metric records once the job finishes.
+    '''
+    logger.debug(f'Recording metric {metric_name}: {metric_value}')
+    with METRICS_LOCK:
+        METRICS.append((metric_name, float(metric_value)))
+
+
+def pop_metrics() -> List[Tuple[str, float]]:
+    '''
+    Returns the metrics recorded so far and clears them.
+    '''
+    with METRICS_LOCK:
+        metrics = METRICS.copy()
+        METRICS.clear()
+    return metrics
+
+
+def defer_records(table_name: str, df: pd.DataFrame) -> None:
+    '''
+    Holds records for a table with a job_run_id column until the currently running job finishes;
+    run_jobs.py then inserts them with the ID of the job's job_run record.
+    '''
+    logger.debug(f'Deferring {len(df)} {table_name} records')
+    with DEFERRED_RECORDS_LOCK:
+        DEFERRED_RECORDS.append((table_name, df))
+
+
+def pop_deferred_records() -> List[Tuple[str, pd.DataFrame]]:
+    '''
+    Returns the records deferred so far, as (table name, DataFrame) pairs, and clears them.
+    '''
+    with DEFERRED_RECORDS_LOCK:
+        deferred_records = DEFERRED_RECORDS.copy()
+        DEFERRED_RECORDS.clear()
+    return deferred_records
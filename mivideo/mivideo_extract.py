@@ -6,7 +6,7 @@ import logging
 import os
 import time
 from datetime import datetime
-from typing import Dict, Iterable, Sequence, Union
+from typing import Dict, Sequence, Union
 
 import pandas as pd
 from KalturaClient import KalturaClient, KalturaConfiguration
@@ -18,12 +18,12 @@ from KalturaClient.Plugins.Core import (
 from KalturaClient.exceptions import KalturaException
 from google.cloud import bigquery
 from google.oauth2 import service_account
-from pandas.io.sql import SQLTable
-from sqlalchemy.engine import Connection, ResultProxy
+from sqlalchemy.engine import ResultProxy
 from sqlalchemy.exc import SQLAlchemyError
 
 import mivideo.queries as queries
 from db.db_creator import DBCreator
+from db.loader import WriteBehindLoader
 from environ import CONFIG_DIR, ENV
 from vocab import ValidDataSourceName
 
@@ -157,7 +157,7 @@ class MiVideoExtract:
 
             localLogger.debug('Saving to table...')
 
-            dfCourseEvents.to_sql(tableName, self.appDb.engine, if_exists='append', index=False)
+            self.appDb.bulk_load(tableName, dfCourseEvents)
 
             localLogger.debug('Saved.')
         else:
@@ -170,30 +170,6 @@ class MiVideoExtract:
             'data_updated_at': pd.to_datetime(time.time(), unit='s', utc=True)
         }
 
-    @staticmethod
-    def _queryRunner(
-            pandasTable: SQLTable,
-            dbConn: Connection,
-            columnNameList: Sequence[str],
-            data: Iterable):
-        '''
-        This handles the fairly rare occurrence of conflicting keys when
-        inserting data into a table.
-        '''
-
-        tableFullName = pandasTable.name
-        if (pandasTable.schema):
-            tableFullName = f'{pandasTable.schema}.{tableFullName}'
-        columnNames = ', '.join(columnNameList)
-        valuePlaceholders = ', '.join(['%s'] * len(columnNameList))
-
-        sql = (
-            f'INSERT INTO {tableFullName} ({columnNames}) VALUES ({valuePlaceholders}) '
-            f'ON DUPLICATE KEY UPDATE {columnNameList[0]}={columnNameList[0]}'  # magic
-        )
-
-        dbConn.execute(sql, list(data))
-
     def mediaCreation(self) -> Dict[str, Union[ValidDataSourceName, pd.Timestamp]]:
         """
         Update data with Kaltura media metadata from Kaltura API.
@@ -237,51 +213,51 @@ class MiVideoExtract:
         totalNumberResults: int = numberResults  # for logging purposes
         endOfResults = False
 
-        while not endOfResults:
-            try:
-                results = kMedia.list(kFilter, kPager).objects
-            except KalturaException as kException:
-                if (KALTURA_MAX_MATCHES_ERROR in kException.args):
-                    # set new filter timestamp, reset pager to page 1, then continue
-                    kFilter.createdAtGreaterThanOrEqual = lastCreatedAtTimestamp
-                    localLogger.debug(
-                        f'New filter timestamp: ({kFilter.createdAtGreaterThanOrEqual})')
+        # Pages are inserted by the loader's thread while the next page is requested from Kaltura
+        with WriteBehindLoader(self.appDb, 'mivideo') as loader:
+            while not endOfResults:
+                try:
+                    results = kMedia.list(kFilter, kPager).objects
+                except KalturaException as kException:
+                    if (KALTURA_MAX_MATCHES_ERROR in kException.args):
+                        # set new filter timestamp, reset pager to page 1, then continue
+                        kFilter.createdAtGreaterThanOrEqual = lastCreatedAtTimestamp
+                        localLogger.debug(
+                            f'New filter timestamp: ({kFilter.createdAtGreaterThanOrEqual})')
 
-                    # to avoid dupes, also filter out the last ID returned by previous query
-                    # because Kaltura compares createdAt greater than *or equal* to timestamp
-                    kFilter.idNotIn = lastId
-                    kPager.pageIndex = 1
-                    continue
+                        # to avoid dupes, also filter out the last ID returned by previous query
+                        # because Kaltura compares createdAt greater than *or equal* to timestamp
+                        kFilter.idNotIn = lastId
+                        kPager.pageIndex = 1
+                        continue
 
-                localLogger.info(f'Other Kaltura API error: "{kException}"')
-                break
+                    localLogger.info(f'Other Kaltura API error: "{kException}"')
+                    break
 
-            numberResults = len(results)
-            localLogger.debug(
-                f'Query page ({queryPageNumber}); number of results: ({numberResults})')
+                numberResults = len(results)
+                localLogger.debug(
+                    f'Query page ({queryPageNumber}); number of results: ({numberResults})')
 
-            if (numberResults > 0):
-                resultDictionaries: Sequence[Dict] = tuple(r.__dict__ for r in results)
+                if (numberResults > 0):
+                    resultDictionaries: Sequence[Dict] = tuple(r.__dict__ for r in results)
 
-                creationData: pd.DataFrame = self._makeCreationData(resultDictionaries)
+                    creationData: pd.DataFrame = self._makeCreationData(resultDictionaries)
 
-                creationData.to_sql(
-                    tableName, self.appDb.engine, if_exists='append', index=False)
+                    loader.load(tableName, creationData)
 
-                courseData: pd.DataFrame = self._makeCourseData(
-                    resultDictionaries, kFilter.categoriesFullNameIn)
+                    courseData: pd.DataFrame = self._makeCourseData(
+                        resultDictionaries, kFilter.categoriesFullNameIn)
 
-                courseData.to_sql('mivideo_media_courses', self.appDb.engine, if_exists='append',
-                                  index=False, method=self._queryRunner)
+                    loader.load('mivideo_media_courses', courseData, keep_existing=True)
 
-                lastCreatedAtTimestamp = results[-1].createdAt
-                lastId = results[-1].id
-                totalNumberResults += numberResults
+                    lastCreatedAtTimestamp = results[-1].createdAt
+                    lastId = results[-1].id
+                    totalNumberResults += numberResults
 
-            endOfResults = (numberResults < kPager.pageSize)
+                endOfResults = (numberResults < kPager.pageSize)
 
-            kPager.pageIndex += 1
-            queryPageNumber += 1
+                kPager.pageIndex += 1
+                queryPageNumber += 1
 
         localLogger.info(f'Total number of results: ({totalNumberResults})')
 
@@ -8,11 +8,18 @@ import re
 import time
 from typing import Dict, List, Optional, Sequence, Union
 
-import canvasapi
 import pandas as pd
-import requests
 from bs4 import BeautifulSoup as bs
-
+from canvasapi.account import Account
+from canvasapi.course import Course
+from canvasapi.requester import Requester
+from canvasapi.util import get_institution_url
+from requests import Session
+
+from api.concurrency import record_concurrency_metrics
+from api.progress import ProgressTracker
+from api.retry import get_retry_engine
+from api.transport import get_transport
 from environ import ENV, DATA_DIR
 from vocab import ValidDataSourceName
 
@@ -21,13 +28,30 @@ logger = logging.getLogger(__name__)
 CANVAS_ENV = ENV.get('CANVAS', {})
 
 
+class TransportRequester(Requester):
+    """A canvasapi Requester that sends its requests through a session from the shared transport"""
+
+    def __init__(self, base_url: str, access_token: str, session: Session):
+        super().__init__(base_url, access_token)
+        self._session = session
+
+
 class ZoomPlacements:
     zoom_courses: List[Dict] = []
     zoom_courses_meetings: List[Dict] = []
 
     def __init__(self):
-        self.zoom_session = requests.Session()
-        self.canvas = canvasapi.Canvas(CANVAS_ENV.get("CANVAS_URL"), CANVAS_ENV.get("CANVAS_TOKEN"))
+        self.progress = ProgressTracker('ZoomPlacements')
+        self.transport = get_transport()
+        # The LTI and Zoom sessions keep their own cookies (and the Zoom XSRF header) apart from the
+        # Canvas API session, but all of them share the transport's connection pools. Requests to Zoom are
+        # not governed by the Canvas concurrency controllers, breakers or rate-limit budgets.
+        self.lti_session = self.transport.new_session()
+        self.zoom_session = self.transport.new_session()
+        canvas_api_url = get_institution_url(CANVAS_ENV.get("CANVAS_URL", "")) + "/api/v1/"
+        self.requester = TransportRequester(
+            canvas_api_url, CANVAS_ENV.get("CANVAS_TOKEN", "").strip(), self.transport.session
+        )
 
     def get_zoom_json(self, **kwargs) -> Optional[Dict]:
         """Retrieves data directly from Zoom. You need to have zoom_session already setup
@@ -40,7 +64,7 @@ class ZoomPlacements:
         if not kwargs:
             # Set empty array if not set
             kwargs = {"page": 1, "lti_scid": ""}
-        logger.info(f"Paging though course on page number {kwargs.get('page')}")
+        logger.debug(f"Paging though course on page number {kwargs.get('page')}")
         # Get tab 1 (Previous Meetings)
         # Zoom needs this lti_scid now as a parameter, pull it out of the header
         kwargs.update({'total': 0,
@@ -51,6 +75,8 @@ class ZoomPlacements:
         # TODO: Specify which page we want, currently hardcoded to previous meetings
         zoom_previous_url = "https://applications.zoom.us/api/v1/lti/rich/meeting/history/COURSE/all"
         r = self.zoom_session.get(zoom_previous_url, params=kwargs)
+        self.progress.record_request(len(r.content))
+        self.progress.record_page()
         # Load in the json and look for results
         zoom_json = json.loads(r.text)
         if zoom_json and "result" in zoom_json:
@@ -115,7 +141,7 @@ class ZoomPlacements:
             logger.warn("Required script extraction not found, no details logged")
             logger.debug(r.text)
 
-    def get_zoom_course(self, course: canvasapi.course.Course) -> None:
+    def get_zoom_course(self, course: Course) -> None:
         # Get tabs and look for defined tool(s) that aren't hidden
         tabs = course.get_tabs()
         for tab in tabs:
@@ -123,9 +149,9 @@ class ZoomPlacements:
             if (tab.label == "Zoom" and not hasattr(tab, "hidden")):
                 logger.info("Found a course with zoom as %s", tab.id)
 
-                r = self.canvas._Canvas__requester.request("GET", _url=tab.url)
+                r = self.requester.request("GET", _url=tab.url)
                 external_url = r.json().get("url")
-                r = requests.get(external_url)
+                r = self.lti_session.get(external_url)
                 # Parse out the form from the response
                 soup = bs(r.text, 'html.parser')
                 # Get the form and parse out all of the inputs
@@ -153,12 +179,13 @@ class ZoomPlacements:
         add_course_ids: Union[List[int], None] = None
     ) -> None:
 
-        account = self.canvas.get_account(canvas_account)
+        # Only the account's ID is needed to list its courses, so the account itself is not fetched
+        account = Account(self.requester, {"id": canvas_account})
         # Canvas has a limit of 100 per page on this API
         per_page = 100
 
         # Get all published courses from the defined enrollment terms
-        courses: List[canvasapi.course.Course] = []
+        courses: List[Course] = []
         if enrollment_term_ids is not None:
             for enrollment_term_id in enrollment_term_ids:
                 logger.info(f'Fetching published course data for term {enrollment_term_id}')
@@ -171,20 +198,28 @@ class ZoomPlacements:
                 )
                 courses += courses_list
 
-        course_count = 0
-        for course in courses:
-            course_count += 1
-            if add_course_ids and course.id in add_course_ids:
-                add_course_ids.remove(course.id)
-            # TODO: In the future get the total count from the Paginated object
-            # Needs API support https://github.com/ucfopen/canvasapi/issues/114
-            logger.info(f"Fetching course #{course_count} for {course}")
-            self.get_zoom_course(course)
-
-        # If there are course_ids passed in, also process those
+        course_ids = [course.id for course in courses]
         if add_course_ids:
+            add_course_ids = [course_id for course_id in add_course_ids if course_id not in course_ids]
+        else:
+            add_course_ids = []
+        self.progress.total = len(courses) + len(add_course_ids)
+
+        with self.progress:
+            course_count = 0
+            for course in courses:
+                course_count += 1
+                logger.debug(f"Fetching course #{course_count} of {self.progress.total} for {course}")
+                self.progress.start_item()
+                self.get_zoom_course(course)
+                self.progress.complete_item()
+
+            # If there are course_ids passed in, also process those
             for course_id in add_course_ids:
-                self.get_zoom_course(self.canvas.get_course(course_id))
+                self.progress.start_item()
+                r = self.requester.request("GET", f"courses/{course_id}")
+                self.get_zoom_course(Course(self.requester, r.json()))
+                self.progress.complete_item()
         return None
 
 
@@ -207,6 +242,8 @@ def main() -> Sequence[Dict[str, Union[ValidDataSourceName, pd.Timestamp]]]:
 
     zoom_courses_df.to_csv(os.path.join(DATA_DIR, "zoom_courses.csv"))
     zoom_courses_meetings_df.to_csv(os.path.join(DATA_DIR, "zoom_courses_meetings.csv"))
+    record_concurrency_metrics()
+    get_retry_engine().record_metrics()
     return [{
         'data_source_name': ValidDataSourceName.CANVAS_ZOOM_MEETINGS,
         'data_updated_at': pd.to_datetime(time.time(), unit='s', utc=True)
@@ -1,5 +1,5 @@
 # standard libraries
-import logging, os, sys, time
+import argparse, logging, os, sys, time
 from importlib import import_module
 from typing import Dict, Sequence, Union
 
@@ -9,7 +9,9 @@ import sqlalchemy
 
 # local libraries
 from db.db_creator import DBCreator
+from db.loader import WriteBehindLoader
 from environ import ENV
+from job_metadata import pop_deferred_records, pop_metrics
 from vocab import ValidJobName, ValidDataSourceName
 
 
@@ -34,7 +36,7 @@ class Job:
         self.finished_at: Union[float, None] = None
         self.data_sources: Sequence[Dict[str, Union[ValidDataSourceName, pd.Timestamp]]] = []
 
-    def create_metadata(self) -> None:
+    def create_metadata(self, metadata_loader: WriteBehindLoader) -> None:
         started_at_dt = pd.to_datetime(self.started_at, unit='s')
         finished_at_dt = pd.to_datetime(self.finished_at, unit='s')
 
@@ -43,12 +45,13 @@ class Job:
             'started_at': [started_at_dt],
             'finished_at': [finished_at_dt]
         })
-        job_run_df.to_sql('job_run', db_creator_obj.engine, if_exists='append', index=False)
+        db_creator_obj.bulk_load('job_run', job_run_df)
         logger.info(
             f'Inserted job_run record for job_name "{self.name}" '
             f'with finished_at value of "{finished_at_dt}"')
         job_run_id = pd.read_sql('job_run', db_creator_obj.engine).iloc[-1]['id']
 
+        # The job_run ID is needed right away; the records referencing it are written together by the loader
         if len(self.data_sources) == 0:
             logger.warning('No valid data sources were identified')
         else:
@@ -60,10 +63,21 @@ class Job:
                 
             data_source_status_df = pd.DataFrame(db_ready_data_sources)
             data_source_status_df = data_source_status_df.assign(**{'job_run_id': job_run_id})
-            data_source_status_df.to_sql('data_source_status', db_creator_obj.engine, if_exists='append', index=False)
-            logger.info(f'Inserted {len(data_source_status_df)} data_source_status records')
+            metadata_loader.load('data_source_status', data_source_status_df)
 
-    def run(self) -> None:
+        metrics = pop_metrics()
+        if len(metrics) > 0:
+            job_run_metric_df = pd.DataFrame(metrics, columns=['metric_name', 'metric_value'])
+            job_run_metric_df = job_run_metric_df.assign(**{'job_run_id': job_run_id})
+            metadata_loader.load('job_run_metric', job_run_metric_df)
+
+        for table_name, deferred_df in pop_deferred_records():
+            metadata_loader.load(table_name, deferred_df.assign(**{'job_run_id': job_run_id}))
+
+        # Any failed write is raised here, so it is reported for this job
+        metadata_loader.flush()
+
+    def run(self, metadata_loader: WriteBehindLoader) -> None:
         leaf_module = import_module(self.import_path)
         start_method = getattr(leaf_module, self.method_name)
 
@@ -86,7 +100,7 @@ class Job:
                 logger.error(f'No data_source_status record will be inserted.')
 
         self.data_sources = valid_data_sources
-        self.create_metadata()
+        self.create_metadata(metadata_loader)
 
 
 class JobManager:
@@ -103,10 +117,25 @@ class JobManager:
     def run_jobs(self) -> None:
         for job in self.jobs:
             logger.info(f'- - Running job {job.name} - -')
-            job.run()
+            # Each job gets its own loader, so a failed write can't cause another job's writes to be skipped
+            metadata_loader = WriteBehindLoader(db_creator_obj, 'job_metadata').start()
+            try:
+                job.run(metadata_loader)
+            finally:
+                metadata_loader.stop()
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the jobs listed in JOB_NAMES.')
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Continue from the checkpoints saved by an interrupted run instead of starting over'
+    )
+    args = parser.parse_args()
+    if args.resume:
+        ENV['RESUME'] = True
+
     db_creator_obj = DBCreator(ENV['INVENTORY_DB'])
     how_started = os.environ.get('HOW_STARTED', None)
 